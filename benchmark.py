@@ -0,0 +1,93 @@
+"""
+Compares reading PDF files through buffered file objects and through memory mappings
+
+Usage: python benchmark.py [--pages N] [--files N] [--repeat N]
+"""
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List
+
+from PyPDF2 import PdfFileWriter
+from PyPDF2.generic import ArrayObject, DecodedStreamObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+
+from engine import PDFMerger, ReaderCache
+
+
+def makeDocument(path: Path, pages: int) -> Path:
+    """
+    Creates a PDF file with many small objects: every page has its own content stream and an annotation
+
+    :param path: path to where the file is to be created
+    :param pages: number of pages of the document
+    :return: path to the created file
+    """
+    writer = PdfFileWriter()
+    for i in range(pages):
+        page = writer.addBlankPage(200, 200)
+        content = DecodedStreamObject()
+        content.setData(b'0 0 m %d %d l S\n' % (i % 200, i % 150) * 20)
+        page[NameObject('/Contents')] = writer._addObject(content)
+        annotation = DictionaryObject({NameObject('/Type'): NameObject('/Annot'), NameObject('/N'): NumberObject(i)})
+        page[NameObject('/Annots')] = ArrayObject([writer._addObject(annotation)])
+    with open(path, 'wb') as f:
+        writer.write(f)
+    return path
+
+
+def resolveAll(files: List[Path], mapped: bool) -> None:
+    """
+    Parses the files and looks up all their objects in random order
+    """
+    with ReaderCache(mapped=mapped) as readers:
+        for file in files:
+            reader = readers.get(file)
+            refs = [IndirectObject(number, generation, reader)
+                    for generation, numbers in reader.xref.items() for number in numbers if number]
+            random.Random(0).shuffle(refs)
+            for ref in refs:
+                reader.getObject(ref)
+
+
+def merge(files: List[Path], mapped: bool, output: Path) -> None:
+    """
+    Merges the files the same way the application does
+    """
+    merged = PDFMerger()
+    with ReaderCache(mapped=mapped) as readers:
+        for file in files:
+            merged.append(readers.get(file))
+        merged.write(str(output))
+
+
+def measure(function: Callable[[], None], repeat: int) -> float:
+    """
+    :return: the best time of the given number of runs, in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--pages', type=int, default=5000, help='pages of every generated document')
+    parser.add_argument('--files', type=int, default=4, help='number of generated documents')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every measurement, the best one is reported')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmpDir = Path(tmp)
+        files = [makeDocument(tmpDir / f'{i}.pdf', args.pages) for i in range(args.files)]
+        size = sum(x.stat().st_size for x in files) / 2 ** 20
+        print(f'{args.files} files, {args.pages} pages ({args.pages * 3} objects) each, {size:.1f} MB in total')
+        for name, benchmark in (('object lookup', resolveAll), ('merge', merge)):
+            for mapped in (False, True):
+                arguments = (files, mapped) if benchmark is resolveAll else (files, mapped, tmpDir / 'output.pdf')
+                seconds = measure(lambda: benchmark(*arguments), args.repeat)
+                print(f'{name:<14} {"mmap" if mapped else "buffered":<9} {seconds:7.3f} s')
@@ -0,0 +1,1990 @@
+"""
+PDF processing used by the application, kept independent from the user interface
+"""
+import json
+import math
+import mmap
+import multiprocessing
+import os
+import re
+import shutil
+import struct
+import threading
+import time
+import zlib
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # not available on Windows, files are always copied there
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from hashlib import md5, sha256
+from io import BytesIO
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from PIL import Image
+from PyPDF2 import PdfFileMerger, PdfFileReader, PdfFileWriter
+from PyPDF2.generic import (ArrayObject, Bookmark, DecodedStreamObject, DictionaryObject, EncodedStreamObject,
+                            IndirectObject, NameObject, NullObject, NumberObject, StreamObject, TextStringObject)
+from PyPDF2.merger import _MergedPage
+from PyPDF2.pagerange import PageRange
+from PyPDF2.pdf import PageObject
+
+# color spaces of image XObjects which can be decoded and re-encoded without any loss of color information
+IMAGE_MODES = {'/DeviceRGB': 'RGB', '/DeviceGray': 'L'}
+
+# resource categories whose entries are used by name from the content streams
+RESOURCE_CATEGORIES = ('/ExtGState', '/ColorSpace', '/Pattern', '/Shading', '/XObject', '/Font', '/Properties')
+NAME_TOKEN = re.compile(rb'/([^\s/\[\]()<>{}%]*)')
+
+# page attributes which may be inherited from the nodes of the page tree
+INHERITABLE_ATTRIBUTES = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+PAGE_SELECTION = re.compile(r'^(?P<name>.*)\[(?P<selection>[\d\s,-]*)\]$')
+
+# formats of the images which can be converted, with markers their images end with (None if there is no such), the
+# files may go on after them (e.g. with the video of a motion photo)
+IMAGE_FORMATS = {'PNG': b'IEND', 'JPEG': b'\xff\xd9', 'TIFF': None}
+# a JPEG marker, i.e. 0xFF followed by anything but a stuffed zero, a restart marker or another fill byte
+JPEG_MARKER = re.compile(rb'\xff[^\x00\xd0-\xd7\xff]')
+STARTXREF = re.compile(rb'startxref\s+(\d+)\s+%%EOF')
+XREF_START = re.compile(rb'\s*(xref|\d+\s+\d+\s+obj)')
+XREF_SUBSECTION = re.compile(rb'\s*(\d+)[ \t]+(\d+)[ \t]*(\r\n|\r|\n)')
+TAIL_SIZE = 2048  # number of bytes at the end of a file searched for end markers
+FICLONE = 0x40049409  # Linux ioctl making a file share the data of another one (reflink), e.g. on Btrfs and XFS
+DIGITS = re.compile(r'(\d+)')
+# EXIF tags of the time a photo was taken, and of the time it was last changed (used if the first one is missing)
+EXIF_IFD, DATE_TIME_ORIGINAL, DATE_TIME = 0x8769, 36867, 306
+
+# changed whenever the same job would produce a different output, so the results cached earlier are not reused
+FINGERPRINT_VERSION = 2
+
+
+def downsampleImage(data: bytes, filtr: str, size: Tuple[int, int], mode: str, scale: float) -> Optional[bytes]:
+    """
+    Decodes an image XObject's data, resizes it and encodes it back with the same filter
+
+    :param data: raw (encoded) data of the image stream
+    :param filtr: filter of the image stream, either /DCTDecode or /FlateDecode
+    :param size: width and height of the image in pixels
+    :param mode: PIL mode of the image
+    :param scale: factor by which both image dimensions are to be multiplied
+    :return: encoded data of the downsampled image, or None if it could not be decoded or made smaller
+    """
+    newSize = (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+    try:
+        if filtr == '/DCTDecode':
+            img = Image.open(BytesIO(data))
+            img.draft(mode, newSize)  # lets the JPEG decoder skip the detail which would be thrown away anyway
+        else:
+            img = Image.frombytes(mode, size, zlib.decompress(data))
+        img = img.convert(mode).resize(newSize, Image.LANCZOS)
+    except Exception:
+        return None  # a damaged image is kept as it is, as viewers may still show it
+    if filtr == '/DCTDecode':
+        output = BytesIO()
+        img.save(output, 'JPEG', quality=85, optimize=True)
+        encoded = output.getvalue()
+    else:
+        encoded = zlib.compress(img.tobytes())
+    return encoded if len(encoded) < len(data) else None
+
+
+def parsePageSelection(text: str) -> Tuple[str, Optional[List[Tuple[int, Optional[int]]]]]:
+    """
+    Splits a list entry such as 'report.pdf[1-2,5,7-]' into the file name and the selected page ranges
+
+    :param text: text of the list entry
+    :return: file name and list of (first, last) page numbers (counted from 1, last is None if the range is open),
+    the list is None if no pages are selected
+    """
+    match = PAGE_SELECTION.match(text.strip())
+    if not match:
+        return text.strip(), None
+    ranges = []
+    for part in match.group('selection').split(','):
+        bounds = [x.strip() for x in part.split('-')]
+        if len(bounds) > 2 or not bounds[0].isdigit() or (len(bounds) == 2 and bounds[1] and not bounds[1].isdigit()):
+            raise ValueError(f'Invalid page range: {part.strip()}')
+        first = int(bounds[0])
+        last = first if len(bounds) == 1 else (int(bounds[1]) if bounds[1] else None)
+        if first < 1 or (last is not None and last < 1):
+            raise ValueError(f'Invalid page range: {part.strip()}')
+        ranges.append((first, last))
+    return match.group('name').strip(), ranges
+
+
+def resolvePageSelection(selection: List[Tuple[int, Optional[int]]], pageCount: int) -> List[int]:
+    """
+    :param selection: page ranges returned by parsePageSelection
+    :param pageCount: number of pages of the document
+    :return: indices (counted from 0) of the selected pages, in the order they were given
+    """
+    indices = []
+    for first, last in selection:
+        last = pageCount if last is None else last
+        if max(first, last) > pageCount:
+            raise ValueError(f'Page {max(first, last)} is out of range, the document has {pageCount} pages')
+        step = 1 if last >= first else -1
+        indices.extend(range(first - 1, last - 1 + step, step))
+    return indices
+
+
+def pageCount(reader: PdfFileReader) -> int:
+    """
+    :param reader: reader of the document
+    :return: number of pages of the document, read from the root of the page tree without loading the pages
+    """
+    return int(reader.trailer['/Root']['/Pages']['/Count'])
+
+
+def getPage(reader: PdfFileReader, index: int) -> PageObject:
+    """
+    Finds a page by descending the page tree straight to it, unlike PdfFileReader.getPage which loads all the pages
+    of the document first. Only the nodes on the way and their direct children are read.
+
+    :param reader: reader of the document
+    :param index: index of the page (counted from 0)
+    :return: the page, with the inherited attributes copied into it
+    """
+    node = reader.trailer['/Root']['/Pages']
+    inherited = {}
+    while True:
+        inherited.update({x: node.raw_get(x) for x in INHERITABLE_ATTRIBUTES if x in node})
+        for ref in node['/Kids']:
+            kid = ref.getObject()
+            isNode = kid.get('/Type') == '/Pages' or '/Kids' in kid
+            count = int(kid['/Count']) if isNode else 1
+            if index < count:
+                break
+            index -= count
+        else:
+            raise IndexError('page index out of range')
+        if isNode:
+            node = kid
+            continue
+        page = PageObject(reader, ref)
+        page.update({NameObject(x): value for x, value in inherited.items()})
+        page.update(kid)
+        return page
+
+
+def isPage(obj) -> bool:
+    """
+    :param obj: resolved object
+    :return: True if the object is a page (a leaf of the page tree)
+    """
+    return isinstance(obj, DictionaryObject) and obj.get('/Type') == '/Page'
+
+
+def walkPageTree(reader: PdfFileReader) -> List[Tuple[IndirectObject, Dict[str, object]]]:
+    """
+    Walks the whole page tree once, unlike PdfFileReader.getPage it does not copy anything into the pages
+
+    :param reader: reader of the document
+    :return: reference to every page, in the order of the pages, with the attributes the page inherits from the nodes
+    above it (values are not resolved)
+    """
+    pages = []
+    pending = [(reader.trailer['/Root'].raw_get('/Pages'), {})]
+    while pending:
+        ref, inherited = pending.pop()
+        node = ref.getObject()
+        if node.get('/Type') == '/Pages' or '/Kids' in node:
+            inherited = dict(inherited, **{x: node.raw_get(x) for x in INHERITABLE_ATTRIBUTES if x in node})
+            pending.extend((kid, inherited) for kid in reversed(node['/Kids']))
+        else:
+            pages.append((ref, inherited))
+    return pages
+
+
+def rebind(value, reader: Optional[PdfFileReader]):
+    """
+    :param value: object which may contain references to objects of another reader of the same file
+    :param reader: reader the references are to be bound to, None detaches them from any reader
+    :return: copy of the object referring to the objects of the given reader instead
+    """
+    if isinstance(value, IndirectObject):
+        return IndirectObject(value.idnum, value.generation, reader)
+    if isinstance(value, DictionaryObject) and not isinstance(value, StreamObject):
+        return DictionaryObject({key: rebind(item, reader) for key, item in value.items()})
+    if isinstance(value, ArrayObject):
+        return ArrayObject(rebind(x, reader) for x in value)
+    return value
+
+
+def splitPDF(path: Path, outputPath: Path, pagesPerPart: int = 1, workers: Optional[int] = None,
+             interrupt: Callable[[], None] = lambda: None,
+             progress: Callable[[float], None] = lambda fraction: None) -> List[Path]:
+    """
+    Splits the document into parts of the given number of pages (see partPath for their names). The page tree is
+    walked once, then the parts are written concurrently, each with only the objects its pages refer to. Parsing and
+    serializing the objects holds the GIL, so the parts are written by processes, every one with its own reader.
+
+    :param path: path to the PDF file
+    :param outputPath: path to the whole output, the parts are named after it
+    :param pagesPerPart: number of pages of each part (the last one may have less)
+    :param workers: maximal number of processes, None lets the executor decide
+    :param interrupt: called before each batch of parts is started, it may raise an exception to stop the split
+    :param progress: called with the fraction (0-1) of the parts written
+    :return: paths to the written parts, none are left behind if the split fails
+    """
+    with ReaderCache() as readers:
+        # references are detached from the reader, so they can be sent to the processes
+        pages = [(ref.idnum, ref.generation, {x: rebind(value, None) for x, value in inherited.items()})
+                 for ref, inherited in walkPageTree(readers.get(path))]
+    chunks = [(number, pages[i:i + pagesPerPart])
+              for number, i in enumerate(range(0, len(pages), pagesPerPart), start=1)]
+    if not chunks:
+        return []
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+    if workers == 1:
+        return writeParts(path, outputPath, chunks, interrupt, lambda done: progress(done / len(chunks)))
+    # every process gets a few batches of neighbouring parts, so it reads the file only a few times
+    batchSize = max(1, math.ceil(len(chunks) / (workers * 4)))
+    batches = [chunks[i:i + batchSize] for i in range(0, len(chunks), batchSize)]
+    # the processes are spawned, a forked copy of a process running other threads may wait for a lock held by them
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = []
+        try:
+            # a batch is submitted only when a process is free, so a paused or cancelled split stops within a batch
+            while True:
+                running = [x for x in futures if not x.done()]
+                if len(futures) < len(batches) and len(running) < workers:
+                    interrupt()
+                    futures.append(executor.submit(writeParts, path, outputPath, batches[len(futures)]))
+                elif running:
+                    finished = wait(running, return_when=FIRST_COMPLETED)[0]
+                    for future in finished:
+                        future.result()  # a failed batch stops the split at once
+                    progress(sum(len(x) for x, future in zip(batches, futures) if future.done()) / len(chunks))
+                    interrupt()
+                else:
+                    break
+            return [x for future in futures for x in future.result()]
+        except BaseException:
+            # the parts written by the other processes are removed as well, once they finished
+            for future in futures:
+                future.cancel()
+            for future in futures:
+                if not future.cancelled() and future.exception() is None:
+                    for x in future.result():
+                        x.unlink(missing_ok=True)
+            raise
+
+
+def writeParts(path: Path, outputPath: Path, chunks: List[Tuple[int, list]],
+               interrupt: Callable[[], None] = lambda: None,
+               progress: Callable[[int], None] = lambda done: None) -> List[Path]:
+    """
+    Writes the parts of a split document, used by splitPDF
+
+    :param path: path to the PDF file
+    :param outputPath: path to the whole output, the parts are named after it
+    :param chunks: numbers of the parts with their pages, given as numbers and generations of their objects
+    and the attributes they inherit (see walkPageTree)
+    :param interrupt: called before each part is written, it may raise an exception to stop the writing
+    :param progress: called with the number of the parts written so far
+    :return: paths to the written parts
+    """
+    paths = []
+    try:
+        with ReaderCache() as readers:
+            reader = readers.get(path)
+            for i, (number, chunk) in enumerate(chunks, start=1):
+                interrupt()
+                with SplitWriter(outputPath, firstPart=number) as writer:
+                    for idnum, generation, inherited in chunk:
+                        ref = IndirectObject(idnum, generation, reader)
+                        page = PageObject(reader, ref)
+                        page.update({NameObject(x): rebind(value, reader) for x, value in inherited.items()})
+                        page.update(ref.getObject())
+                        writer.addPage(page)
+                paths.extend(writer.paths)
+                progress(i)
+    except BaseException:
+        for x in paths:  # the writer removed the parts of the failed chunk itself
+            x.unlink(missing_ok=True)
+        raise
+    return paths
+
+
+def validateFile(path: Path) -> Optional[str]:
+    """
+    Quickly checks whether the file can be converted or merged, without parsing it. Images' headers are read and their
+    end markers are looked for (see findImageEnd); PDF files' headers, cross-reference offsets and encryption are
+    checked.
+
+    :param path: path to the file
+    :return: description of the problem, None if no problem was found
+    """
+    try:
+        size = path.stat().st_size
+        with open(path, 'rb') as f:
+            head = f.read(1024)
+            f.seek(max(0, size - TAIL_SIZE))
+            tail = f.read()
+            if path.suffix.lower() != '.pdf':
+                try:
+                    with Image.open(f) as img:
+                        imageFormat = img.format
+                except (IOError, SyntaxError):
+                    return 'not a supported image'
+                if imageFormat not in IMAGE_FORMATS:
+                    return 'not a supported image'
+                if IMAGE_FORMATS[imageFormat]:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                        if findImageEnd(data, imageFormat) is None:
+                            return 'damaged image (file is truncated)'
+                return None
+
+            if b'%PDF-' not in head:
+                return 'not a PDF file'
+            match = None
+            for match in STARTXREF.finditer(tail):
+                pass  # the last marker is the one that counts
+            if match is None:
+                return 'damaged PDF file (end of file marker is missing)'
+            offset = int(match.group(1))
+            f.seek(offset)
+            chunk = f.read(4096)
+            xref = XREF_START.match(chunk)
+            if offset >= size or not xref:
+                return 'damaged PDF file (cross-reference offset is invalid)'
+            if xref.group(1) == b'xref':
+                # a cross-reference table is followed by the trailer, its entries have fixed size so they are skipped
+                position = offset + xref.end()
+                while True:
+                    f.seek(position)
+                    subsection = XREF_SUBSECTION.match(f.read(64))
+                    if not subsection:
+                        break
+                    position += subsection.end() + int(subsection.group(2)) * 20
+                f.seek(position)
+                chunk = f.read(4096)
+            # the trailer (or the dictionary of a cross-reference stream) tells whether the document is encrypted
+            if b'/Encrypt' in chunk.split(b'startxref')[0].split(b'stream')[0]:
+                return 'PDF file is encrypted'
+    except OSError as e:
+        return f'file cannot be read ({e.strerror or e})'
+    return None
+
+
+def findImageEnd(data, imageFormat: str) -> Optional[int]:
+    """
+    Finds the end marker of the image by walking its chunks or segments, so the data appended after the image (e.g.
+    the video of a motion photo) is not searched and the markers inside it (e.g. of an embedded thumbnail) are skipped
+
+    :param data: content of the file, e.g. memory-mapped
+    :param imageFormat: 'PNG' or 'JPEG'
+    :return: offset of the end of the marker, None if the image is truncated
+    """
+    if imageFormat == 'PNG':
+        position = 8  # after the signature, every chunk has its length, type, data and checksum
+        while position + 8 <= len(data):
+            length, chunkType = struct.unpack_from('>I4s', data, position)
+            position += 12 + length
+            if chunkType == b'IEND':
+                return position if position <= len(data) else None
+        return None
+    position = 2  # after the start of image marker
+    while True:
+        # the entropy-coded data following a start of scan segment is skipped up to the next marker
+        match = JPEG_MARKER.search(data, position)
+        if not match:
+            return None
+        marker = data[match.end() - 1]
+        if marker == 0xD9:
+            return match.end()
+        position = match.end()
+        if marker not in (0x01, 0xD8):  # the other markers are followed by the length of their segment
+            if position + 2 > len(data):
+                return None
+            position += struct.unpack_from('>H', data, position)[0]
+
+
+def scanFiles(paths: List[Path], extensions: Set[str], batchSize: int = 500, interval: float = 0.2,
+              interrupt: Callable[[], None] = lambda: None) -> Iterator[List[Path]]:
+    """
+    Finds the files with given extensions among the paths, folders are searched recursively. Every folder is read
+    with a single os.scandir, which also tells files from folders without further system calls. The files are found
+    in the order of their names, the folders' ones after the files lying next to them.
+
+    :param paths: paths to files and folders
+    :param extensions: lower-case extensions of the files to be found (e.g. '.pdf')
+    :param batchSize: maximal number of files in a batch
+    :param interval: seconds after which the files found so far are yielded even if the batch is not full
+    :param interrupt: called before each folder is read, it may raise an exception to stop the search
+    :return: batches of paths to the found files
+    """
+    batch = []
+    lastYield = time.monotonic()
+    stack = [Path(x) for x in reversed(paths)]  # paths still to be searched, the next one last
+    while stack:
+        path = stack.pop()
+        if not path.is_dir():
+            if path.suffix.lower() in extensions:
+                batch.append(path)
+        else:
+            interrupt()
+            try:
+                with os.scandir(path) as it:
+                    entries = sorted(it, key=lambda x: x.name.lower())
+            except OSError:
+                continue  # folders which cannot be read are skipped, as the file dialog does
+            folders = []
+            for entry in entries:
+                try:
+                    # links to folders are not followed, they might lead to a loop
+                    if entry.is_dir(follow_symlinks=False):
+                        folders.append(Path(entry.path))
+                    elif os.path.splitext(entry.name)[1].lower() in extensions and entry.is_file():
+                        batch.append(Path(entry.path))
+                except OSError:
+                    continue
+            stack.extend(reversed(folders))
+        while len(batch) >= batchSize:
+            yield batch[:batchSize]
+            del batch[:batchSize]
+            lastYield = time.monotonic()
+        if batch and time.monotonic() - lastYield >= interval:
+            yield batch
+            batch = []
+            lastYield = time.monotonic()
+    if batch:
+        yield batch
+
+
+def validateFiles(paths: List[Path], workers: Optional[int] = None) -> Dict[Path, str]:
+    """
+    Checks all the files in parallel, each distinct file only once
+
+    :param paths: paths to the files
+    :param workers: maximal number of threads, None lets the executor decide
+    :return: dictionary of paths to the invalid files and descriptions of their problems, in the order of the files
+    """
+    paths = list(dict.fromkeys(paths))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        problems = executor.map(validateFile, paths)
+    return {path: problem for path, problem in zip(paths, problems) if problem}
+
+
+def naturalKey(name: str) -> list:
+    """
+    :param name: name of a file
+    :return: key ordering the names as people do, numbers by their values (e.g. 'scan2.png' before 'scan10.png')
+    """
+    # splitting by a captured group alternates text and numbers, so the parts of any two keys compare with their likes
+    return [int(x) if i % 2 else x for i, x in enumerate(DIGITS.split(name.casefold()))]
+
+
+class FileInfo(NamedTuple):
+    """
+    Metadata the files can be sorted by
+    """
+    size: int
+    modified: float  # time of the last modification
+    taken: Optional[str]  # time the photo was taken, from its EXIF data ('YYYY:MM:DD HH:MM:SS'), None if unknown
+    pages: int  # number of pages, 1 for images and 0 if the file cannot be read
+
+
+def readFileInfo(path: Path) -> FileInfo:
+    """
+    :param path: path to the file
+    :return: metadata of the file, what cannot be read is left unknown
+    """
+    try:
+        stat = path.stat()
+    except OSError:
+        return FileInfo(0, 0, None, 0)
+    taken, pages = None, 0
+    try:
+        if path.suffix.lower() == '.pdf':
+            with open(path, 'rb') as f:
+                pages = pageCount(PdfFileReader(f, strict=False))
+        else:
+            with Image.open(path) as img:
+                exif = img.getexif()
+                taken = exif.get_ifd(EXIF_IFD).get(DATE_TIME_ORIGINAL) or exif.get(DATE_TIME)
+                taken = str(taken).strip('\x00 ') if taken else None
+                pages = 1
+    except Exception:
+        pass  # the damaged file is reported when the job is started
+    return FileInfo(stat.st_size, stat.st_mtime, taken or None, pages)
+
+
+def readFilesInfo(paths: List[Path], workers: Optional[int] = None) -> Dict[Path, FileInfo]:
+    """
+    Reads the metadata of all the files in parallel, each distinct file only once
+
+    :param paths: paths to the files
+    :param workers: maximal number of threads, None lets the executor decide
+    :return: dictionary of paths to the files and their metadata
+    """
+    paths = list(dict.fromkeys(paths))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(paths, executor.map(readFileInfo, paths)))
+
+
+def loadImage(path: Path, maxDimension: Optional[int] = None) -> Image.Image:
+    """
+    Loads an image and converts it to RGB, the form in which it is placed on a PDF page
+
+    :param path: path to the image
+    :param maxDimension: images with bigger width or height are resized to it, None keeps the original size
+    :return: the converted image
+    """
+    with Image.open(path) as img:
+        if maxDimension and (img.size[0] > maxDimension or img.size[1] > maxDimension):
+            # resize image while maintaining the aspect ratio
+            ratio = img.size[0] / img.size[1]
+            if ratio > 1:
+                newSize = (maxDimension, round(maxDimension / ratio))
+            else:
+                newSize = (round(maxDimension * ratio), maxDimension)
+            img = img.resize(newSize, Image.LANCZOS)
+        mask = img.split()[3] if img.mode == 'RGBA' else None  # dealing with transparency in RGBA images
+        converted = Image.new('RGB', img.size, (255, 255, 255))
+        converted.paste(img, mask=mask)
+    return converted
+
+
+def encodeImage(img: Image.Image) -> bytes:
+    """
+    :param img: RGB image
+    :return: the image encoded as JPEG, the form in which it is placed on a PDF page
+    """
+    data = BytesIO()
+    img.save(data, 'JPEG', optimize=True)
+    return data.getvalue()
+
+
+def makeThumbnail(path: Path, size: int, page: int = 0) -> Optional[bytes]:
+    """
+    Makes a thumbnail of an image, or of a PDF page which shows a JPEG image (as scanned pages do). PDF pages are not
+    rendered, the biggest JPEG image placed on the page stands for it.
+
+    :param path: path to the image or PDF file
+    :param size: maximal width and height of the thumbnail
+    :param page: index of the PDF file's page (counted from 0)
+    :return: the thumbnail encoded as PNG, None if there is nothing to show
+    """
+    if Path(path).suffix.lower() == '.pdf':
+        with open(path, 'rb') as f:
+            pageObject = getPage(PdfFileReader(f, strict=False), page)
+            images = [x.getObject() for x in PDFMerger._xObjects(pageObject).values()]
+            jpegs = [x for x in images
+                     if x.get('/Subtype') == '/Image' and x.get('/Filter') in ('/DCTDecode', ['/DCTDecode'])]
+            if not jpegs:
+                return None
+            source = BytesIO(max(jpegs, key=lambda x: x['/Width'] * x['/Height'])._data)
+    else:
+        source = path
+    with Image.open(source) as img:
+        img.draft('RGB', (size, size))  # lets the JPEG decoder skip the detail which would be thrown away anyway
+        img.thumbnail((size, size))
+        output = BytesIO()
+        img.convert('RGBA').save(output, 'PNG')
+    return output.getvalue()
+
+
+def imagePage(img: Image.Image) -> PageObject:
+    """
+    Creates a page showing the image, the same way Pillow does when saving images as PDF: the image is JPEG-encoded
+    and the page has the size of the image at 72 dpi
+
+    :param img: RGB image
+    :return: the page, its objects are direct and become indirect when the page is written
+    """
+    return jpegPage(encodeImage(img))
+
+
+def jpegPage(data: bytes) -> PageObject:
+    """
+    Creates a page showing an already encoded image, the size of the page is read from the JPEG header
+
+    :param data: RGB image encoded as JPEG, e.g. returned by encodeImage
+    :return: the page, its objects are direct and become indirect when the page is written
+    """
+    with Image.open(BytesIO(data)) as img:
+        width, height = img.size
+    image = EncodedStreamObject()
+    image.update({
+        NameObject('/Type'): NameObject('/XObject'),
+        NameObject('/Subtype'): NameObject('/Image'),
+        NameObject('/Width'): NumberObject(width),
+        NameObject('/Height'): NumberObject(height),
+        NameObject('/ColorSpace'): NameObject('/DeviceRGB'),
+        NameObject('/BitsPerComponent'): NumberObject(8),
+        NameObject('/Filter'): NameObject('/DCTDecode'),
+    })
+    image._data = data
+    contents = DecodedStreamObject()
+    contents.setData(b'q %d 0 0 %d 0 0 cm /image Do Q' % (width, height))
+
+    page = PageObject()
+    page.update({
+        NameObject('/Type'): NameObject('/Page'),
+        NameObject('/MediaBox'): ArrayObject([NumberObject(0), NumberObject(0),
+                                              NumberObject(width), NumberObject(height)]),
+        NameObject('/Resources'): DictionaryObject({
+            NameObject('/ProcSet'): ArrayObject([NameObject('/PDF'), NameObject('/ImageC')]),
+            NameObject('/XObject'): DictionaryObject({NameObject('/image'): image}),
+        }),
+        NameObject('/Contents'): contents,
+    })
+    return page
+
+
+def pruneResources(page: PageObject) -> None:
+    """
+    Drops the entries of the page's resources which are not used by any of its content streams, nor by the streams of
+    its form XObjects and Type 3 fonts which have no resources of their own. Shared resource dictionaries are never
+    modified, the page gets its own copy when there is anything to drop.
+
+    :param page: page whose resources are to be pruned
+    """
+    resources = page.get('/Resources')
+    if resources is None or '/Contents' not in page:
+        return
+    resources = resources.getObject()
+    xObjects, fonts = (resources[x] if x in resources else {} for x in ('/XObject', '/Font'))
+    used = set()
+    streams = list(PDFMerger._contentStreams(page))
+    while streams:
+        try:
+            data = b''.join(x.getData() for x in streams)
+        except Exception:
+            return  # streams which cannot be decoded are left as they are
+        names = set(NAME_TOKEN.findall(data))
+        if any(b'#' in x or not x.isascii() for x in names):
+            return  # names with escaped characters would need to be normalized first, such pages are left as they are
+        names = {'/' + x.decode('ascii') for x in names} - used
+        used |= names
+        # form XObjects and Type 3 fonts without resources of their own use the page's ones, so the names used by
+        # their streams are kept as well
+        streams = []
+        for name in names:
+            for entry in (xObjects.get(name), fonts.get(name)):
+                entry = entry.getObject() if entry is not None else None
+                if not isinstance(entry, DictionaryObject) or '/Resources' in entry:
+                    continue
+                if entry.get('/Subtype') == '/Form' and isinstance(entry, StreamObject):
+                    streams.append(entry)
+                elif entry.get('/Subtype') == '/Type3' and '/CharProcs' in entry:
+                    streams.extend(x.getObject() for x in entry['/CharProcs'].values())
+
+    pruned = DictionaryObject(resources)
+    for category in RESOURCE_CATEGORIES:
+        entries = resources.get(category)
+        if entries is None:
+            continue
+        entries = entries.getObject()
+        kept = {name: value for name, value in entries.items() if name in used}
+        if len(kept) < len(entries):
+            pruned[NameObject(category)] = DictionaryObject(kept)
+    if any(pruned[x] is not resources[x] for x in pruned):
+        page[NameObject('/Resources')] = pruned
+
+
+class PDFWriter(PdfFileWriter):
+    """
+    PdfFileWriter which writes only the objects reachable from the trailer. Objects of the source documents are copied
+    in a single pass without the quadratic bookkeeping of PdfFileWriter.
+    """
+    interrupt = None  # called before each object is written, it may raise an exception to stop the writing
+    progress = None  # called with the fraction (0-1) of the objects written
+
+    def getReference(self, obj) -> IndirectObject:
+        # objects are usually looked up right after being added, and equal copies of a page must not be confused
+        for i in range(len(self._objects) - 1, -1, -1):
+            if self._objects[i] is obj:
+                return IndirectObject(i + 1, 0, self)
+        raise ValueError('object is not a part of this document')
+
+    def write(self, stream) -> None:
+        if not self._root:
+            self._root = self._addObject(self._root_object)
+        self.collectGarbage()
+
+        objectPositions = []
+        stream.write(self._header + b'\n')
+        for number, obj in enumerate(self._objects, start=1):
+            if self.interrupt:
+                self.interrupt()
+            objectPositions.append(stream.tell())
+            stream.write(b'%d 0 obj\n' % number)
+            key = None
+            if hasattr(self, '_encrypt') and number != self._encrypt.idnum:
+                key = self._encrypt_key + struct.pack('<i', number)[:3] + struct.pack('<i', 0)[:2]
+                key = md5(key).digest()[:min(16, len(self._encrypt_key) + 5)]
+            obj.writeToStream(stream, key)
+            stream.write(b'\nendobj\n')
+            if self.progress:
+                self.progress(number / len(self._objects))
+
+        xrefPosition = stream.tell()
+        stream.write(b'xref\n0 %d\n%010d %05d f \n' % (len(self._objects) + 1, 0, 65535))
+        for position in objectPositions:
+            stream.write(b'%010d %05d n \n' % (position, 0))
+        stream.write(b'trailer\n')
+        self._trailer().writeToStream(stream, None)
+        stream.write(b'\nstartxref\n%d\n%%%%EOF\n' % xrefPosition)
+
+    def collectGarbage(self) -> None:
+        """
+        Copies the objects referenced from other documents into this one, then drops every object which cannot be
+        reached from the trailer and renumbers the remaining ones
+        """
+        # pages remember their original references, so the objects pointing back at them (e.g. annotations)
+        # are redirected to the pages of this document instead of copying them once more
+        copied = {}  # (source document, generation, number) -> reference in this document
+        for number, obj in enumerate(self._objects, start=1):
+            if isinstance(obj, PageObject) and obj.indirectRef is not None:
+                ref = obj.indirectRef
+                copied[(ref.pdf, ref.generation, ref.idnum)] = IndirectObject(number, 0, self)
+
+        reached = set()
+        pending = []
+
+        def sweep(value):
+            if isinstance(value, IndirectObject):
+                if value.pdf is not self:
+                    key = (value.pdf, value.generation, value.idnum)
+                    if key not in copied:
+                        try:
+                            obj = value.pdf.getObject(value)
+                        except ValueError:
+                            obj = None
+                        if isPage(obj):
+                            obj = None  # a page left out (e.g. a link's target) would bring its whole document along
+                        copied[key] = self._addObject(obj if obj is not None else NullObject())
+                    value = copied[key]
+                if value.idnum not in reached:
+                    reached.add(value.idnum)
+                    pending.append(value.idnum)
+                return value
+            if isinstance(value, (DictionaryObject, ArrayObject)):
+                items = value.items() if isinstance(value, DictionaryObject) else enumerate(value)
+                for key, item in list(items):
+                    item = sweep(item)
+                    if isinstance(item, StreamObject):
+                        # streams must be indirect objects
+                        item = sweep(self._addObject(item))
+                    value[key] = item
+            return value
+
+        for ref in self._trailer().values():
+            sweep(ref)
+        while pending:
+            sweep(self._objects[pending.pop() - 1])
+        if len(reached) == len(self._objects):
+            return
+
+        numbers = {old: new for new, old in enumerate(sorted(reached), start=1)}
+        renumbered = set()  # ids of the containers already renumbered, direct objects may be shared
+
+        def renumber(value):
+            if isinstance(value, IndirectObject):
+                return IndirectObject(numbers[value.idnum], 0, self)
+            if isinstance(value, (DictionaryObject, ArrayObject)) and id(value) not in renumbered:
+                renumbered.add(id(value))
+                items = value.items() if isinstance(value, DictionaryObject) else enumerate(value)
+                for key, item in list(items):
+                    value[key] = renumber(item)
+            return value
+
+        self._objects = [renumber(self._objects[old - 1]) for old in sorted(reached)]
+        for name in ('_pages', '_info', '_root', '_encrypt'):
+            if hasattr(self, name):
+                setattr(self, name, renumber(getattr(self, name)))
+
+    def _trailer(self) -> DictionaryObject:
+        """
+        :return: trailer dictionary of the document
+        """
+        trailer = DictionaryObject({
+            NameObject('/Size'): NumberObject(len(self._objects) + 1),
+            NameObject('/Root'): self._root,
+            NameObject('/Info'): self._info,
+        })
+        if hasattr(self, '_ID'):
+            trailer[NameObject('/ID')] = self._ID
+        if hasattr(self, '_encrypt'):
+            trailer[NameObject('/Encrypt')] = self._encrypt
+        return trailer
+
+
+class IncrementalUpdate:
+    """
+    Appends pages to an existing PDF file as an incremental update: the new objects, a new version of the root of the
+    page tree and a cross-reference section for them are written after the end of the file. The existing bytes are
+    never rewritten, so the cost of an update depends only on the appended pages.
+    """
+    def __init__(self, path: Path):
+        """
+        :param path: path to the existing PDF file
+        """
+        self.path = Path(path)
+        self.file = open(self.path, 'rb')
+        self.base = PdfFileReader(self.file)
+        if '/Encrypt' in self.base.trailer:
+            self.file.close()
+            raise ValueError('encrypted files cannot be appended to')
+        self.pagesRef = self.base.trailer['/Root'].raw_get('/Pages')
+        self.objects = {}  # number of a new object -> the object
+        self.copied = {}  # (source document, generation, number) -> reference to the copy in the update
+        # PyPDF2 keeps no /Size of a cross-reference stream, the highest number of an existing object tells it then
+        numbers = [x for entries in self.base.xref.values() for x in entries] + list(self.base.xref_objStm)
+        self.nextNumber = max([int(self.base.trailer.get('/Size', 0))] + [x + 1 for x in numbers])
+        self.kids = []  # references to the appended pages
+
+    def addPage(self, page: PageObject) -> None:
+        """
+        :param page: page to be appended, usually acquired from another document
+        """
+        copy = DictionaryObject(page)
+        copy[NameObject('/Parent')] = self.pagesRef
+        ref = self._addObject(copy)
+        if getattr(page, 'indirectRef', None) is not None:
+            # objects pointing back at the page (e.g. annotations) are redirected to its copy
+            self.copied[(page.indirectRef.pdf, page.indirectRef.generation, page.indirectRef.idnum)] = ref
+        self.kids.append(ref)
+
+    def write(self, progress: Optional[Callable[[float], None]] = None,
+              interrupt: Optional[Callable[[], None]] = None) -> None:
+        """
+        Copies everything the appended pages refer to and writes the update at the end of the file
+
+        :param progress: called with the fraction (0-1) of the objects written
+        :param interrupt: called before each object is written, it may raise an exception to stop the writing (the
+        bytes written so far are left at the end of the file)
+        """
+        pending = list(self.objects)
+        swept = set(pending)
+
+        def sweep(value):
+            if isinstance(value, IndirectObject):
+                if value.pdf is self.base:
+                    return value  # objects of the existing file stay where they are
+                if value.pdf is not self:
+                    key = (value.pdf, value.generation, value.idnum)
+                    if key not in self.copied:
+                        obj = value.pdf.getObject(value)
+                        if isPage(obj):
+                            obj = None  # a page left out (e.g. a link's target) would bring its whole document along
+                        self.copied[key] = self._addObject(obj if obj is not None else NullObject())
+                    value = self.copied[key]
+                if value.idnum not in swept:
+                    swept.add(value.idnum)
+                    pending.append(value.idnum)
+                return value
+            if isinstance(value, (DictionaryObject, ArrayObject)):
+                items = value.items() if isinstance(value, DictionaryObject) else enumerate(value)
+                for key, item in list(items):
+                    item = sweep(item)
+                    if isinstance(item, StreamObject):
+                        # streams must be indirect objects
+                        item = sweep(self._addObject(item))
+                    value[key] = item
+            return value
+
+        while pending:
+            sweep(self.objects[pending.pop()])
+
+        # new version of the page tree's root, written under its old number
+        pagesNode = DictionaryObject(self.pagesRef.getObject())
+        pagesNode[NameObject('/Kids')] = ArrayObject(list(pagesNode['/Kids']) + self.kids)
+        pagesNode[NameObject('/Count')] = NumberObject(int(pagesNode['/Count']) + len(self.kids))
+        entries = {number: (obj, 0) for number, obj in self.objects.items()}
+        entries[self.pagesRef.idnum] = (pagesNode, self.pagesRef.generation)
+
+        with open(self.path, 'rb+') as f:
+            f.seek(0, 2)
+            size = f.tell()
+            f.seek(max(0, size - TAIL_SIZE))
+            previous = [int(x) for x in STARTXREF.findall(f.read())][-1]
+            f.seek(0, 2)
+            f.write(b'\n')
+            positions = {}
+            for i, number in enumerate(sorted(entries), start=1):
+                if interrupt:
+                    interrupt()
+                obj, generation = entries[number]
+                positions[number] = f.tell()
+                f.write(b'%d %d obj\n' % (number, generation))
+                obj.writeToStream(f, None)
+                f.write(b'\nendobj\n')
+                if progress:
+                    progress(i / len(entries))
+
+            xrefPosition = f.tell()
+            # head of the free objects list is repeated, so readers do not take the table for a wrongly indexed one
+            f.write(b'xref\n0 1\n%010d %05d f \n' % (0, 65535))
+            numbers = sorted(entries)
+            start = 0
+            while start < len(numbers):
+                # consecutive numbers form one subsection of the table
+                end = start
+                while end + 1 < len(numbers) and numbers[end + 1] == numbers[end] + 1:
+                    end += 1
+                f.write(b'%d %d\n' % (numbers[start], end - start + 1))
+                for number in numbers[start:end + 1]:
+                    f.write(b'%010d %05d n \n' % (positions[number], entries[number][1]))
+                start = end + 1
+
+            trailer = DictionaryObject({
+                NameObject('/Size'): NumberObject(self.nextNumber),
+                NameObject('/Root'): self.base.trailer.raw_get('/Root'),
+                NameObject('/Prev'): NumberObject(previous),
+            })
+            for name in ('/Info', '/ID'):
+                if name in self.base.trailer:
+                    trailer[NameObject(name)] = self.base.trailer.raw_get(name)
+            f.write(b'trailer\n')
+            trailer.writeToStream(f, None)
+            f.write(b'\nstartxref\n%d\n%%%%EOF\n' % xrefPosition)
+
+    def close(self) -> None:
+        """
+        Closes the existing file
+        """
+        self.file.close()
+
+    def __enter__(self) -> 'IncrementalUpdate':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def getObject(self, ref: IndirectObject):
+        if ref.pdf is not self:
+            raise ValueError('pdf must be self')
+        return self.objects[ref.idnum]
+
+    def _addObject(self, obj) -> IndirectObject:
+        """
+        :param obj: object to be written in the update
+        :return: reference to the object, numbered after the objects of the existing file
+        """
+        self.objects[self.nextNumber] = obj
+        self.nextNumber += 1
+        return IndirectObject(self.nextNumber - 1, 0, self)
+
+
+def partPath(path: Path, number: int) -> Path:
+    """
+    :param path: path to the whole output, e.g. 'scan.pdf'
+    :param number: number of the part (counted from 1)
+    :return: path to the part, e.g. 'scan_2.pdf'
+    """
+    path = Path(path)
+    return path.with_name(f'{path.stem}_{number}{path.suffix}')
+
+
+def uniqueNames(names: List[str]) -> List[str]:
+    """
+    :param names: names of files, e.g. of the files split into the same directory
+    :return: the names, the repeated ones (regardless of case) numbered from the second one, e.g. 'scan (2).pdf'
+    """
+    taken = {x.lower() for x in names}
+    seen = set()
+    result = []
+    for name in names:
+        unique = name
+        number = 2
+        while unique.lower() in seen or (unique != name and unique.lower() in taken):
+            unique = f'{Path(name).stem} ({number}){Path(name).suffix}'
+            number += 1
+        seen.add(unique.lower())
+        result.append(unique)
+    return result
+
+
+class SplitWriter:
+    """
+    Streams pages into numbered PDF files (see partPath), each page is written to the current part as soon as it is
+    added. When the next page would make the part exceed the page or byte limit, the part is finished and the page
+    starts a new one, so the output is split in the single write pass. Objects shared by pages of different parts
+    are written to each of them.
+    """
+    # upper bound of the bytes written when a part is finished, besides the kids and the cross-reference entries
+    # (catalog, root of the page tree, trailer and end of file marker)
+    TAIL_OVERHEAD = 256
+    NULL_OBJECT_SIZE = 64  # upper bound of the bytes taken by a null object and its cross-reference entry
+
+    def __init__(self, path: Path, maxPages: Optional[int] = None, maxBytes: Optional[int] = None,
+                 firstPart: int = 1):
+        """
+        :param path: path to the whole output, the parts are created next to it and existing files are never
+        overwritten
+        :param maxPages: maximal number of pages of a part, None for no limit
+        :param maxBytes: maximal size of a part in bytes, None for no limit. A single page bigger than the limit gets
+        a part of its own.
+        :param firstPart: number of the first part written, used when the parts are written by several writers
+        """
+        self.path = Path(path)
+        self.maxPages = maxPages
+        self.maxBytes = maxBytes
+        self.firstPart = firstPart
+        self.paths = []  # paths to the parts written so far
+        self.file = None
+
+    def addPage(self, page: PageObject) -> None:
+        """
+        :param page: page to be written, usually acquired from another document
+        """
+        if self.file is None:
+            self._startPart()
+        rendered = self._render(page)
+        if self.kids and (self.maxPages and len(self.kids) >= self.maxPages
+                          or self.maxBytes and self._projectedSize(*rendered) > self.maxBytes):
+            self._finishPart()
+            self._startPart()
+            rendered = self._render(page)
+        data, offsets, assigned, forward, nextNumber = rendered
+
+        position = self.file.tell()
+        self.file.write(data)
+        for number, offset in offsets.items():
+            self.positions[number] = position + offset
+        self.kids.append(next(iter(offsets)))  # the page is always the first object of its rendering
+        self.kidsSize += len(b'%d 0 R ' % self.kids[-1])
+        self.numbers.update(assigned)
+        self.forward.update(forward)
+        self.nextNumber = nextNumber
+
+    def close(self) -> None:
+        """
+        Finishes the current part
+        """
+        if self.file is not None:
+            self._finishPart()
+
+    def abort(self) -> None:
+        """
+        Closes the current part without finishing it and removes the parts written so far, used when the job fails
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        for path in self.paths:
+            path.unlink(missing_ok=True)
+
+    def __enter__(self) -> 'SplitWriter':
+        return self
+
+    def __exit__(self, excType, *args) -> None:
+        if excType is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _startPart(self) -> None:
+        """
+        Creates the file of the next part, numbers 1 and 2 are kept for the catalog and the root of the page tree
+        """
+        path = partPath(self.path, self.firstPart + len(self.paths))
+        self.file = open(path, 'xb')
+        self.paths.append(path)
+        self.file.write(b'%PDF-1.3\n%\xe2\xe3\xcf\xd3\n')
+        self.positions = {}  # number of a written object -> its offset in the file
+        self.numbers = {}  # (source document, generation, number) -> number of the written copy
+        self.forward = {}  # same as above, for the pages referred to before being added to the part (e.g. by links)
+        self.nextNumber = 3
+        self.kids = []  # numbers of the pages of the part
+        self.kidsSize = 0  # bytes taken by the references to the pages in the root of the page tree
+
+    def _render(self, page: PageObject) -> Tuple[bytes, Dict[int, int], dict, dict, int]:
+        """
+        Serializes the page together with every object it refers to which is not in the current part yet. Nothing is
+        changed, so the page can be rendered again for the next part.
+
+        :param page: page to be rendered
+        :return: serialized objects, their offsets in it by their numbers, numbers of the source objects newly
+        written and of the pages newly referred to (both by keys of the source objects), and the next free number
+        """
+        assigned = {}
+        forward = {}
+        pending = []
+        nextNumber = self.nextNumber
+
+        def number(key=None):
+            nonlocal nextNumber
+            nextNumber += 1
+            if key is not None:
+                assigned[key] = nextNumber - 1
+            return nextNumber - 1
+
+        def translate(value):
+            if isinstance(value, IndirectObject):
+                key = (value.pdf, value.generation, value.idnum)
+                found = self.numbers.get(key) or assigned.get(key) or self.forward.get(key) or forward.get(key)
+                if found is None:
+                    obj = value.getObject()
+                    if isPage(obj):
+                        # pages are never copied along, the reference is kept in case the page joins the part later
+                        found = forward[key] = nextNumber
+                        number()
+                    else:
+                        found = number(key)
+                        pending.append((found, obj))
+                return IndirectObject(found, 0, self)
+            if isinstance(value, StreamObject):
+                # streams must be indirect objects
+                found = number()
+                pending.append((found, value))
+                return IndirectObject(found, 0, self)
+            if isinstance(value, DictionaryObject):
+                return DictionaryObject({key: translate(item) for key, item in value.items()})
+            if isinstance(value, ArrayObject):
+                return ArrayObject(translate(x) for x in value)
+            return value
+
+        ref = getattr(page, 'indirectRef', None)
+        key = (ref.pdf, ref.generation, ref.idnum) if ref is not None else None
+        if key in self.forward:
+            # the page was already referred to in the part, it is written under the number reserved for it
+            pageNumber = self.forward[key]
+            assigned[key] = pageNumber
+        else:
+            pageNumber = number(key)
+        pending.append((pageNumber, page))
+
+        data = BytesIO()
+        offsets = {}
+        i = 0
+        while i < len(pending):  # objects found while translating are appended to the list
+            objectNumber, obj = pending[i]
+            i += 1
+            if isinstance(obj, StreamObject):
+                copy = EncodedStreamObject() if '/Filter' in obj else DecodedStreamObject()
+                copy.update({name: translate(value) for name, value in obj.items() if name != '/Length'})
+                copy._data = obj._data
+            elif obj is page:
+                copy = DictionaryObject({name: translate(value) for name, value in obj.items() if name != '/Parent'})
+                copy[NameObject('/Parent')] = IndirectObject(2, 0, self)
+            else:
+                copy = translate(obj)
+            offsets[objectNumber] = data.tell()
+            data.write(b'%d 0 obj\n' % objectNumber)
+            copy.writeToStream(data, None)
+            data.write(b'\nendobj\n')
+        return data.getvalue(), offsets, assigned, forward, nextNumber
+
+    def _projectedSize(self, data: bytes, offsets: Dict[int, int], assigned: dict, forward: dict,
+                       nextNumber: int) -> int:
+        """
+        :return: upper bound of the size the current part would have if it was finished right after the rendered page
+        (the arguments are the result of _render)
+        """
+        return self.file.tell() + len(data) + self.kidsSize + len(b'%d 0 R ' % nextNumber) + 20 * nextNumber \
+            + self.NULL_OBJECT_SIZE * (len(self.forward) + len(forward)) + self.TAIL_OVERHEAD
+
+    def _finishPart(self) -> None:
+        """
+        Writes the catalog, the root of the page tree and the cross-reference table of the current part and closes it
+        """
+        f = self.file
+        added = set(self.numbers.values())
+        for number in sorted(set(self.forward.values()) - added):
+            # pages referred to, but never added to the part
+            self.positions[number] = f.tell()
+            f.write(b'%d 0 obj\nnull\nendobj\n' % number)
+        catalog = DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): IndirectObject(2, 0, self),
+        })
+        pages = DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Kids'): ArrayObject(IndirectObject(x, 0, self) for x in self.kids),
+            NameObject('/Count'): NumberObject(len(self.kids)),
+        })
+        for number, obj in ((1, catalog), (2, pages)):
+            self.positions[number] = f.tell()
+            f.write(b'%d 0 obj\n' % number)
+            obj.writeToStream(f, None)
+            f.write(b'\nendobj\n')
+
+        xrefPosition = f.tell()
+        f.write(b'xref\n0 %d\n%010d %05d f \n' % (self.nextNumber, 0, 65535))
+        for number in range(1, self.nextNumber):
+            f.write(b'%010d %05d n \n' % (self.positions[number], 0))
+        f.write(b'trailer\n')
+        DictionaryObject({
+            NameObject('/Size'): NumberObject(self.nextNumber),
+            NameObject('/Root'): IndirectObject(1, 0, self),
+        }).writeToStream(f, None)
+        f.write(b'\nstartxref\n%d\n%%%%EOF\n' % xrefPosition)
+        f.close()
+        self.file = None
+
+
+def fileDigest(path: Path) -> str:
+    """
+    :param path: path to the file
+    :return: SHA-256 hash of the file's content
+    """
+    digest = sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def jobFingerprint(paths: List[Path], options: dict, workers: Optional[int] = None) -> str:
+    """
+    Identifies a job by the contents of its input files (in their order) and its options, independently of the names
+    and locations of the files. The files are hashed in parallel, hashlib releases the GIL for big blocks.
+
+    :param paths: paths to the input files, in the order they are used
+    :param options: options of the job, must be serializable to JSON
+    :param workers: maximal number of threads, None lets the executor decide
+    :return: hexadecimal fingerprint of the job
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        digests = list(executor.map(fileDigest, paths))
+    fingerprint = sha256(json.dumps([FINGERPRINT_VERSION, options], sort_keys=True).encode())
+    for digest in digests:
+        fingerprint.update(bytes.fromhex(digest))
+    return fingerprint.hexdigest()
+
+
+def cloneOrCopy(source: Path, destination: Path) -> None:
+    """
+    Copies the file, as a reflink (the files share their data until one of them is changed) where the file system
+    supports it. Hard links are never made, a change of one file (e.g. appending to an output) would change the other.
+
+    :param source: path to the existing file
+    :param destination: path to the new file
+    """
+    if fcntl is not None:
+        try:
+            with open(source, 'rb') as src, open(destination, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+        except OSError:
+            pass  # the file system cannot clone files, the partial destination is overwritten below
+    shutil.copyfile(source, destination)
+
+
+class DiskCache:
+    """
+    Directory of entries identified by keys, each made of one or more files. Files are cloned into the cache where the
+    file system supports it, so caching an output costs no copying of data. When the total size exceeds the limit, the
+    least recently used entries are evicted. The cache can be shared by the threads of the application.
+    """
+    INDEX_NAME = 'index.json'
+    # entries are evicted until the total size is this part of the limit, so a full cache is not sorted on every put
+    EVICTION_TARGET = 0.9
+
+    def __init__(self, directory: Path, maxBytes: int):
+        """
+        :param directory: directory of the cache, created if it does not exist
+        :param maxBytes: maximal total size of the cached files
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.maxBytes = maxBytes
+        self.lock = threading.Lock()
+        try:
+            with open(self.directory / self.INDEX_NAME) as f:
+                self.index = json.load(f)  # key -> [total size of the entry's files, time of its last use]
+        except (OSError, ValueError):
+            self.index = {}
+        self.total = sum(size for size, _ in self.index.values())  # total size of the cached files
+        self.dirty = False
+
+    def get(self, key: str) -> Optional[List[Path]]:
+        """
+        :param key: key of the entry
+        :return: paths to the files of the entry in the order they were put, None if there is no such entry
+        """
+        with self.lock:
+            if key not in self.index:
+                return None
+            files = self._files(key)
+            # an entry whose files were changed (or damaged) is dropped
+            if files is None or sum(x.stat().st_size for x in files) != self.index[key][0]:
+                self._remove(key)
+                self._save()
+                return None
+            self.index[key][1] = time.time()
+            self.dirty = True  # the time of use is saved with the next change, or by flush
+            return files
+
+    def put(self, key: str, files: List[Path]) -> None:
+        """
+        Stores the files as the entry of the key, replacing the previous one
+
+        :param key: key of the entry
+        :param files: paths to the files, they are cloned or copied into the cache
+        """
+        with self.lock:
+            temporary = self.directory / f'{key}.{threading.get_ident()}.tmp'
+            shutil.rmtree(temporary, ignore_errors=True)
+            temporary.mkdir()
+            for i, file in enumerate(files):
+                cloneOrCopy(file, temporary / str(i))
+            self._remove(key)
+            os.replace(temporary, self.directory / key)
+            self._add(key, sum(x.stat().st_size for x in files))
+            self._evict()
+            self._save()
+
+    def getData(self, key: str) -> Optional[bytes]:
+        """
+        :param key: key of the entry
+        :return: content of the entry's only file, None if there is no such entry
+        """
+        files = self.get(key)
+        try:
+            return files[0].read_bytes() if files else None
+        except OSError:
+            return None
+
+    def putData(self, key: str, data: bytes, save: bool = True) -> None:
+        """
+        Stores the data as the entry of the key, replacing the previous one
+
+        :param key: key of the entry
+        :param data: content of the entry's only file
+        :param save: if False, the index is saved with the next change or by flush (many small entries are put faster)
+        """
+        with self.lock:
+            self._remove(key)
+            directory = self.directory / key
+            directory.mkdir()
+            (directory / '0').write_bytes(data)
+            self._add(key, len(data))
+            self._evict()
+            if save:
+                self._save()
+            else:
+                self.dirty = True
+
+    def flush(self) -> None:
+        """
+        Saves the times of use of the entries read since the last change
+        """
+        with self.lock:
+            if self.dirty:
+                self._save()
+
+    def _files(self, key: str) -> Optional[List[Path]]:
+        """
+        :return: paths to the files of the entry in their order, None if the entry's directory is missing
+        """
+        try:
+            return sorted((self.directory / key).iterdir(), key=lambda x: int(x.name))
+        except (OSError, ValueError):
+            return None
+
+    def _add(self, key: str, size: int) -> None:
+        """
+        Records the entry whose files were just stored in the index
+        """
+        self.index[key] = [size, time.time()]
+        self.total += size
+
+    def _remove(self, key: str) -> None:
+        """
+        Removes the entry's files and its record in the index
+        """
+        shutil.rmtree(self.directory / key, ignore_errors=True)
+        if key in self.index:
+            self.total -= self.index.pop(key)[0]
+
+    def _evict(self) -> None:
+        """
+        Removes the least recently used entries when the total size exceeds the limit
+        """
+        if self.total <= self.maxBytes:
+            return
+        for key in sorted(self.index, key=lambda x: self.index[x][1]):
+            if self.total <= self.maxBytes * self.EVICTION_TARGET:
+                break
+            self._remove(key)
+
+    def _save(self) -> None:
+        """
+        Writes the index, replacing the previous one at once so it is never left half-written
+        """
+        temporary = self.directory / f'{self.INDEX_NAME}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(temporary, self.directory / self.INDEX_NAME)
+        self.dirty = False
+
+
+def jobKey(paths: List[Path], options: dict) -> str:
+    """
+    Identifies a job by the paths, sizes and modification times of its input files and its options, which is quick
+    (unlike jobFingerprint the files are not read) and good enough to recognize a job started before
+
+    :param paths: paths to the input files, in the order they are used
+    :param options: options of the job, must be serializable to JSON
+    :return: hexadecimal key of the job
+    """
+    files = []
+    for path in paths:
+        stat = Path(path).stat()
+        files.append([str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns])
+    return sha256(json.dumps([FINGERPRINT_VERSION, files, options], sort_keys=True).encode()).hexdigest()
+
+
+class Checkpoint:
+    """
+    Progress of a job writing its output in batches, saved to disk after every batch so the job can be resumed after
+    the application (or the machine) stopped. The output is written to a partial file: the first batch as a complete
+    document, the next ones as incremental updates. Updates only add bytes at the end, so cutting the partial file
+    to the size saved with the checkpoint drops anything written after it.
+    """
+    def __init__(self, path: Path, savePath: Path, position: int = 0, size: int = 0):
+        """
+        :param path: path to the checkpoint file
+        :param savePath: path to the output of the job
+        :param position: number of the input files whose pages are in the partial file
+        :param size: size of the partial file when the checkpoint was saved
+        """
+        self.path = Path(path)
+        self.savePath = Path(savePath)
+        self.position = position
+        self.size = size
+
+    @property
+    def partialPath(self) -> Path:
+        """
+        :return: path to the output written so far, it gets the output's name when the job is finished
+        """
+        return self.savePath.with_name(self.savePath.name + '.part')
+
+    @classmethod
+    def load(cls, path: Path) -> Optional['Checkpoint']:
+        """
+        :param path: path to the checkpoint file
+        :return: the saved checkpoint, None if there is none or its partial file is missing
+        """
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            checkpoint = cls(path, Path(data['savePath']), data['position'], data['size'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if checkpoint.position and not checkpoint.partialPath.exists():
+            return None
+        return checkpoint
+
+    def restore(self) -> None:
+        """
+        Drops whatever was written to the partial file after the checkpoint was saved
+        """
+        if not self.position:
+            self.partialPath.unlink(missing_ok=True)
+            return
+        with open(self.partialPath, 'rb+') as f:
+            f.truncate(self.size)
+
+    def commit(self, position: int) -> None:
+        """
+        Saves the checkpoint after a batch was written to the partial file
+
+        :param position: number of the input files whose pages are in the partial file
+        """
+        self.position = position
+        with open(self.partialPath, 'rb+') as f:
+            os.fsync(f.fileno())  # the batch must be on the disk before the checkpoint says it is
+            self.size = f.seek(0, 2)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_name(self.path.name + '.tmp')
+        with open(temporary, 'w') as f:
+            json.dump({'savePath': str(self.savePath), 'position': self.position, 'size': self.size}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+    def writeBatch(self, merged: 'PDFMerger', position: int) -> None:
+        """
+        Writes the merged pages to the partial file and saves the checkpoint. Bookmarks and named destinations are
+        carried over only from the first batch.
+
+        :param merged: merger with the pages of the batch
+        :param position: number of the input files whose pages are in the partial file with the batch
+        """
+        if not self.position:
+            # the file is closed even if the writing is interrupted, so it can be removed (on Windows too)
+            with open(self.partialPath, 'wb') as f:
+                merged.write(f)
+        elif merged.pages:
+            merged.appendTo(self.partialPath)
+        self.commit(position)
+
+    def discard(self) -> None:
+        """
+        Removes the partial file and the checkpoint, used when the job is not to be resumed
+        """
+        self.partialPath.unlink(missing_ok=True)
+        self.path.unlink(missing_ok=True)
+
+    def finish(self) -> None:
+        """
+        Gives the partial file the output's name and removes the checkpoint
+        """
+        os.replace(self.partialPath, self.savePath)
+        self.path.unlink(missing_ok=True)
+
+
+class ImageFragments:
+    """
+    Encoded images kept between jobs, so a rebuild re-encodes only the images which are new or changed. Fragments are
+    looked up by the hash of the image's content; the manifest remembers the hashes of the files by their paths, sizes
+    and modification times, so unchanged files are not even read.
+    """
+    MANIFEST_NAME = 'manifest.json'
+    SAVE_INTERVAL = 100  # number of newly encoded images after which the manifest is saved, in case the job stops
+    PREFETCH = 16  # number of images read or encoded ahead of the one being yielded
+
+    def __init__(self, cache: DiskCache):
+        """
+        :param cache: cache the fragments are kept in, the manifest is kept in its directory
+        """
+        self.cache = cache
+        self.lock = threading.Lock()  # the fragments are shared by the jobs, which digest and save from their threads
+        try:
+            with open(cache.directory / self.MANIFEST_NAME) as f:
+                self.manifest = json.load(f)  # resolved path -> [size, modification time, hash of the content]
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def get(self, paths: List[Path], maxDimension: Optional[int] = None,
+            workers: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Yields the encoded images in the order of the files. Only a few images ahead of the one being yielded are read
+        from the cache or encoded (in parallel, Pillow releases the GIL while resizing and encoding), so the memory
+        used does not grow with the number of images.
+
+        :param paths: paths to the images
+        :param maxDimension: images with bigger width or height are resized to it, None keeps the original size
+        :param workers: maximal number of threads, None lets the executor decide
+        """
+        newImages = 0
+        futures = {}  # key -> future of the fragment, for the images read or encoded ahead
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                digests = list(executor.map(self.digest, paths))
+                keys = [sha256(json.dumps([FINGERPRINT_VERSION, x, maxDimension]).encode()).hexdigest()
+                        for x in digests]
+                ahead = 0  # position of the next image to be submitted
+                try:
+                    for i, key in enumerate(keys):
+                        while ahead < len(keys) and ahead <= i + self.PREFETCH:
+                            if keys[ahead] not in futures:
+                                futures[keys[ahead]] = executor.submit(self.fragment, keys[ahead], paths[ahead],
+                                                                       maxDimension)
+                            ahead += 1
+                        data, isNew = futures[key].result()
+                        if key not in keys[i + 1:ahead]:
+                            del futures[key]  # a later occurrence beyond the submitted ones reads it from the cache
+                        if isNew:
+                            newImages += 1
+                            if newImages % self.SAVE_INTERVAL == 0:
+                                self.save()
+                        yield data
+                finally:
+                    # a job stopped halfway does not wait for the rest of the images to be encoded
+                    for future in futures.values():
+                        future.cancel()
+        finally:
+            self.save()  # after the executor finished, so the images being encoded when stopped are recorded too
+
+    def fragment(self, key: str, path: Path, maxDimension: Optional[int]) -> Tuple[bytes, bool]:
+        """
+        :param key: key of the fragment
+        :param path: path to the image
+        :param maxDimension: images with bigger width or height are resized to it, None keeps the original size
+        :return: the encoded image, taken from the cache or encoded and put into it, and True if it was encoded
+        """
+        data = self.cache.getData(key)
+        if data is not None:
+            return data, False
+        data = encodeImage(loadImage(path, maxDimension))
+        self.cache.putData(key, data, save=False)  # the index is saved together with the manifest
+        return data, True
+
+    def digest(self, path: Path) -> str:
+        """
+        :param path: path to the file
+        :return: hash of the file's content, taken from the manifest if the file was not changed since
+        """
+        path = Path(path).resolve()
+        stat = path.stat()
+        with self.lock:
+            entry = self.manifest.get(str(path))
+        if entry and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return entry[2]
+        digest = fileDigest(path)
+        with self.lock:
+            self.manifest[str(path)] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def save(self) -> None:
+        """
+        Writes the manifest and the times of use of the fragments
+        """
+        self.cache.flush()
+        with self.lock:
+            manifest = dict(self.manifest)  # a snapshot, as other jobs may add to the manifest while it is written
+        temporary = self.cache.directory / f'{self.MANIFEST_NAME}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(temporary, self.cache.directory / self.MANIFEST_NAME)
+
+
+class ReaderCache:
+    """
+    Keeps one reader for every distinct PDF file used in a job, so a file merged several times is parsed only once
+    """
+    def __init__(self, mapped: bool = False):
+        """
+        :param mapped: if True, the files are read through read-only memory mappings instead of buffered file objects
+        (see benchmark.py for how the two compare)
+        """
+        self.mapped = mapped
+        self.readers = {}  # (resolved path, modification time) -> reader of the file
+        self.files = []  # opened files and mappings, closed together with the cache
+
+    def get(self, path: Path) -> PdfFileReader:
+        """
+        :param path: path to the PDF file
+        :return: reader of the file, shared by all occurrences of the same unmodified file
+        """
+        path = Path(path).resolve()
+        key = (path, path.stat().st_mtime_ns)
+        if key not in self.readers:
+            f = open(path, 'rb')
+            self.files.append(f)
+            if self.mapped:
+                f = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.files.append(f)
+            self.readers[key] = PdfFileReader(f)
+        return self.readers[key]
+
+    def close(self) -> None:
+        """
+        Closes all the files and mappings opened by the cache
+        """
+        for f in reversed(self.files):
+            f.close()
+        self.files.clear()
+        self.readers.clear()
+
+    def __enter__(self) -> 'ReaderCache':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class PDFMerger(PdfFileMerger):
+    """
+    PdfFileMerger with optional processing stages applied to the merged pages right before writing
+    """
+    def __init__(self, compressionLevel: Optional[int] = None, maxImageDPI: Optional[int] = None,
+                 workers: Optional[int] = None, interrupt: Optional[Callable[[], None]] = None,
+                 progress: Optional[Callable[[float], None]] = None):
+        """
+        :param compressionLevel: zlib level (1-9) used to Flate-encode uncompressed content streams, None disables
+        the recompression stage
+        :param maxImageDPI: images with higher resolution are downsampled to this resolution, None disables
+        the downsampling stage; unused resources of the pages are dropped only if any of the two stages is enabled
+        :param workers: maximal number of threads used by the processing stages, None lets the executor decide
+        :param interrupt: called before each page is processed or written, it may raise an exception to stop the merge
+        :param progress: called with the fraction (0-1) of the output written, may be replaced before each write
+        """
+        super().__init__()
+        self.output = PDFWriter()
+        self.output.interrupt = interrupt
+        self.interrupt = interrupt or (lambda: None)
+        self.progress = progress or (lambda fraction: None)
+        self.compressionLevel = compressionLevel
+        self.maxImageDPI = maxImageDPI
+        self.workers = workers
+
+    def merge(self, position: int, fileobj, bookmark: str = None, pages=None, import_bookmarks: bool = True) -> None:
+        """
+        Same as PdfFileMerger.merge, except that a given PdfFileReader is used as it is, instead of being parsed again
+        from a copy of its stream. Every occurrence of a page gets its own page dictionary, but the objects it refers to
+        (contents, fonts, images...) are shared, so a document merged many times is copied to the output only once.
+        """
+        if not isinstance(fileobj, PdfFileReader):
+            return super().merge(position, fileobj, bookmark, pages, import_bookmarks)
+        reader = fileobj
+        if pages is None:
+            pages = (0, reader.getNumPages())
+        elif isinstance(pages, PageRange):
+            pages = pages.indices(reader.getNumPages())
+        elif not isinstance(pages, tuple):
+            raise TypeError('"pages" must be a tuple of (start, stop[, step])')
+
+        if bookmark:
+            bookmark = Bookmark(TextStringObject(bookmark), NumberObject(self.id_count), NameObject('/Fit'))
+        outline = self._trim_outline(reader, reader.getOutlines(), pages) if import_bookmarks else []
+        self.bookmarks += [bookmark, outline] if bookmark else outline
+        self.named_dests += self._trim_dests(reader, reader.namedDestinations, pages)
+        self._insertPages(position, reader, [reader.getPage(i) for i in range(*pages)])
+
+    def appendImage(self, img: Image.Image) -> None:
+        """
+        Appends a page showing the image
+
+        :param img: RGB image, e.g. returned by loadImage
+        """
+        self._insertPages(len(self.pages), None, [imagePage(img)])
+
+    def appendJPEG(self, data: bytes) -> None:
+        """
+        Appends a page showing an already encoded image
+
+        :param data: RGB image encoded as JPEG, e.g. returned by encodeImage
+        """
+        self._insertPages(len(self.pages), None, [jpegPage(data)])
+
+    def appendPages(self, reader: PdfFileReader, indices: List[int]) -> None:
+        """
+        Appends the chosen pages of a document, in the given order. The page tree is descended straight to each of
+        them, so the pages which are not chosen are never loaded. Bookmarks and named destinations are not imported,
+        as finding their pages would require loading the whole document.
+
+        :param reader: reader of the document
+        :param indices: indices (counted from 0) of the pages to be appended
+        """
+        self._insertPages(len(self.pages), reader, [getPage(reader, i) for i in indices])
+
+    def rotatePages(self, indices: List[int], angle: int) -> None:
+        """
+        Rotates the merged pages by changing their /Rotate entries, the contents of the pages are not touched
+
+        :param indices: indices (counted from 0) of the merged pages to be rotated
+        :param angle: clockwise angle, a multiple of 90
+        """
+        if angle % 90:
+            raise ValueError('pages can be rotated only by multiples of 90 degrees')
+        for i in indices:
+            # every occurrence of a page has its own page dictionary, so other occurrences are not rotated
+            page = self.pages[i].pagedata
+            page[NameObject('/Rotate')] = NumberObject((int(page.get('/Rotate', 0)) + angle) % 360)
+
+    def _insertPages(self, position: int, reader: PdfFileReader, pages: List[PageObject]) -> None:
+        """
+        :param position: index in the merged pages at which the pages are to be inserted
+        :param reader: reader of the document the pages come from, None for the pages created from scratch
+        :param pages: pages to be inserted
+        """
+        srcPages = []
+        for page in pages:
+            copy = PageObject(reader, page.indirectRef)
+            copy.update(page)
+            srcPages.append(_MergedPage(copy, reader, self.id_count))
+            self.id_count += 1
+        self._associate_dests_to_pages(srcPages)
+        self._associate_bookmarks_to_pages(srcPages)
+        self.pages[position:position] = srcPages
+        if reader is not None:
+            self.inputs.append((reader.stream, reader, False))  # the stream is owned by the caller
+
+    def write(self, fileobj) -> None:
+        self.processPages()
+        self.output.progress = self.progress
+        super().write(fileobj)
+
+    def appendTo(self, path: Path) -> None:
+        """
+        Appends the merged pages to an existing PDF file as an incremental update. Bookmarks and named destinations
+        are not carried over.
+
+        :param path: path to the existing PDF file
+        """
+        self.processPages()
+        with IncrementalUpdate(path) as update:
+            for page in self.pages:
+                self.interrupt()
+                update.addPage(page.pagedata)
+            update.write(self.progress, self.interrupt)
+
+    def writeParts(self, path: Path, maxPages: Optional[int] = None, maxBytes: Optional[int] = None) -> List[Path]:
+        """
+        Writes the merged pages into numbered parts of limited size (see SplitWriter). Bookmarks and named
+        destinations are not carried over.
+
+        :param path: path to the whole output, the parts are named after it
+        :param maxPages: maximal number of pages of a part, None for no limit
+        :param maxBytes: maximal size of a part in bytes, None for no limit
+        :return: paths to the written parts
+        """
+        self.processPages()
+        with SplitWriter(path, maxPages, maxBytes) as writer:
+            for i, page in enumerate(self.pages, start=1):
+                self.interrupt()
+                writer.addPage(page.pagedata)
+                self.progress(i / len(self.pages))
+        return writer.paths
+
+    def processPages(self) -> None:
+        """
+        Runs the enabled processing stages over the merged pages
+        """
+        # unused resources are dropped first, so they are neither processed by the other stages nor copied; finding
+        # them decodes every content stream, so plain merges copy the pages as they are
+        if self.compressionLevel is not None or self.maxImageDPI is not None:
+            for page in self.pages:
+                self.interrupt()
+                pruneResources(page.pagedata)
+        if self.maxImageDPI is not None:
+            self.downsampleImages(self.maxImageDPI)
+        if self.compressionLevel is not None:
+            self.compressContentStreams(self.compressionLevel)
+
+    def compressContentStreams(self, level: int) -> None:
+        """
+        Flate-encodes every page content stream that is stored without any filter. Streams shared by several pages
+        are compressed only once.
+
+        :param level: zlib compression level, from 1 (fastest) to 9 (smallest output)
+        """
+        # streams are collected in this thread only, PdfFileReader is not safe to be used from many threads at once
+        streams = {}  # id of the source stream -> source stream
+        for page in self.pages:
+            for stream in self._contentStreams(page.pagedata):
+                if isinstance(stream, DecodedStreamObject) and '/Filter' not in stream:
+                    streams[id(stream)] = stream
+        if not streams:
+            return
+
+        # zlib releases the GIL while compressing, so the pages are really processed in parallel
+        sources = list(streams.values())
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            compressed = list(executor.map(lambda x: zlib.compress(x.getData(), level), sources))
+
+        replacements = {}  # id of the source stream -> reference to the compressed stream in the output
+        for source, data in zip(sources, compressed):
+            if len(data) >= len(source.getData()):
+                continue
+            encoded = EncodedStreamObject()
+            encoded.update({key: value for key, value in source.items() if key != '/Length'})
+            encoded[NameObject('/Filter')] = NameObject('/FlateDecode')
+            encoded._data = data
+            replacements[id(source)] = self.output._addObject(encoded)
+
+        for page in self.pages:
+            contents = page.pagedata.get('/Contents')
+            if contents is None:
+                continue
+            contents = contents.getObject()
+            if isinstance(contents, ArrayObject):
+                page.pagedata[NameObject('/Contents')] = ArrayObject(
+                    replacements.get(id(x.getObject()), x) for x in contents
+                )
+            elif id(contents) in replacements:
+                page.pagedata[NameObject('/Contents')] = replacements[id(contents)]
+
+    def downsampleImages(self, maxDPI: int) -> None:
+        """
+        Downsamples image XObjects placed on the pages with resolution higher than the given one. The resolution is
+        estimated assuming the image covers the whole page, as it does in scanned documents. Images shared by several
+        pages (or documents read by the same reader) are processed only once.
+
+        :param maxDPI: resolution (in dots per inch) to which the images are to be downsampled
+        """
+        # key of the image reference -> [image reference, lowest resolution the image is displayed in]
+        images = {}  # type: Dict[Tuple[int, int, int], list]
+        for page in self.pages:
+            pageSize = max(float(page.pagedata.mediaBox.getWidth()), float(page.pagedata.mediaBox.getHeight()))
+            for ref in self._imageReferences(page.pagedata).values():
+                image = ref.getObject()
+                dpi = max(image['/Width'], image['/Height']) / (pageSize / 72)
+                key = self._referenceKey(ref)
+                if key not in images:
+                    images[key] = [ref, dpi]
+                images[key][1] = min(images[key][1], dpi)
+
+        # only the images which can be re-encoded without changing their meaning are processed
+        jobs = []  # (key, image, filter, size, mode, scale) for every image to be downsampled
+        for key, (ref, dpi) in images.items():
+            image = ref.getObject()
+            filtr = image.get('/Filter')
+            if isinstance(filtr, ArrayObject):
+                filtr = filtr[0] if len(filtr) == 1 else None
+            colorSpace = image.get('/ColorSpace')
+            mode = IMAGE_MODES.get(colorSpace) if isinstance(colorSpace, NameObject) else None
+            if dpi <= maxDPI or filtr not in ('/DCTDecode', '/FlateDecode') or not mode \
+                    or image.get('/BitsPerComponent') != 8 or image.get('/ImageMask') \
+                    or '/Decode' in image or '/DecodeParms' in image:
+                continue
+            size = (int(image['/Width']), int(image['/Height']))
+            jobs.append((key, image, filtr, size, mode, maxDPI / dpi))
+        if not jobs:
+            return
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(lambda x: downsampleImage(x[1]._data, *x[2:]), jobs))
+
+        replacements = {}  # key of the source image -> reference to the downsampled image in the output
+        for (key, image, filtr, size, mode, scale), data in zip(jobs, results):
+            if data is None:
+                continue
+            encoded = EncodedStreamObject()
+            encoded.update({name: value for name, value in image.items() if name != '/Length'})
+            encoded[NameObject('/Width')] = NumberObject(max(1, round(size[0] * scale)))
+            encoded[NameObject('/Height')] = NumberObject(max(1, round(size[1] * scale)))
+            encoded[NameObject('/Filter')] = NameObject(filtr)
+            encoded._data = data
+            replacements[key] = self.output._addObject(encoded)
+
+        # the XObject dictionaries may be shared between pages, so every reference is replaced in place
+        for page in self.pages:
+            xObjects = self._xObjects(page.pagedata)
+            for name, ref in list(xObjects.items()):
+                if isinstance(ref, IndirectObject) and self._referenceKey(ref) in replacements:
+                    xObjects[NameObject(name)] = replacements[self._referenceKey(ref)]
+
+    @staticmethod
+    def _xObjects(page) -> dict:
+        """
+        :param page: page whose XObjects are to be returned
+        :return: resolved XObject dictionary of the page's resources, empty dictionary if there is none
+        """
+        resources = page.get('/Resources')
+        xObjects = resources.getObject().get('/XObject') if resources is not None else None
+        return xObjects.getObject() if xObjects is not None else {}
+
+    def _imageReferences(self, page) -> Dict[str, IndirectObject]:
+        """
+        :param page: page whose images are to be returned
+        :return: dictionary of names and references of image XObjects used by the page
+        """
+        return {
+            name: ref for name, ref in self._xObjects(page).items()
+            if isinstance(ref, IndirectObject) and ref.getObject().get('/Subtype') == '/Image'
+        }
+
+    @staticmethod
+    def _referenceKey(ref: IndirectObject) -> Tuple[int, int, int]:
+        """
+        :param ref: indirect reference to an object
+        :return: key identifying the referenced object across all the source documents
+        """
+        return id(ref.pdf), ref.idnum, ref.generation
+
+    @staticmethod
+    def _contentStreams(page) -> List:
+        """
+        :param page: page whose content streams are to be returned
+        :return: list of resolved content streams of the page
+        """
+        contents = page.get('/Contents')
+        if contents is None:
+            return []
+        contents = contents.getObject()
+        if isinstance(contents, ArrayObject):
+            return [x.getObject() for x in contents]
+        return [contents]
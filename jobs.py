@@ -0,0 +1,553 @@
+"""
+Jobs creating the output files, they take everything they need when they are created, so they can run in any thread
+"""
+import threading
+import time
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from engine import (Checkpoint, DiskCache, FileInfo, ImageFragments, PDFMerger, ReaderCache, SplitWriter,
+                    cloneOrCopy, jobFingerprint, jobKey, jpegPage, pageCount, parsePageSelection, partPath,
+                    readFilesInfo, resolvePageSelection, scanFiles, splitPDF, uniqueNames, validateFiles)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.tif'}
+# parts of the work on a file done when the output is written, images take most of their time to be encoded,
+# while copying the objects of PDF files to the output takes about as long as reading them
+IMAGE_WRITE_SHARE = 0.1
+PDF_WRITE_SHARE = 0.5
+
+
+class JobError(Exception):
+    """
+    Problem which stops the job, its message is meant to be shown to the user as it is
+    """
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside the job when the user cancelled it
+    """
+
+
+class JobControl:
+    """
+    Lets the user pause, resume and cancel a job running in another thread. The job calls check between pages, so
+    a request takes effect within one page.
+    """
+    def __init__(self):
+        self.cancelled = threading.Event()
+        self.running = threading.Event()  # cleared while the job is paused
+        self.running.set()
+
+    def pause(self) -> None:
+        self.running.clear()
+
+    def resume(self) -> None:
+        self.running.set()
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+        self.running.set()  # a paused job wakes up to stop
+
+    def isPaused(self) -> bool:
+        return not self.running.is_set()
+
+    def check(self) -> None:
+        """
+        Blocks while the job is paused
+
+        :raise JobCancelled: if the job was cancelled
+        """
+        self.running.wait()
+        if self.cancelled.is_set():
+            raise JobCancelled()
+
+
+class Progress(NamedTuple):
+    """
+    Progress of a job, reported to the user interface
+    """
+    percent: int
+    pages: int  # pages done so far
+    bytes: int  # bytes of the input files done so far
+    elapsed: float  # seconds since the job started
+    remaining: Optional[float]  # estimated seconds until the job is done, None until it can be estimated
+
+
+class ProgressTracker:
+    """
+    Turns the work done by a job into progress reports. The work is weighted by the sizes of the input files, so one
+    big file does not freeze the progress while small ones race it forward. Reports are sent at most every INTERVAL
+    seconds, so big jobs do not flood the user interface with updates.
+    """
+    INTERVAL = 0.1
+
+    def __init__(self, report: Callable[[Progress], None], total: float):
+        """
+        :param report: called with the progress reports
+        :param total: amount of work of the whole job, usually the total size of the input files
+        """
+        self.report = report
+        self.total = max(total, 1)
+        self.done = 0.0
+        self.skipped = 0.0  # work done before the job was started (e.g. before it was resumed)
+        self.pages = 0
+        self.bytes = 0
+        self.start = time.monotonic()
+        self.lastReport = None
+
+    def advance(self, work: float, pages: int = 0, size: int = 0) -> None:
+        """
+        :param work: amount of work done since the last call
+        :param pages: number of pages done since the last call
+        :param size: bytes of the input files done since the last call
+        """
+        self.done += work
+        self.pages += pages
+        self.bytes += size
+        self.send()
+
+    def skip(self, work: float) -> None:
+        """
+        :param work: amount of work which was done before the job was started, it does not count into its speed
+        """
+        self.done += work
+        self.skipped += work
+
+    def step(self, work: float) -> Callable[[float], None]:
+        """
+        :param work: amount of work of a step which reports its progress by itself (e.g. writing the output)
+        :return: function to be called with the fraction (0-1) of the step done
+        """
+        start = self.done
+
+        def update(fraction):
+            self.done = start + work * fraction
+            self.send()
+        return update
+
+    def finish(self) -> None:
+        """
+        Reports the job as done
+        """
+        self.done = self.total
+        self.send(force=True)
+
+    def send(self, force: bool = False) -> None:
+        """
+        Reports the progress, unless the last report was sent less than INTERVAL seconds ago
+
+        :param force: if True, the progress is reported anyway
+        """
+        now = time.monotonic()
+        if not force and self.lastReport is not None and now - self.lastReport < self.INTERVAL:
+            return
+        self.lastReport = now
+        elapsed = now - self.start
+        done = min(self.done, self.total)
+        speed = (done - self.skipped) / elapsed if elapsed else 0
+        remaining = (self.total - done) / speed if speed else None
+        self.report(Progress(int(done / self.total * 100), self.pages, self.bytes, elapsed, remaining))
+
+
+def problemsMessage(problems: dict, limit: int = 15) -> str:
+    """
+    Builds the message listing the files which cannot be used
+
+    :param problems: dictionary of paths to the invalid files and descriptions of their problems
+    :param limit: maximal number of listed files
+    :return: text of the message
+    """
+    lines = [f'{path.name}: {problem}' for path, problem in list(problems.items())[:limit]]
+    if len(problems) > limit:
+        lines.append(f'...and {len(problems) - limit} more')
+    return 'Some files cannot be used:\n' + '\n'.join(lines)
+
+
+class Job:
+    """
+    Converts the images to a PDF file, or merges the PDF files (possibly mixed with images) into one
+    """
+    writing = set()  # outputs and checkpoints of the running jobs, a file can be written by only one job at a time
+    writingLock = threading.Lock()
+
+    def __init__(self, files: List[Path], options: dict, outputDir: Path, imageFragments: ImageFragments,
+                 customName: Optional[str] = None, append: bool = False, reuse: bool = False,
+                 outputCache: Optional[DiskCache] = None, checkpointDir: Optional[Path] = None,
+                 checkpointPages: int = 1000):
+        """
+        :param files: paths to the files, in the order of their items (a file has one path for every item)
+        :param options: all the options which affect the output: 'images' (True if all the files are images),
+        'items' (texts of the items, with page selections), 'rotations' (clockwise angles of the items),
+        'maxDimension', 'maxImageDPI', 'compressionLevel' and 'limits' (maximal number of pages and bytes of
+        an output part, None if the output is not to be split)
+        :param outputDir: directory the output is created in
+        :param imageFragments: images encoded by previous jobs, only the new or changed images are encoded again
+        :param customName: name of the output without the extension, None for the default one
+        :param append: if True, the pages are appended to the existing file as an incremental update
+        :param reuse: if True, the output is named after its fingerprint and the output of an identical job is reused
+        :param outputCache: cache of the outputs of previous jobs, required if they are to be reused
+        :param checkpointDir: directory of the checkpoints, merges are not checkpointed if it is None
+        :param checkpointPages: merged pages are written out (and a checkpoint saved) after this many pages
+        """
+        self.files = list(files)
+        self.options = options
+        self.outputDir = outputDir
+        self.customName = customName
+        self.append = append
+        self.reuse = reuse
+        self.outputCache = outputCache
+        self.imageFragments = imageFragments
+        self.checkpointDir = checkpointDir
+        self.checkpointPages = checkpointPages
+        self.control = JobControl()
+        self.reserved = []  # files the job writes, see reserve
+
+    def run(self, progress: Callable[[Progress], None] = lambda report: None) -> List[Path]:
+        """
+        Creates the output
+
+        :param progress: called with the progress of the job
+        :return: paths to the created files, empty if pages were appended to an existing file
+        """
+        self.control.check()  # a job cancelled while it was queued does not start
+        try:
+            return self.createOutput(progress)
+        finally:
+            self.release()
+
+    def reserve(self, path: Path) -> None:
+        """
+        Marks the file as written by this job until it ends
+
+        :param path: path to the file
+        :raise JobError: if another running job writes the file
+        """
+        path = path.resolve()
+        with self.writingLock:
+            if path in self.writing:
+                raise JobError('The same file is being created by another job!')
+            self.writing.add(path)
+        self.reserved.append(path)
+
+    def release(self) -> None:
+        """
+        Lets other jobs write the files reserved by this job
+        """
+        with self.writingLock:
+            self.writing.difference_update(self.reserved)
+        self.reserved = []
+
+    def createOutput(self, progress: Callable[[Progress], None]) -> List[Path]:
+        """
+        :param progress: called with the progress of the job
+        :return: paths to the created files, empty if pages were appended to an existing file
+        """
+        savePath = self.outputDir.joinpath(f'{self.customName}.pdf') if self.customName else None
+        # all the files are checked up front, so the job does not fail halfway through
+        problems = validateFiles(self.files + ([savePath] if self.append else []))
+        if problems:
+            raise JobError(problemsMessage(problems))
+        # in deterministic mode the same files and options always give the same output, which is reused if possible
+        fingerprint = None
+        if self.reuse and not self.append:
+            # the items' page selections matter but not their names, the files are recognized by their contents
+            options = dict(self.options, items=[parsePageSelection(x)[1] for x in self.options['items']])
+            fingerprint = jobFingerprint(self.files, options)
+        limits = self.options['limits']
+
+        if not savePath:
+            name = fingerprint[:16] if fingerprint else datetime.now().strftime('%Y-%m-%d %H%M%S%f')
+            savePath = self.outputDir.joinpath(f'pdf-maker-{name}.pdf')
+        self.reserve(savePath)
+        if fingerprint and not self.customName:
+            # an output named after the fingerprint was created by an identical job before, e.g. one queued earlier
+            outputs = [] if limits else [savePath]
+            while limits and partPath(savePath, len(outputs) + 1).exists():
+                outputs.append(partPath(savePath, len(outputs) + 1))
+            if outputs and outputs[0].exists():
+                return outputs
+        # the file could have been created by a job queued earlier
+        if limits and partPath(savePath, 1).exists() or self.customName and not self.append and savePath.exists():
+            raise JobError('File already exists!')
+        if fingerprint:
+            reused = self.reuseOutput(fingerprint, savePath)
+            if reused:
+                return reused
+        # merges are written out in batches, images need no checkpoints as their encoded pages are cached anyway
+        checkpoint = None
+        if self.checkpointDir and not self.options['images'] and not self.append and not limits:
+            options = dict(self.options, outputDir=str(self.outputDir.resolve()), name=self.customName)
+            checkpointPath = self.checkpointDir / f'{jobKey(self.files, options)}.json'
+            self.reserve(checkpointPath)
+            checkpoint = Checkpoint.load(checkpointPath) or Checkpoint(checkpointPath, savePath)
+            if checkpoint.savePath != savePath:
+                savePath = checkpoint.savePath  # a resumed job keeps the name it got when it was started
+                self.reserve(savePath)
+
+        # images alone are converted directly, PDF files (possibly mixed with images) are merged in a single pass
+        appendedSize = savePath.stat().st_size if self.append else None
+        sizes = [x.stat().st_size for x in self.files]
+        tracker = ProgressTracker(progress, sum(sizes))
+        try:
+            if self.options['images']:
+                created = self.convertImages(savePath, sizes, tracker)
+            else:
+                created = self.mergeFiles(savePath, checkpoint, sizes, tracker)
+        except BaseException as e:
+            # nothing written by a cancelled or failed job is left behind (split parts are removed by SplitWriter),
+            # only the batches written before the application itself was interrupted are kept to resume the job from
+            if checkpoint:
+                if isinstance(e, Exception):
+                    checkpoint.discard()
+            elif self.append:
+                with open(savePath, 'rb+') as f:
+                    f.truncate(appendedSize)
+            elif not limits:
+                savePath.unlink(missing_ok=True)
+            raise
+        if fingerprint and created:
+            try:
+                self.outputCache.put(fingerprint, created)
+            except OSError:
+                pass  # the output is created even if it cannot be cached
+        tracker.finish()
+        return created
+
+    def reuseOutput(self, fingerprint: str, savePath: Path) -> List[Path]:
+        """
+        Creates the output of the job from the cached output of an identical job, without processing any file
+
+        :param fingerprint: fingerprint of the job
+        :param savePath: path to where the file is to be created
+        :return: paths to the created files, empty if there is no cached output of the job
+        """
+        try:
+            cached = self.outputCache.get(fingerprint)
+            if not cached:
+                return []
+            outputs = [partPath(savePath, i) for i in range(1, len(cached) + 1)] if self.options['limits'] \
+                else [savePath]
+            for source, destination in zip(cached, outputs):
+                cloneOrCopy(source, destination)
+            self.outputCache.flush()
+        except OSError:
+            return []
+        return outputs
+
+    def convertImages(self, savePath: Path, sizes: List[int], tracker: ProgressTracker) -> List[Path]:
+        """
+        Merges images and converts them to PDF file. Encoded images are kept between jobs, so only the images which
+        are new or were changed since the last job are encoded again.
+
+        :param savePath: path to where the file is to be created
+        :param sizes: sizes of the files, the work on each of them is weighted by them
+        :param tracker: tracker of the job's progress
+        :return: paths to the created files
+        """
+        limits = self.options['limits']
+        # the pass over the images is closed when the job stops, so it does not go on encoding
+        with closing(self.imageFragments.get(self.files, self.options['maxDimension'])) as fragments:
+            if limits:
+                # each image is written to the current part as soon as it is encoded
+                with SplitWriter(savePath, *limits) as writer:
+                    for size, data in zip(sizes, fragments):
+                        self.control.check()
+                        writer.addPage(jpegPage(data))
+                        tracker.advance(size, pages=1, size=size)
+                return writer.paths
+            merged = PDFMerger(interrupt=self.control.check)
+            for size, data in zip(sizes, fragments):
+                self.control.check()
+                merged.appendJPEG(data)
+                tracker.advance(size * (1 - IMAGE_WRITE_SHARE), pages=1, size=size)
+        merged.progress = tracker.step(sum(sizes) * IMAGE_WRITE_SHARE)
+        if self.append:
+            merged.appendTo(savePath)
+            return []
+        # the file is closed even if the writing is interrupted, so it can be removed (on Windows too)
+        with open(savePath, 'wb') as f:
+            merged.write(f)
+        return [savePath]
+
+    def mergeFiles(self, savePath: Path, checkpoint: Optional[Checkpoint], sizes: List[int],
+                   tracker: ProgressTracker) -> List[Path]:
+        """
+        Merges the PDF files into one, images among them are placed on their own pages in the same pass
+
+        :param savePath: path to where the file is to be saved
+        :param checkpoint: if given, the pages are written out in batches and the job resumes from the checkpoint
+        :param sizes: sizes of the files, the work on each of them is weighted by them
+        :param tracker: tracker of the job's progress
+        :return: paths to the created files
+        """
+        # page selection of each file, None if the whole file is to be merged, and the angle its pages are rotated by
+        selections = [parsePageSelection(x)[1] for x in self.options['items']]
+        rotations = self.options['rotations']
+        maxDimension = self.options['maxDimension']
+        limits = self.options['limits']
+
+        # uncompressed content streams are Flate-encoded before writing if the user asked for it
+        settings = {'compressionLevel': self.options['compressionLevel'], 'maxImageDPI': self.options['maxImageDPI'],
+                    'interrupt': self.control.check}
+        merged = PDFMerger(**settings)
+        # files whose pages were written before the job stopped are skipped
+        if checkpoint:
+            checkpoint.restore()
+        done = checkpoint.position if checkpoint else 0
+        unwritten = 0  # work of writing the pages merged since the last batch
+        # all the images go through one pass, which reads or encodes a few of them ahead of their use
+        images = self.imageFragments.get([x for x in self.files[done:] if x.suffix.lower() in IMAGE_EXTENSIONS],
+                                         maxDimension)
+        # each distinct file is parsed once, its repeated occurrences refer to the objects copied the first time
+        with ReaderCache() as readers, closing(images):
+            for i, (file, size, selection, rotation) in enumerate(zip(self.files, sizes, selections, rotations),
+                                                                  start=1):
+                if i <= done:
+                    tracker.skip(size)
+                    continue
+                self.control.check()
+                start = len(merged.pages)
+                if file.suffix.lower() in IMAGE_EXTENSIONS:
+                    writeShare = IMAGE_WRITE_SHARE
+                    merged.appendJPEG(next(images))
+                else:
+                    writeShare = PDF_WRITE_SHARE
+                    reader = readers.get(file)
+                    if selection is None:
+                        merged.append(reader)
+                    else:
+                        # only the selected pages are loaded from the document
+                        try:
+                            merged.appendPages(reader, resolvePageSelection(selection, pageCount(reader)))
+                        except ValueError as e:
+                            raise JobError(f'{file.name}: {e}')
+                    if rotation:
+                        # only /Rotate entries of the pages change, their contents are copied as they are
+                        merged.rotatePages(range(start, len(merged.pages)), rotation)
+                tracker.advance(size * (1 - writeShare), pages=len(merged.pages) - start, size=size)
+                unwritten += size * writeShare
+                if checkpoint and len(merged.pages) >= self.checkpointPages and i < len(self.files):
+                    merged.progress = tracker.step(unwritten)
+                    checkpoint.writeBatch(merged, i)
+                    merged = PDFMerger(**settings)
+                    unwritten = 0
+            merged.progress = tracker.step(unwritten)
+            if self.append:
+                merged.appendTo(savePath)
+                return []
+            elif limits:
+                return merged.writeParts(savePath, *limits)
+            elif checkpoint:
+                checkpoint.writeBatch(merged, len(self.files))
+                checkpoint.finish()
+            else:
+                with open(savePath, 'wb') as f:
+                    merged.write(f)
+        return [savePath]
+
+
+class SplitJob:
+    """
+    Splits each of the PDF files into parts named after it
+    """
+    def __init__(self, files: List[Path], outputDir: Path, pagesPerPart: int = 1):
+        """
+        :param files: paths to the PDF files
+        :param outputDir: directory the parts are created in
+        :param pagesPerPart: number of pages of a part (the last one may have fewer)
+        """
+        self.files = list(files)
+        self.outputDir = outputDir
+        self.pagesPerPart = pagesPerPart
+        self.control = JobControl()
+
+    def run(self, progress: Callable[[Progress], None] = lambda report: None) -> List[Path]:
+        """
+        Creates the parts
+
+        :param progress: called with the progress of the job
+        :return: paths to the created files
+        """
+        # files of the same name from different folders are split into parts of different names
+        outputPaths = [self.outputDir.joinpath(x) for x in uniqueNames([x.name for x in self.files])]
+        if any(partPath(x, 1).exists() for x in outputPaths):
+            raise JobError('File already exists!')
+        problems = validateFiles(self.files)
+        if problems:
+            raise JobError(problemsMessage(problems))
+        created = []
+        sizes = [x.stat().st_size for x in self.files]
+        tracker = ProgressTracker(progress, sum(sizes))
+        try:
+            for file, size, outputPath in zip(self.files, sizes, outputPaths):
+                # a file is split by several processes at once, the job stops between the batches of its parts
+                self.control.check()
+                step = tracker.step(size)
+                created.extend(splitPDF(file, outputPath, self.pagesPerPart, interrupt=self.control.check,
+                                        progress=step))
+                step(1)
+                tracker.advance(0, size=size)
+        except BaseException:
+            # splitPDF removes the parts of the file it failed on, the parts of the previous files are removed here
+            for path in created:
+                path.unlink(missing_ok=True)
+            raise
+        tracker.finish()
+        return created
+
+
+class ScanJob:
+    """
+    Finds the files which can be converted or merged in folders (searched recursively) and among other files, the
+    found files are reported in batches while the search goes on
+    """
+    def __init__(self, paths: List[Path]):
+        """
+        :param paths: paths to files and folders
+        """
+        self.paths = list(paths)
+        self.control = JobControl()
+
+    def run(self, progress: Callable[[List[Path]], None] = lambda paths: None) -> int:
+        """
+        Searches the folders
+
+        :param progress: called with every batch of found files
+        :return: number of found files
+        """
+        found = 0
+        for batch in scanFiles(self.paths, IMAGE_EXTENSIONS | {'.pdf'}, interrupt=self.control.check):
+            progress(batch)
+            found += len(batch)
+        return found
+
+
+class InfoJob:
+    """
+    Reads the metadata the files can be sorted by, in parallel
+    """
+    CHUNK_SIZE = 500  # number of files read between the checks of the job's control
+
+    def __init__(self, files: List[Path]):
+        """
+        :param files: paths to the files
+        """
+        self.files = list(files)
+        self.control = JobControl()
+
+    def run(self, progress: Callable[[int], None] = lambda done: None) -> Dict[Path, FileInfo]:
+        """
+        Reads the metadata
+
+        :param progress: called with the number of files read so far
+        :return: dictionary of paths to the files and their metadata
+        """
+        info = {}
+        for start in range(0, len(self.files), self.CHUNK_SIZE):
+            self.control.check()
+            info.update(readFilesInfo(self.files[start:start + self.CHUNK_SIZE]))
+            progress(len(info))
+        return info
@@ -1,14 +1,17 @@
-from typing import List, Union
-from datetime import datetime
+from typing import List, Optional, Tuple, Union
 from pathlib import Path
 
-from PIL import Image
-from PyPDF2 import PdfFileMerger, PdfFileReader
-from PyQt5.QtCore import Qt, QAbstractAnimation, QVariantAnimation, QEvent
+from PyPDF2.utils import PdfReadError
+from PyQt5.QtCore import (Qt, QAbstractAnimation, QVariantAnimation, QEvent, QModelIndex, QObject, QRunnable,
+                          QSize, QStandardPaths, QThreadPool, pyqtSignal)
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 
 import resources
+from engine import (DiskCache, ImageFragments, ReaderCache, naturalKey, pageCount, parsePageSelection,
+                    resolvePageSelection)
+from jobs import IMAGE_EXTENSIONS, InfoJob, Job, JobCancelled, JobError, Progress, ScanJob, SplitJob
+from models import FileEntry, FilesModel, Thumbnails
 
 
 class AnimatedPushButton(QPushButton):
@@ -39,6 +42,84 @@ class AnimatedPushButton(QPushButton):
         super().leaveEvent(event)
 
 
+def droppedPaths(event: QDropEvent) -> List[Path]:
+    """
+    :param event: drag or drop event
+    :return: paths to the local files and folders being dragged from another application, empty list if there are none
+    """
+    if event.source() is not None or not event.mimeData().hasUrls():
+        return []
+    return [Path(x.toLocalFile()) for x in event.mimeData().urls() if x.isLocalFile()]
+
+
+def cacheDirectory() -> Path:
+    """
+    :return: the user's cache directory of the application (named after the application set on QApplication)
+    """
+    return Path(QStandardPaths.writableLocation(QStandardPaths.CacheLocation))
+
+
+class FilesList(QListView):
+    """
+    Custom class for QListView, its entries are reordered by dragging them and files can be dropped onto it from
+    other applications
+    """
+    pathsDropped = pyqtSignal(list)
+
+    def dragEnterEvent(self, event: QDragEnterEvent) -> None:
+        if droppedPaths(event):
+            event.acceptProposedAction()
+        else:
+            super().dragEnterEvent(event)
+
+    def dragMoveEvent(self, event: QDragMoveEvent) -> None:
+        if droppedPaths(event):
+            event.acceptProposedAction()
+        else:
+            super().dragMoveEvent(event)
+
+    def dropEvent(self, event: QDropEvent) -> None:
+        paths = droppedPaths(event)
+        if paths:
+            event.acceptProposedAction()
+            self.pathsDropped.emit(paths)
+        else:
+            super().dropEvent(event)
+
+
+class WorkerSignals(QObject):
+    """
+    Signals of Worker, QRunnable cannot have its own as it is not a QObject
+    """
+    progress = pyqtSignal(object)
+    finished = pyqtSignal(object)
+    error = pyqtSignal(object)
+
+
+class Worker(QRunnable):
+    """
+    Runs a job in a thread of QThreadPool and reports its progress, result and error through signals
+    """
+    def __init__(self, job: Union[Job, InfoJob, ScanJob, SplitJob]):
+        super().__init__()
+        self.job = job
+        self.signals = WorkerSignals()
+        self.setAutoDelete(False)  # the window keeps the worker while its signals are delivered
+        self.item = None  # entry of the job in the window's list of jobs
+        self.name = ''
+        self.message = ''  # shown when the job is done
+        self.value = 0  # percentage of the job done
+        self.remaining = None  # estimated seconds until the job is done
+
+    def run(self) -> None:
+        try:
+            created = self.job.run(progress=self.signals.progress.emit)
+        except Exception as e:
+            self.signals.error.emit(e)
+        else:
+            self.signals.finished.emit(created)
+
+
 class PDFMaker(QWidget):
     """
     Main application
@@ -50,10 +131,35 @@ class PDFMaker(QWidget):
         self.testingMode = False
         self.baseDir = Path(__file__).parent.absolute()
 
-        self.IMG_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.tif'}
+        self.IMG_EXTENSIONS = IMAGE_EXTENSIONS
+        self.FILES_FILTER = 'Supported Files (*.png *.jpg *.jpeg *.tif *.pdf);;' \
+                            'Image Files (*.png *.jpg *.jpeg *.tif);;PDF Files (*.pdf)'
+        self.MAX_DIM = 2000  # used when checkbox to optimize file size is ticked, maximal dimension an image can have
+        self.MAX_DPI = 150  # used when checkbox to optimize file size is ticked, maximal resolution of merged images
+        self.ROTATION_ROLE = FilesModel.ROTATION_ROLE  # clockwise angle by which PDF file's pages are to be rotated
+        self.CACHE_SIZE = 1024 ** 3  # maximal total size of the outputs kept for reuse
+        self.THUMBNAILS_CACHE_SIZE = 256 * 1024 ** 2  # maximal total size of the thumbnails kept on disk
+        self.CHECKPOINT_PAGES = 1000  # merged pages are written out (and a checkpoint saved) after this many pages
 
         self.chosenFiles = []  # used for storing paths to files to be converted/merged
         self.outputDir = None
+        self.outputCache = None  # cache of the outputs of previous jobs, created when it is used for the first time
+        self.imageFragments = None  # images encoded by previous jobs, created when they are used for the first time
+        self.createdFiles = []  # paths to the files created by the last job
+        self.MAX_JOBS = 2  # number of jobs run at once, the others are queued
+        self.workers = []  # workers of the queued and running jobs
+        self.threadPool = QThreadPool(self)
+        self.threadPool.setMaxThreadCount(self.MAX_JOBS)
+        # folders are searched one at a time in their own thread, so their files are listed in the order they came
+        self.scanners = []  # workers of the unfinished searches
+        self.scanPool = QThreadPool(self)
+        self.scanPool.setMaxThreadCount(1)
+        # metadata the files are sorted by, read in the same thread as the folders are searched (once for every file)
+        self.filesInfo = {}
+        self.infoWorker = None  # worker reading the metadata, None if none is being read
+        self.sortKey = None  # key the list is sorted by when the metadata is read, None if no sorting is waiting
+        # checkpoints of unfinished jobs, a job started again with the same files and options resumes from its one
+        self.checkpointDir = cacheDirectory() / 'jobs'
 
         self.initUI()
         self.createActions()
@@ -65,13 +171,27 @@ class PDFMaker(QWidget):
         """
         self.toolBar = QToolBar()
 
-        self.filesList = QListWidget()
+        # the list only shows the model's records, so it stays fast with hundreds of thousands of files
+        self.filesModel = FilesModel(self)
+        self.filesModel.rotationIcon = self.style().standardIcon(QStyle.SP_BrowserReload)
+        # thumbnails are made in the background for the rows being shown, so scrolling never waits for them
+        self.thumbnails = Thumbnails(cacheDirectory() / 'thumbnails', self.THUMBNAILS_CACHE_SIZE, parent=self)
+        self.filesModel.setThumbnails(self.thumbnails)
+        self.filesList = FilesList()
+        self.filesList.setModel(self.filesModel)
+        self.filesList.setIconSize(QSize(Thumbnails.SIZE, Thumbnails.SIZE))
+        self.filesList.setUniformItemSizes(True)
+        self.filesList.setLayoutMode(QListView.Batched)
         self.filesList.setContextMenuPolicy(Qt.ActionsContextMenu)
         self.filesList.setDragEnabled(True)
         self.filesList.setDefaultDropAction(Qt.MoveAction)
         self.filesList.setDragDropOverwriteMode(False)
         self.filesList.setDragDropMode(QAbstractItemView.InternalMove)
         self.filesList.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        # page selection of PDF files (e.g. 'file.pdf[1-2,5]') can be typed into their entries
+        self.filesList.setEditTriggers(QAbstractItemView.DoubleClicked | QAbstractItemView.EditKeyPressed)
+        # files and folders can be dropped onto the window and onto the list
+        self.setAcceptDrops(True)
 
         self.chooseFilesPush = AnimatedPushButton('Choose files...')
         self.chooseFilesLine = QLineEdit('No Files Selected')
@@ -79,6 +199,32 @@ class PDFMaker(QWidget):
         self.chooseFilesLine.setFocusPolicy(Qt.NoFocus)
 
         self.optimizeSizeCheck = QCheckBox('Optimize file size')
+        self.reuseCheck = QCheckBox('Reuse identical results')
+        self.reuseCheck.setToolTip('Name the output after the files and options, and reuse the output of the same '
+                                   'job if it was made before')
+
+        self.compressCheck = QCheckBox('Compress page contents')
+        self.compressLevelLabel = QLabel('Level:')
+        self.compressLevelSpin = QSpinBox()
+        self.compressLevelSpin.setRange(1, 9)
+        self.compressLevelSpin.setValue(6)
+        self.compressLevelSpin.setDisabled(True)
+        self.compressWidget = QWidget()
+        self.compressWidget.setHidden(True)  # compression options are available only when merging PDFs
+
+        # output is split into numbered parts with at most the given number of pages and megabytes (0 means no limit)
+        self.splitCheck = QCheckBox('Split into parts')
+        self.splitPagesLabel = QLabel('Pages:')
+        self.splitPagesSpin = QSpinBox()
+        self.splitPagesSpin.setRange(0, 100000)
+        self.splitPagesSpin.setSpecialValueText('No limit')
+        self.splitSizeLabel = QLabel('MB:')
+        self.splitSizeSpin = QSpinBox()
+        self.splitSizeSpin.setRange(0, 100000)
+        self.splitSizeSpin.setSpecialValueText('No limit')
+        self.splitSizeSpin.setValue(10)
+        for widget in (self.splitPagesSpin, self.splitSizeSpin):
+            widget.setDisabled(True)
 
         self.outputLabel = QLabel('Output directory:')
         self.outputLine = QLineEdit()
@@ -89,11 +235,28 @@ class PDFMaker(QWidget):
         self.customNameCheck = QCheckBox('Custom file name')
         self.customNameLine = QLineEdit()
         self.customNameLine.setDisabled(True)
+        self.appendCheck = QCheckBox('Append')
+        self.appendCheck.setToolTip('Append the pages to the file if it already exists')
+        self.appendCheck.setDisabled(True)
 
         self.makePDFPush = AnimatedPushButton('Convert to PDF')
+        self.splitPDFPush = AnimatedPushButton('Split PDF')
+        self.splitPDFPush.setToolTip('Split each file into parts of the number of pages given above (single pages '
+                                     'if there is no limit)')
+        self.splitPDFPush.setHidden(True)  # splitting is available only when all the chosen files are PDFs
 
         self.progressBar = QProgressBar()
         self.progressBar.setHidden(True)
+        # the selected jobs (all if none is selected) can be paused and cancelled, they stop within one page
+        self.pausePush = AnimatedPushButton('Pause')
+        self.cancelPush = AnimatedPushButton('Cancel')
+        for widget in (self.pausePush, self.cancelPush):
+            widget.setHidden(True)
+
+        # every press of the main button queues a job, while the files and options of the next one can be changed
+        self.jobsList = QListWidget()
+        self.jobsList.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.jobsList.setFixedHeight(100)
 
         selectedLayout = QHBoxLayout()
         selectedLayout.addWidget(self.chooseFilesLine)
@@ -104,23 +267,56 @@ class PDFMaker(QWidget):
         outputLayout.addWidget(self.outputLine)
         outputLayout.addWidget(self.outputPush)
 
+        optionsLayout = QHBoxLayout()
+        optionsLayout.addWidget(self.optimizeSizeCheck)
+        optionsLayout.addStretch()
+        optionsLayout.addWidget(self.reuseCheck)
+
+        compressLayout = QHBoxLayout(self.compressWidget)
+        compressLayout.setContentsMargins(0, 0, 0, 0)
+        compressLayout.addWidget(self.compressCheck)
+        compressLayout.addStretch()
+        compressLayout.addWidget(self.compressLevelLabel)
+        compressLayout.addWidget(self.compressLevelSpin)
+
+        splitLayout = QHBoxLayout()
+        splitLayout.addWidget(self.splitCheck)
+        splitLayout.addStretch()
+        splitLayout.addWidget(self.splitPagesLabel)
+        splitLayout.addWidget(self.splitPagesSpin)
+        splitLayout.addWidget(self.splitSizeLabel)
+        splitLayout.addWidget(self.splitSizeSpin)
+
         customNameLayout = QHBoxLayout()
         customNameLayout.addWidget(self.customNameCheck)
         customNameLayout.addWidget(self.customNameLine)
+        customNameLayout.addWidget(self.appendCheck)
+
+        actionLayout = QHBoxLayout()
+        actionLayout.addWidget(self.makePDFPush)
+        actionLayout.addWidget(self.splitPDFPush)
+
+        progressLayout = QHBoxLayout()
+        progressLayout.addWidget(self.progressBar)
+        progressLayout.addWidget(self.pausePush)
+        progressLayout.addWidget(self.cancelPush)
 
         mainLayout = QVBoxLayout()
         mainLayout.addWidget(self.toolBar)
         mainLayout.addWidget(self.filesList)
         mainLayout.addLayout(selectedLayout)
-        mainLayout.addWidget(self.optimizeSizeCheck)
+        mainLayout.addLayout(optionsLayout)
+        mainLayout.addWidget(self.compressWidget)
+        mainLayout.addLayout(splitLayout)
         mainLayout.addLayout(outputLayout)
         mainLayout.addLayout(customNameLayout)
-        mainLayout.addWidget(self.makePDFPush)
-        mainLayout.addWidget(self.progressBar)
+        mainLayout.addLayout(actionLayout)
+        mainLayout.addWidget(self.jobsList)
+        mainLayout.addLayout(progressLayout)
 
         # window settings
         self.setLayout(mainLayout)
-        self.setFixedSize(500, 500)
+        self.setFixedSize(500, 620)
         self.setWindowTitle('PDF Maker')
         self.setWindowIcon(QIcon(':icon.svg'))
         with open('style/main.qss') as f:
@@ -136,10 +332,24 @@ class PDFMaker(QWidget):
         self.moveUpAction = QAction(QIcon(':goUp.svg'), 'Move Up', self)
         self.moveToTopAction = QAction(QIcon(':goToTop.svg'), 'Move To Top', self)
         self.addItemAction = QAction(QIcon(':addItem.svg'), 'Add', self)
+        self.addFolderAction = QAction(self.style().standardIcon(QStyle.SP_DirOpenIcon), 'Add Folder', self)
         self.deleteItemAction = QAction(QIcon(':deleteItem.svg'), 'Delete', self)
+        self.sortAction = QAction(self.style().standardIcon(QStyle.SP_FileDialogListView), 'Sort', self)
+        sortMenu = QMenu(self)
+        self.sortActions = {
+            key: sortMenu.addAction(text) for key, text in (
+                ('name', 'By Name'), ('modified', 'By Modification Time'), ('size', 'By Size'),
+                ('taken', 'By Capture Date'), ('pages', 'By Page Count'),
+            )
+        }
+        self.sortAction.setMenu(sortMenu)
+        # page editing of PDF files, available only in the context menu
+        self.rotateRightAction = QAction('Rotate Right', self)
+        self.rotateLeftAction = QAction('Rotate Left', self)
+        self.expandPagesAction = QAction('Split Into Pages', self)
 
         actions = [self.moveToTopAction, self.moveUpAction, self.moveDownAction, self.moveToBottomAction,
-                   self.addItemAction, self.deleteItemAction]
+                   self.sortAction, self.addItemAction, self.addFolderAction, self.deleteItemAction]
 
         # separator between move buttons and delete button
         separator = QAction(self)
@@ -152,6 +362,14 @@ class PDFMaker(QWidget):
                 self.filesList.addAction(separator)
             self.toolBar.addAction(action)
             self.filesList.addAction(action)
+        # the sort button only opens its menu
+        self.toolBar.widgetForAction(self.sortAction).setPopupMode(QToolButton.InstantPopup)
+
+        pagesSeparator = QAction(self)
+        pagesSeparator.setSeparator(True)
+        self.filesList.addAction(pagesSeparator)
+        for action in (self.rotateRightAction, self.rotateLeftAction, self.expandPagesAction):
+            self.filesList.addAction(action)
 
         # keyboard shortcuts
         self.moveDownAction.setShortcut('Alt+Down')
@@ -159,7 +377,11 @@ class PDFMaker(QWidget):
         self.moveUpAction.setShortcut('Alt+Up')
         self.moveToTopAction.setShortcut('Alt+Shift+Up')
         self.addItemAction.setShortcut('Insert')
+        self.addFolderAction.setShortcut('Shift+Insert')
         self.deleteItemAction.setShortcut('Delete')
+        self.rotateRightAction.setShortcut('Ctrl+R')
+        self.rotateLeftAction.setShortcut('Ctrl+Shift+R')
+        self.expandPagesAction.setShortcut('Ctrl+E')
 
     def connectSignals(self) -> None:
         """
@@ -168,107 +390,334 @@ class PDFMaker(QWidget):
         self.chooseFilesPush.clicked.connect(self.chooseFilesHandler)
         self.outputPush.clicked.connect(self.chooseOutputDir)
         self.makePDFPush.clicked.connect(self.makePDF)
+        self.splitPDFPush.clicked.connect(self.splitPDFs)
+        self.pausePush.clicked.connect(self.pauseJob)
+        self.cancelPush.clicked.connect(self.cancelJob)
+        self.jobsList.itemSelectionChanged.connect(self.updateJobControls)
 
         self.moveDownAction.triggered.connect(
-            lambda: self.moveItem(self.filesList.selectedItems(), down_direction=True)
+            lambda: self.moveItem(self.selectedRows(), down_direction=True)
         )
         self.moveToBottomAction.triggered.connect(
-            lambda: self.moveItem(self.filesList.selectedItems(), down_direction=True, to_edge=True)
+            lambda: self.moveItem(self.selectedRows(), down_direction=True, to_edge=True)
         )
         self.moveUpAction.triggered.connect(
-            lambda: self.moveItem(self.filesList.selectedItems(), down_direction=False)
+            lambda: self.moveItem(self.selectedRows(), down_direction=False)
         )
         self.moveToTopAction.triggered.connect(
-            lambda: self.moveItem(self.filesList.selectedItems(), down_direction=False, to_edge=True)
+            lambda: self.moveItem(self.selectedRows(), down_direction=False, to_edge=True)
         )
-        self.deleteItemAction.triggered.connect(lambda: self.deleteItem(self.filesList.selectedItems()))
+        self.deleteItemAction.triggered.connect(lambda: self.deleteItem(self.selectedRows()))
         self.addItemAction.triggered.connect(self.addItem)
+        self.addFolderAction.triggered.connect(self.addFolder)
+        self.filesList.pathsDropped.connect(self.scanPaths)
+        for key, action in self.sortActions.items():
+            action.triggered.connect(lambda checked, key=key: self.sortFiles(key))
+        self.rotateRightAction.triggered.connect(lambda: self.rotateItems(self.selectedRows(), 90))
+        self.rotateLeftAction.triggered.connect(lambda: self.rotateItems(self.selectedRows(), -90))
+        self.expandPagesAction.triggered.connect(lambda: self.expandPages(self.selectedRows()))
 
         self.customNameCheck.stateChanged.connect(self.customNameEnable)
+        self.filesModel.dataChanged.connect(self.pageSelectionChanged)
+        self.compressCheck.stateChanged.connect(
+            lambda: self.compressLevelSpin.setEnabled(self.compressCheck.isChecked())
+        )
+        self.splitCheck.stateChanged.connect(self.splitEnable)
+
+    def splitEnable(self) -> None:
+        """
+        Enables the limits of the output parts if the checkbox to split the output is ticked
+        """
+        for widget in (self.splitPagesSpin, self.splitSizeSpin):
+            widget.setEnabled(self.splitCheck.isChecked())
+
+    def splitLimits(self) -> Optional[Tuple[Optional[int], Optional[int]]]:
+        """
+        :return: maximal number of pages and maximal size in bytes of an output part (None for no limit), None if
+        the output is not to be split
+        """
+        if not self.splitCheck.isChecked():
+            return None
+        maxPages = self.splitPagesSpin.value() or None
+        maxBytes = self.splitSizeSpin.value() * 1024 * 1024 or None
+        return (maxPages, maxBytes) if maxPages or maxBytes else None
 
     def customNameEnable(self):
         """
-        Enables the custom name line edit if corresponding checkbox is ticked
+        Enables the custom name line edit (and the option to append to existing file) if the checkbox is ticked
         """
         enable = True if self.customNameCheck.isChecked() else False
         self.customNameLine.setEnabled(enable)
+        self.appendCheck.setEnabled(enable)
+
+    def selectedRows(self) -> List[int]:
+        """
+        :return: rows of the selected entries of the files list, in ascending order
+        """
+        return sorted(x.row() for x in self.filesList.selectionModel().selectedRows())
 
-    def moveItem(self, items: List[QListWidgetItem], down_direction: bool, to_edge: bool = False) -> None:
+    def moveItem(self, rows: List[int], down_direction: bool, to_edge: bool = False) -> None:
         """
-        Allows to move items in ListWidget up and down
+        Allows to move entries of the files list up and down, they stay selected. All the entries are moved in one
+        update of the list.
 
-        :param items: list of currently selected items
-        :param down_direction: True if the items are to be moved down, False if up
-        :param to_edge: True if the items are to be moved to the top/bottom, False if they are to be moved by only one
+        :param rows: rows of the entries to be moved (usually the selected ones)
+        :param down_direction: True if the entries are to be moved down, False if up
+        :param to_edge: True if the entries are to be moved to the top/bottom, False if they are to be moved by only one
         index
         """
-        if not items:
+        if not rows:
             return
-        # list of row numbers of corresponding items
-        rows = [self.filesList.indexFromItem(item).row() for item in items]
-        rows.sort(reverse=down_direction)
-        rowCount = self.filesList.count()
+        rows = sorted(set(rows), reverse=down_direction)
+        rowCount = self.filesModel.rowCount()
 
-        # if the items are already at the edge, don't move them further in that direction
+        # if the entries are already at the edge, don't move them further in that direction
         if (rows[0] >= rowCount - 1 and down_direction) or (rows[0] <= 0 and not down_direction):
             return
-        for i, row in enumerate(rows):
-            item = self.filesList.takeItem(row)
-            if i == 0:
-                itemToScroll = item
-            if not to_edge:
-                # move item(s) by one index
-                if down_direction:
-                    self.filesList.insertItem(row + 1, item)
-                else:
-                    self.filesList.insertItem(row - 1, item)
-            else:
-                # move item(s) to bottom/top
-                if down_direction:
-                    self.filesList.insertItem(rowCount - i - 1, item)
-                else:
-                    self.filesList.insertItem(0 + i, item)
-            item.setSelected(True)
+        if to_edge:
+            # moved entries keep their order at the bottom/top
+            moved = sorted(rows)
+            movedSet = set(moved)
+            rest = [x for x in range(rowCount) if x not in movedSet]
+            order = rest + moved if down_direction else moved + rest
+            rowToScroll = rowCount - 1 if down_direction else 0
         else:
-            self.filesList.scrollToItem(itemToScroll)
+            # each entry swaps places with its neighbour, the entries nearest to the edge go first
+            order = list(range(rowCount))
+            step = 1 if down_direction else -1
+            for row in rows:
+                order[row], order[row + step] = order[row + step], order[row]
+            rowToScroll = rows[0] + step
+        self.filesModel.reorder(order)
+        self.filesList.scrollTo(self.filesModel.index(rowToScroll))
 
-    def deleteItem(self, items: List[QListWidgetItem]) -> None:
+    def deleteItem(self, rows: List[int]) -> None:
         """
-        Deletes given items from ListWidget and from paths' list
+        Deletes given entries from the files list and their paths from paths' list, in one update of the list
 
-        :param items: items to be deleted
+        :param rows: rows of the entries to be deleted
         """
-        if not items:
+        if not rows:
             return
-        itemsToDelete = []
-        for item in items:
-            itemsToDelete.append(item.text())
-            self.filesList.takeItem(self.filesList.row(item))
-        self.chosenFiles = list(filter(lambda x: x.name not in itemsToDelete, self.chosenFiles))
+        self.filesModel.removeEntries(rows)
+        # the same file may have several entries (e.g. its pages), only the paths of the deleted ones are removed
+        self.chosenFiles = [x.path for x in self.filesModel.entries]
         self.updateFilesLabel()
-        itemsToDelete.clear()
 
     def addItem(self) -> None:
         """
-        Adds items chosen from file dialog to ListWidget and to paths' list
+        Adds files chosen from file dialog to the files list and to paths' list
         """
         if not self.chosenFiles:
             return self.chooseFilesHandler()
-        if self.chosenFiles[0].suffix.lower() == '.pdf':
-            filtr = 'PDF Files (*.pdf)'
-        elif self.chosenFiles[0].suffix.lower() in self.IMG_EXTENSIONS:
-            filtr = 'Image Files (*.png *.jpg *.jpeg *.tif)'
+        paths = [Path(x) for x in self.chooseFilesDialog(filtr=self.FILES_FILTER)]
+        self.chosenFiles.extend(paths)
+        self.filesModel.appendPaths(paths)
+        self.updateFilesLabel()
+        self.updateMode()
+
+    def addFolder(self) -> None:
+        """
+        Adds the files found in the folder chosen from file dialog (and in its subfolders) to the files list and to
+        paths' list, the folder is searched in the background
+        """
+        if not self.testingMode:
+            directory = QFileDialog.getExistingDirectory(self, caption='Choose folder')
         else:
-            filtr = None
-        if not filtr:
+            # for testing purposes, the file dialog is omitted
+            directory = str(self.baseDir.joinpath('test_files'))
+        if directory:
+            self.scanPaths([Path(directory)])
+
+    def scanPaths(self, paths: List[Path]) -> None:
+        """
+        Searches the folders among the paths in the background, the found files are added to the list in batches as
+        they are found
+
+        :param paths: paths to files and folders
+        """
+        worker = Worker(ScanJob(paths))
+        self.scanners.append(worker)
+        # the signals are emitted in the worker's thread, queued connections deliver them through the event loop
+        worker.signals.progress.connect(lambda paths: self.filesFound(worker, paths), Qt.QueuedConnection)
+        worker.signals.finished.connect(lambda found: self.scanFinished(worker), Qt.QueuedConnection)
+        worker.signals.error.connect(lambda error: self.scanFailed(worker, error), Qt.QueuedConnection)
+        self.scanPool.start(worker)
+
+    def filesFound(self, worker: 'Worker', paths: List[Path]) -> None:
+        """
+        Adds a batch of files found by a search to the files list and to paths' list
+
+        :param worker: worker of the search, batches of cancelled searches are dropped
+        :param paths: paths to the found files
+        """
+        if worker not in self.scanners:
+            return
+        self.chosenFiles.extend(paths)
+        self.filesModel.appendPaths(paths)
+        self.updateFilesLabel()
+        self.updateMode()
+
+    def scanFinished(self, worker: 'Worker') -> None:
+        """
+        :param worker: worker of the search which is over
+        """
+        if worker in self.scanners:
+            self.scanners.remove(worker)
+
+    def scanFailed(self, worker: 'Worker', error: Exception) -> Union[None, int]:
+        """
+        :param worker: worker of the search
+        :param error: exception raised by the search
+        :return: the result of MessageBox execution, None if the search was cancelled
+        """
+        self.scanFinished(worker)
+        if isinstance(error, JobCancelled):
+            return None  # the search was stopped on purpose
+        return self.showMessageBox('Files could not be listed!', is_error=True)
+
+    def cancelScans(self) -> None:
+        """
+        Stops the searches and the reading of the metadata, and drops the results they already sent
+        """
+        self.scanPool.clear()
+        for worker in self.scanners:
+            worker.job.control.cancel()
+        self.scanners.clear()
+        if self.infoWorker is not None:
+            self.infoWorker.job.control.cancel()
+            self.infoWorker = None
+            self.sortKey = None
+
+    def sortFiles(self, key: str) -> None:
+        """
+        Sorts the files list, files with equal keys are sorted by their names. The metadata the key needs is read in
+        the background the first time the files are sorted by it, then the list is sorted in memory.
+
+        :param key: 'name', 'modified', 'size', 'taken' (capture date of photos) or 'pages' (page count)
+        """
+        self.sortKey = key
+        if key != 'name':
+            missing = list(dict.fromkeys(x.path for x in self.filesModel.entries if x.path not in self.filesInfo))
+            if missing:
+                # one reading at a time, when it is done the list is sorted by the key asked for last
+                if self.infoWorker is None:
+                    worker = self.infoWorker = Worker(InfoJob(missing))
+                    worker.signals.finished.connect(lambda info: self.infoRead(worker, info), Qt.QueuedConnection)
+                    worker.signals.error.connect(lambda error: self.infoFailed(worker, error), Qt.QueuedConnection)
+                    self.scanPool.start(worker)
+                return
+        info = self.filesInfo
+        keys = {
+            'name': lambda x: (),
+            'modified': lambda x: info[x.path].modified,
+            'size': lambda x: info[x.path].size,
+            # photos without the date go last
+            'taken': lambda x: (info[x.path].taken is None, info[x.path].taken or ''),
+            'pages': lambda x: info[x.path].pages,
+        }
+        self.sortKey = None
+        self.filesModel.sortEntries(lambda x: (keys[key](x), naturalKey(x.text)))
+        self.filesList.scrollTo(self.filesList.currentIndex())
+
+    def infoRead(self, worker: 'Worker', info: dict) -> None:
+        """
+        Keeps the metadata read in the background and sorts the list by the key waiting for it
+
+        :param worker: worker which read the metadata, results of a cancelled one are dropped
+        :param info: dictionary of paths to the files and their metadata
+        """
+        if worker is not self.infoWorker:
             return
-        filenames = self.chooseFilesDialog(filtr=filtr)
-        for file in filenames:
-            path = Path(file)
-            self.chosenFiles.append(path)
-            self.filesList.addItem(QListWidgetItem(path.name))
+        self.filesInfo.update(info)
+        self.infoWorker = None
+        if self.sortKey is not None:
+            self.sortFiles(self.sortKey)  # files added meanwhile are read in the next round
+
+    def infoFailed(self, worker: 'Worker', error: Exception) -> Union[None, int]:
+        """
+        :param worker: worker which read the metadata
+        :param error: exception raised while the metadata was read
+        :return: the result of MessageBox execution, None if the reading was cancelled
+        """
+        if worker is not self.infoWorker:
+            return None  # the reading was cancelled
+        self.infoWorker = None
+        self.sortKey = None
+        return self.showMessageBox('Files could not be sorted!', is_error=True)
+
+    def dragEnterEvent(self, event: QDragEnterEvent) -> None:
+        if droppedPaths(event):
+            event.acceptProposedAction()
+
+    def dropEvent(self, event: QDropEvent) -> None:
+        paths = droppedPaths(event)
+        if paths:
+            event.acceptProposedAction()
+            self.scanPaths(paths)
+
+    def rotateItems(self, rows: List[int], angle: int) -> None:
+        """
+        Rotates the pages of the given PDF files' entries, the rotation is applied losslessly when the files are merged
+
+        :param rows: rows of the entries to be rotated, images' entries are skipped
+        :param angle: clockwise angle, a multiple of 90
+        """
+        for row in rows:
+            entry = self.filesModel.entries[row]
+            if entry.isPDF():
+                self.filesModel.setData(self.filesModel.index(row), (entry.rotation + angle) % 360, self.ROTATION_ROLE)
+
+    def expandPages(self, rows: List[int]) -> None:
+        """
+        Replaces the given PDF files' entries with one entry for every (selected) page, so the pages can be reordered,
+        rotated and deleted one by one
+
+        :param rows: rows of the entries to be expanded, images' entries are skipped
+        """
+        try:
+            with ReaderCache() as readers:
+                # entries are replaced from the bottom, so the rows of the others do not change
+                for row in sorted(rows, reverse=True):
+                    entry = self.filesModel.entries[row]
+                    name = entry.path.name
+                    if not entry.isPDF():
+                        continue
+                    count = pageCount(readers.get(entry.path))
+                    selection = parsePageSelection(entry.text)[1]
+                    indices = resolvePageSelection(selection, count) if selection else range(count)
+                    self.filesModel.removeRows(row, 1)
+                    self.filesModel.insertEntries(
+                        row, [FileEntry(entry.path, f'{name}[{index + 1}]', entry.rotation) for index in indices]
+                    )
+                    # the file has one path for every entry
+                    self.chosenFiles.extend([entry.path] * (len(indices) - 1))
+        except (IOError, PdfReadError, ValueError) as e:
+            return self.showMessageBox(f'{name}: {e}', is_error=True)
         self.updateFilesLabel()
 
+    def pageSelectionChanged(self, topLeft: QModelIndex, bottomRight: QModelIndex, roles: List[int] = ()) -> None:
+        """
+        Validates the page selection typed into PDF files' entries, restores the plain file name if it is invalid
+
+        :param topLeft: first changed entry
+        :param bottomRight: last changed entry
+        :param roles: changed roles, empty if all of them could change
+        """
+        if roles and Qt.EditRole not in roles:
+            return
+        for row in range(topLeft.row(), bottomRight.row() + 1):
+            index = self.filesModel.index(row)
+            name = self.filesModel.entries[row].path.name
+            try:
+                typedName, selection = parsePageSelection(self.filesModel.entries[row].text)
+            except ValueError as e:
+                self.filesModel.setData(index, name)
+                return self.showMessageBox(str(e), is_error=True)
+            if typedName != name:
+                self.filesModel.setData(index, name)
+                self.showMessageBox(f'Pages are to be given after the file name, e.g. {name}[1-2,5]', is_error=True)
+
     def chooseFilesDialog(self, filtr: str = '') -> List[str]:
         """
         Allows the user to pick the files with the file dialog
@@ -280,25 +729,40 @@ class PDFMaker(QWidget):
             filenames, filter_ = QFileDialog.getOpenFileNames(self, caption='Choose files', filter=filtr)
         else:
             # for testing purposes, the file dialog is omitted
-            filenames = list(self.baseDir.joinpath(f'test_files/png').glob('*.png'))
+            filenames = sorted(self.baseDir.joinpath(f'test_files/png').glob('*.png'))
         return filenames
 
     def chooseFilesHandler(self) -> None:
         """
-        Main handler for selecting files - adds them to ListWidget and filepaths' list
+        Main handler for selecting files - adds them to the files list and filepaths' list
         """
-        self.filesList.clear()
-        filenames = self.chooseFilesDialog(filtr='Image Files (*.png *.jpg *.jpeg *.tif);;PDF Files (*.pdf)')
+        filenames = self.chooseFilesDialog(filtr=self.FILES_FILTER)
+        self.cancelScans()  # files of the folders being searched would be added to the new list
         self.chosenFiles = [Path(x) for x in filenames]
         self.updateFilesLabel()
-        self.filesList.addItems(list(map(lambda x: x.name, self.chosenFiles)))  # populate ListWidget
+        self.filesModel.clear()
+        self.filesModel.appendPaths(self.chosenFiles)  # a single update of the list, however many files there are
+        self.updateMode()
+
+    def hasOnlyImages(self) -> bool:
+        """
+        :return: True if all the chosen files are images (they are converted by Pillow), False if there are PDF files
+        among them (they are merged together with the images)
+        """
+        return all(x.suffix.lower() in self.IMG_EXTENSIONS for x in self.chosenFiles)
 
-        if self.chosenFiles and self.chosenFiles[0].suffix.lower() == '.pdf':  # if only pdf files are selected
+    def updateMode(self) -> None:
+        """
+        Adjusts the main button and the options to the kinds of chosen files
+        """
+        if self.hasOnlyImages():
+            self.makePDFPush.setText('Convert to PDF')
+        elif all(x.suffix.lower() == '.pdf' for x in self.chosenFiles):
             self.makePDFPush.setText('Join PDFs')
-            self.optimizeSizeCheck.setHidden(True)
         else:
-            self.makePDFPush.setText('Convert to PDF')
-            self.optimizeSizeCheck.setHidden(False)
+            self.makePDFPush.setText('Merge to PDF')
+        self.compressWidget.setHidden(self.hasOnlyImages())
+        self.splitPDFPush.setHidden(not all(x.suffix.lower() == '.pdf' for x in self.chosenFiles))
 
     def updateFilesLabel(self) -> None:
         """
@@ -322,98 +786,274 @@ class PDFMaker(QWidget):
 
     def makePDF(self) -> Union[None, int]:
         """
-        Main handler for PDF creating
+        Main handler for PDF creating, the job is queued and runs in the background
 
-        :return: the result of MessageBox execution
+        :return: the result of MessageBox execution if the job cannot be started
         """
         hasCustomName = self.customNameCheck.isChecked()
         customName = self.customNameLine.text().strip()
+        # existing file is appended to (as an incremental update) only if the user asked for it
+        append = bool(hasCustomName and customName and self.appendCheck.isChecked()
+                      and self.outputDir and self.outputDir.joinpath(f'{customName}.pdf').exists())
         if not self.chosenFiles:
             return self.showMessageBox('No files were selected!', is_error=True)
         elif not self.outputDir:
             return self.showMessageBox('Output directory were not specified!', is_error=True)
-        elif hasCustomName and customName and self.outputDir.joinpath(f'{customName}.pdf').exists():
+        elif hasCustomName and customName and self.outputDir.joinpath(f'{customName}.pdf').exists() and not append:
             return self.showMessageBox('File already exists!', is_error=True)
         self.orderFiles()
-        # if custom name checkbox is ticked, but name is not given, it will give the default one
-        filename = f'{customName}.pdf' if hasCustomName and customName \
-            else f'pdf-maker-{datetime.now().strftime("%Y-%m-%d %H%M%S%f")}.pdf'
-        savePath = self.outputDir.joinpath(filename)
+        limits = self.splitLimits()
+        if limits and append:
+            return self.showMessageBox('Split output cannot be appended to an existing file!', is_error=True)
+        options = self.jobOptions(limits)
+        if not options['images'] and len(self.chosenFiles) < 2 and not append and not limits \
+                and not any(parsePageSelection(x)[1] for x in options['items']) and not any(options['rotations']):
+            return self.showMessageBox('Select more than one PDF file!', is_error=True)
 
-        # extension validation is already performed during file choosing, this is additional
-        if self.chosenFiles[0].suffix.lower() in self.IMG_EXTENSIONS:
-            self.imageToPDF(savePath)
-        elif self.chosenFiles[0].suffix.lower() == '.pdf':
-            self.joinPDFs(savePath)
-        self.resetProgressBar()
+        # everything the job needs is taken from the widgets now, the job itself does not touch them
+        reuse = self.reuseCheck.isChecked()
+        job = Job(self.chosenFiles, options, self.outputDir, self.getImageFragments(),
+                  customName=customName if hasCustomName and customName else None, append=append, reuse=reuse,
+                  outputCache=self.getOutputCache() if reuse else None, checkpointDir=self.checkpointDir,
+                  checkpointPages=self.CHECKPOINT_PAGES)
+        verb = 'created' if options['images'] else 'merged'
+        self.startJob(job, f'PDF {verb} at: {self.outputDir.resolve()}')
 
-    def imageToPDF(self, savePath: Path) -> Union[None, int]:
+    def jobOptions(self, limits: Optional[Tuple[Optional[int], Optional[int]]]) -> dict:
         """
-        Merges images and converts them to PDF file
+        :param limits: maximal number of pages and bytes of an output part, None if the output is not to be split
+        :return: all the options which affect the output of the job, used to identify identical jobs
+        """
+        return {
+            'images': self.hasOnlyImages(),
+            'items': [x.text for x in self.filesModel.entries],
+            'rotations': [x.rotation for x in self.filesModel.entries],
+            'maxDimension': self.MAX_DIM if self.optimizeSizeCheck.isChecked() else None,
+            'maxImageDPI': self.MAX_DPI if self.optimizeSizeCheck.isChecked() else None,
+            'compressionLevel': self.compressLevelSpin.value() if self.compressCheck.isChecked() else None,
+            'limits': limits,
+        }
 
-        :param savePath: path to where the file is to be created
-        :return: the result of MessageBox execution
+    def getOutputCache(self) -> DiskCache:
+        """
+        :return: cache of the outputs of previous jobs, kept in the user's cache directory
         """
-        self.progressBar.setHidden(False)
+        if self.outputCache is None:
+            directory = cacheDirectory() / 'outputs'
+            self.outputCache = DiskCache(directory, self.CACHE_SIZE)
+        return self.outputCache
 
-        MAX_DIM = 2000  # used when checkbox to optimize file size is ticked, it's the maximal dimension image can have
-        pages = []  # list to store converted images, used further for saving them into one file
-        for i, file in enumerate(self.chosenFiles, start=1):
-            try:
-                with Image.open(file) as img:
-                    if self.optimizeSizeCheck.isChecked() and (img.size[0] > MAX_DIM or img.size[1] > MAX_DIM):
-                        # resize image while maintaining the aspect ratio
-                        ratio = img.size[0] / img.size[1]
-                        if ratio > 1:
-                            newSize = (MAX_DIM, round(MAX_DIM / ratio))
-                        else:
-                            newSize = (round(MAX_DIM * ratio), MAX_DIM)
-                        img = img.resize(newSize, Image.LANCZOS)
-                    mask = img.split()[3] if img.mode == 'RGBA' else None  # dealing with transparency in RGBA images
-                    converted = Image.new('RGB', img.size, (255, 255, 255))
-                    converted.paste(img, mask=mask)
-                    pages.append(converted)
-                    self.progressBar.setValue(int((i / len(self.chosenFiles)) * 95))
-            except IOError:
-                self.resetProgressBar()
-                return self.showMessageBox('Something went wrong!', is_error=True)
-        mainImg = pages.pop(0)
-        if not pages:
-            mainImg.save(savePath, optimize=True)
+    def getImageFragments(self) -> ImageFragments:
+        """
+        :return: images encoded by previous jobs, kept in the user's cache directory
+        """
+        if self.imageFragments is None:
+            directory = cacheDirectory() / 'fragments'
+            self.imageFragments = ImageFragments(DiskCache(directory, self.CACHE_SIZE))
+        return self.imageFragments
+
+    def splitPDFs(self) -> Union[None, int]:
+        """
+        Splits each of the chosen PDF files into parts named after it, the number of pages of a part is taken from
+        the split options
+
+        :return: the result of MessageBox execution if the job cannot be started
+        """
+        if not self.chosenFiles:
+            return self.showMessageBox('No files were selected!', is_error=True)
+        elif not self.outputDir:
+            return self.showMessageBox('Output directory were not specified!', is_error=True)
+        limits = self.splitLimits()
+        pagesPerPart = limits[0] if limits and limits[0] else 1
+        self.startJob(SplitJob(self.chosenFiles, self.outputDir, pagesPerPart),
+                      f'PDF split at: {self.outputDir.resolve()}')
+
+    def startJob(self, job: Union[Job, SplitJob], message: str) -> None:
+        """
+        Queues the job, at most MAX_JOBS jobs run at once in the window's thread pool and the others wait for a free
+        thread. The window is informed about the jobs only by signals.
+
+        :param job: job to be run
+        :param message: message shown in the job's tooltip when it is done
+        """
+        worker = Worker(job)
+        worker.message = message
+        worker.item = QListWidgetItem()
+        worker.item.setData(Qt.UserRole, worker)
+        files = job.files[0].name + (f' and {len(job.files) - 1} more' if len(job.files) > 1 else '')
+        if isinstance(job, SplitJob):
+            worker.name = f'Split {files}'
         else:
-            mainImg.save(savePath, save_all=True, append_images=pages, optimize=True)
-        self.progressBar.setValue(100)
-        return self.showMessageBox(f'PDF created at: {self.outputDir.resolve()}', is_error=False)
+            worker.name = f'{job.customName}.pdf' if job.customName else files
+        worker.item.setToolTip(f'Output directory: {job.outputDir.resolve()}')
+        self.setJobStatus(worker, 'Queued')
+        self.jobsList.addItem(worker.item)
+        self.jobsList.scrollToItem(worker.item)
+        self.workers.append(worker)
+
+        # the signals are emitted in the worker's thread, queued connections deliver them through the event loop
+        worker.signals.progress.connect(lambda value: self.jobProgress(worker, value), Qt.QueuedConnection)
+        worker.signals.finished.connect(lambda created: self.jobFinished(worker, created), Qt.QueuedConnection)
+        worker.signals.error.connect(lambda error: self.jobFailed(worker, error), Qt.QueuedConnection)
+        self.threadPool.start(worker)
+        self.updateJobControls()
 
-    def joinPDFs(self, savePath: Path) -> Union[None, int]:
+    def setJobStatus(self, worker: 'Worker', status: str) -> None:
         """
-        Merges the PDF files into one
+        :param worker: worker of the job
+        :param status: text describing the state of the job
+        """
+        worker.item.setText(f'{worker.name} — {status}')
 
-        :param savePath: path to where the file is to be saved
-        :return: the result of MessageBox execution
+    def jobProgress(self, worker: 'Worker', report: Progress) -> None:
         """
-        if len(self.chosenFiles) < 2:
-            return self.showMessageBox('Select more than one PDF file!', is_error=True)
-        self.progressBar.setHidden(False)
-        merged = PdfFileMerger()
-        for i, file in enumerate(self.chosenFiles, start=1):
-            merged.append(PdfFileReader(str(file)))
-            self.progressBar.setValue(int((i / len(self.chosenFiles)) * 95))
-        merged.write(str(savePath))
-        self.progressBar.setValue(100)
-        return self.showMessageBox(f'PDF merged at: {self.outputDir.resolve()}', is_error=False)
+        Shows the progress, speed and remaining time of the job in its entry, and the progress of all the unfinished
+        jobs in the progress bar
+
+        :param worker: worker of the job
+        :param report: progress of the job
+        """
+        if worker not in self.workers:
+            return  # the job was cancelled meanwhile
+        worker.value = report.percent
+        worker.remaining = report.remaining
+        if worker.job.control.isPaused():
+            self.setJobStatus(worker, 'Paused')
+        else:
+            status = [f'{report.percent}%']
+            if report.elapsed >= 1:
+                if report.pages:
+                    status.append(f'{report.pages / report.elapsed:.1f} pages/s')
+                status.append(f'{report.bytes / report.elapsed / 1024 ** 2:.1f} MB/s')
+            if report.remaining is not None:
+                status.append(f'{self.formatDuration(report.remaining)} left')
+            self.setJobStatus(worker, ', '.join(status))
+        self.progressBar.setValue(sum(x.value for x in self.workers) // len(self.workers))
+        # jobs run at once, so the last of them to finish tells when all of them are done
+        remaining = [x.remaining for x in self.workers if x.remaining is not None]
+        self.progressBar.setFormat(f'%p% ({self.formatDuration(max(remaining))} left)' if remaining else '%p%')
+
+    @staticmethod
+    def formatDuration(seconds: float) -> str:
+        """
+        :param seconds: duration in seconds
+        :return: the duration as minutes and seconds (with hours if needed), e.g. '2:05'
+        """
+        minutes, seconds = divmod(int(seconds), 60)
+        hours, minutes = divmod(minutes, 60)
+        return f'{hours}:{minutes:02d}:{seconds:02d}' if hours else f'{minutes}:{seconds:02d}'
+
+    def jobFinished(self, worker: 'Worker', created: List[Path]) -> None:
+        """
+        Marks the job as done
+
+        :param worker: worker of the job
+        :param created: paths to the files created by the job
+        """
+        if worker not in self.workers:
+            return
+        self.createdFiles = created
+        self.setJobStatus(worker, 'Done')
+        worker.item.setToolTip(worker.message)
+        self.removeWorker(worker)
+
+    def jobFailed(self, worker: 'Worker', error: Exception) -> Union[None, int]:
+        """
+        Marks the job as failed and informs the user about it
+
+        :param worker: worker of the job
+        :param error: exception raised by the job
+        :return: the result of MessageBox execution, None if the job was cancelled
+        """
+        if worker not in self.workers:
+            return None
+        self.removeWorker(worker)
+        if isinstance(error, JobCancelled):
+            self.setJobStatus(worker, 'Cancelled')
+            return None  # the user knows, and the job's output was already removed
+        message = str(error) if isinstance(error, JobError) else 'Something went wrong!'
+        self.setJobStatus(worker, 'Failed')
+        worker.item.setToolTip(message)
+        return self.showMessageBox(f'{worker.name}: {message}', is_error=True)
+
+    def removeWorker(self, worker: 'Worker') -> None:
+        """
+        Removes the worker of the job which is over from the unfinished ones
+
+        :param worker: worker of the job
+        """
+        self.workers.remove(worker)
+        worker.item.setData(Qt.UserRole, None)
+        if not self.workers:
+            self.resetProgressBar()
+        self.updateJobControls()
+
+    def selectedWorkers(self) -> List['Worker']:
+        """
+        :return: workers of the selected unfinished jobs, all the unfinished jobs if none of them is selected
+        """
+        items = self.jobsList.selectedItems()
+        if not items:
+            return list(self.workers)
+        return [x.data(Qt.UserRole) for x in items if x.data(Qt.UserRole) is not None]
+
+    def updateJobControls(self) -> None:
+        """
+        Shows the progress bar and the buttons controlling the jobs while there are unfinished ones
+        """
+        for widget in (self.progressBar, self.pausePush, self.cancelPush):
+            widget.setHidden(not self.workers)
+        workers = self.selectedWorkers()
+        self.pausePush.setText('Resume' if workers and all(x.job.control.isPaused() for x in workers) else 'Pause')
+
+    def pauseJob(self) -> None:
+        """
+        Pauses the selected jobs (all the jobs if none is selected), or resumes them if they all are paused
+        """
+        workers = self.selectedWorkers()
+        resume = bool(workers) and all(x.job.control.isPaused() for x in workers)
+        for worker in workers:
+            if resume:
+                worker.job.control.resume()
+                self.setJobStatus(worker, f'{worker.value}%' if worker.value else 'Queued')
+            else:
+                worker.job.control.pause()
+                self.setJobStatus(worker, 'Paused')
+        self.updateJobControls()
+
+    def cancelJob(self) -> None:
+        """
+        Cancels the selected jobs (all the jobs if none is selected), the files they wrote are removed
+        """
+        for worker in self.selectedWorkers():
+            worker.job.control.cancel()
+            if self.threadPool.tryTake(worker):
+                # the job did not start yet
+                self.removeWorker(worker)
+                self.setJobStatus(worker, 'Cancelled')
+            else:
+                self.setJobStatus(worker, 'Cancelling')
+
+    def closeEvent(self, event: QCloseEvent) -> None:
+        """
+        Cancels the unfinished jobs and waits until the running ones stop, so they leave no partial files
+        """
+        self.threadPool.clear()
+        for worker in self.workers:
+            worker.job.control.cancel()
+        self.threadPool.waitForDone()
+        self.cancelScans()
+        self.scanPool.waitForDone()
+        self.thumbnails.close()
+        super().closeEvent(event)
 
     def orderFiles(self) -> None:
         """
-        Sets items in filepaths' list in the same order as in ListWidget (to preserve user-defined order in the created
-        PDF file)
+        Sets items in filepaths' list in the same order as in the files list (to preserve user-defined order in the
+        created PDF file). Every entry carries the full path to its file, so files of the same name from different
+        directories keep their places.
         """
-        for i in range(self.filesList.count()):
-            for j in range(i, len(self.chosenFiles)):
-                if self.filesList.item(i).text() == self.chosenFiles[j].name:
-                    if i != j:
-                        self.chosenFiles[i], self.chosenFiles[j] = self.chosenFiles[j], self.chosenFiles[i]
-                    break
+        self.chosenFiles = [x.path for x in self.filesModel.entries]
 
     def showMessageBox(self, message: str, is_error: bool) -> int:
         """
@@ -439,11 +1079,15 @@ class PDFMaker(QWidget):
         """
         self.progressBar.setHidden(True)
         self.progressBar.setValue(0)
+        self.progressBar.setFormat('%p%')
 
 
 if __name__ == '__main__':
     import sys
     app = QApplication(sys.argv)
+    # the user's directories of the application (e.g. its cache) are named after it
+    app.setOrganizationName('pdf-maker')
+    app.setApplicationName('PDF Maker')
     app.setStyle('Fusion')
     pdf_maker = PDFMaker()
     sys.exit(app.exec())
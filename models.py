@@ -0,0 +1,350 @@
+"""
+Models of the lists shown by the application, they keep only compact records so the lists can be very long
+"""
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from pathlib import Path
+from typing import Any, Callable, List, Optional, Tuple
+
+from PyQt5.QtCore import Qt, QAbstractItemModel, QAbstractListModel, QModelIndex, QObject, pyqtSignal
+from PyQt5.QtGui import QIcon, QImage, QPixmap, QTransform
+
+from engine import DiskCache, makeThumbnail, parsePageSelection
+
+PAGES_TIP = 'Double-click to select pages, e.g. file.pdf[1-2,5]'
+
+
+class FileEntry:
+    """
+    Entry of the files list
+    """
+    __slots__ = ('path', 'text', 'rotation')
+
+    def __init__(self, path: Path, text: Optional[str] = None, rotation: int = 0):
+        """
+        :param path: path to the file
+        :param text: name of the file, PDF file's name may be followed by its page selection (e.g. 'file.pdf[1-2,5]')
+        :param rotation: clockwise angle by which PDF file's pages are to be rotated
+        """
+        self.path = path
+        self.text = text or path.name
+        self.rotation = rotation
+
+    def isPDF(self) -> bool:
+        return self.path.suffix.lower() == '.pdf'
+
+
+class Thumbnails(QObject):
+    """
+    Thumbnails of the files, made in background threads only when a view asks for them, i.e. for the rows it shows.
+    The recently shown thumbnails are kept in memory, all the made ones in a cache on disk.
+    """
+    loaded = pyqtSignal(object, QImage)  # (path, page index) and its thumbnail, null if the file has nothing to show
+    updated = pyqtSignal()  # emitted when a thumbnail is stored in memory
+    SIZE = 48  # maximal width and height of a thumbnail
+    MAX_ICONS = 2000  # number of thumbnails kept in memory, the least recently shown ones are dropped
+    # number of thumbnails waiting to be made, the oldest requests are dropped (their rows were scrolled away)
+    MAX_PENDING = 200
+    SAVE_INTERVAL = 100  # number of new thumbnails after which the index of the disk cache is saved
+
+    def __init__(self, cacheDirectory: Optional[Path] = None, cacheSize: int = 0, workers: Optional[int] = None,
+                 parent=None):
+        """
+        :param cacheDirectory: directory of the cache on disk, None if the thumbnails are kept only in memory
+        :param cacheSize: maximal total size of the thumbnails kept on disk
+        :param workers: maximal number of threads, None lets the executor decide
+        """
+        super().__init__(parent)
+        self.cacheDirectory = cacheDirectory
+        self.cacheSize = cacheSize
+        self.cache = None  # opened in a background thread when it is used for the first time, reading its index
+        self.cacheLock = threading.Lock()
+        self.unsaved = 0  # number of thumbnails put into the cache since its index was saved
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.closed = False  # no more thumbnails are made after the thumbnails are closed
+        self.icons = OrderedDict()  # (path, page index) -> thumbnail icon (None if there is none), the last used last
+        self.pending = OrderedDict()  # (path, page index) -> future of the thumbnail, the last requested last
+        placeholder = QPixmap(self.SIZE, self.SIZE)
+        placeholder.fill(Qt.transparent)
+        self.placeholder = QIcon(placeholder)  # shown until the thumbnail is made, keeps the rows' height
+        self.loaded.connect(self.store)
+
+    def get(self, path: Path, page: int = 0) -> Optional[QIcon]:
+        """
+        Returns the thumbnail if it is in memory, otherwise has it made in the background; the loaded signal is emitted
+        when it is ready
+
+        :param path: path to the image or PDF file
+        :param page: index of the PDF file's page (counted from 0)
+        :return: the thumbnail, None if it is not ready or if the file has nothing to show
+        """
+        key = (path, page)
+        if key in self.icons:
+            self.icons.move_to_end(key)
+            return self.icons[key]
+        if key in self.pending:
+            self.pending.move_to_end(key)
+        elif not self.closed:
+            self.pending[key] = self.executor.submit(self.make, key)
+            if len(self.pending) > self.MAX_PENDING:
+                self.pending.popitem(last=False)[1].cancel()
+        return None
+
+    def make(self, key: Tuple[Path, int]) -> None:
+        """
+        Takes the thumbnail from the cache on disk or makes it, runs in a background thread
+
+        :param key: path to the file and index of its page
+        """
+        path, page = key
+        data = None
+        try:
+            stat = path.stat()
+            cacheKey = sha256(json.dumps([str(path.resolve()), stat.st_size, stat.st_mtime_ns, page, self.SIZE])
+                              .encode()).hexdigest()
+            cache = self.getCache()
+            data = cache.getData(cacheKey) if cache else None
+            if data is None:
+                data = makeThumbnail(path, self.SIZE, page) or b''
+                if cache:
+                    self.putData(cache, cacheKey, data)
+        except Exception:
+            pass  # a file which cannot be read (or is damaged) has no thumbnail, the job reports its problem
+        self.loaded.emit(key, QImage.fromData(data) if data else QImage())
+
+    def getCache(self) -> Optional[DiskCache]:
+        """
+        :return: cache of the thumbnails on disk, None if they are kept only in memory
+        """
+        with self.cacheLock:
+            if self.cache is None and self.cacheDirectory is not None:
+                self.cache = DiskCache(self.cacheDirectory, self.cacheSize)
+            return self.cache
+
+    def putData(self, cache: DiskCache, key: str, data: bytes) -> None:
+        """
+        Puts the thumbnail into the cache on disk, its index is saved once in a while and when the thumbnails are closed
+        """
+        cache.putData(key, data, save=False)
+        with self.cacheLock:
+            self.unsaved += 1
+            if self.unsaved < self.SAVE_INTERVAL:
+                return
+            self.unsaved = 0
+        cache.flush()
+
+    def store(self, key: Tuple[Path, int], image: QImage) -> None:
+        """
+        Keeps the thumbnail made in the background in memory, runs in the thread the thumbnails belong to
+        """
+        self.pending.pop(key, None)
+        self.icons[key] = None if image.isNull() else QIcon(QPixmap.fromImage(image))
+        if len(self.icons) > self.MAX_ICONS:
+            self.icons.popitem(last=False)
+        self.updated.emit()
+
+    def close(self) -> None:
+        """
+        Drops the requests, waits for the thumbnails being made and saves the index of the cache on disk
+        """
+        self.closed = True
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown()
+        if self.cache is not None:
+            self.cache.flush()
+
+
+class FilesModel(QAbstractListModel):
+    """
+    Chosen files in the order they are merged in. Rows are inserted, removed and moved in batches, each batch is a
+    single update of the views.
+    """
+    PATH_ROLE = Qt.UserRole  # full path to the file, it identifies the entry's file among files of the same name
+    ROTATION_ROLE = Qt.UserRole + 1  # clockwise angle by which PDF file's pages are to be rotated
+    # entries removed from more separate places than this are removed by resetting the model, which costs less than
+    # updating the views for every run of adjacent rows
+    MAX_REMOVED_RUNS = 100
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.entries = []
+        self.rotationIcon = QIcon()  # shown by the entries of rotated PDF files which have no thumbnail
+        self.thumbnails = None  # type: Optional[Thumbnails]
+
+    def setThumbnails(self, thumbnails: Thumbnails) -> None:
+        """
+        :param thumbnails: thumbnails shown by the entries
+        """
+        self.thumbnails = thumbnails
+        thumbnails.updated.connect(self.thumbnailsUpdated)
+
+    def thumbnailsUpdated(self) -> None:
+        """
+        Lets the views repaint the entries whose thumbnails are ready, the views repaint only the rows they show
+        """
+        if self.entries:
+            self.dataChanged.emit(self.index(0), self.index(len(self.entries) - 1), [Qt.DecorationRole])
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.entries)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        entry = self.entries[index.row()]
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return entry.text
+        elif role == self.PATH_ROLE:
+            return entry.path
+        elif role == self.ROTATION_ROLE:
+            return entry.rotation
+        elif role == Qt.DecorationRole:
+            return self.decoration(entry)
+        elif role == Qt.ToolTipRole and entry.isPDF():
+            return f'{PAGES_TIP}\nRotated by {entry.rotation}° clockwise' if entry.rotation else PAGES_TIP
+        return None
+
+    def decoration(self, entry: FileEntry) -> Optional[QIcon]:
+        """
+        :param entry: entry of the files list
+        :return: thumbnail of the entry's file (or its first selected page) turned by the entry's rotation
+        """
+        if self.thumbnails is None:
+            return self.rotationIcon if entry.rotation else None
+        page = 0
+        if entry.isPDF():
+            try:
+                selection = parsePageSelection(entry.text)[1]
+                page = selection[0][0] - 1 if selection else 0
+            except ValueError:
+                pass  # the invalid selection is reported when the job is started
+        icon = self.thumbnails.get(entry.path, page)
+        if icon is None:
+            return self.rotationIcon if entry.rotation else self.thumbnails.placeholder
+        if entry.rotation:
+            pixmap = icon.pixmap(self.thumbnails.SIZE)
+            return QIcon(pixmap.transformed(QTransform().rotate(entry.rotation)))
+        return icon
+
+    def setData(self, index: QModelIndex, value, role: int = Qt.EditRole) -> bool:
+        if not index.isValid():
+            return False
+        entry = self.entries[index.row()]
+        if role == Qt.EditRole:
+            entry.text = value
+        elif role == self.ROTATION_ROLE:
+            entry.rotation = value
+        else:
+            return False
+        self.dataChanged.emit(index, index, [role])
+        return True
+
+    def flags(self, index: QModelIndex) -> Qt.ItemFlags:
+        if not index.isValid():
+            return Qt.ItemIsDropEnabled  # entries are dropped between the others, never onto them
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsDragEnabled
+        # page selection can be typed into PDF files' entries
+        return flags | Qt.ItemIsEditable if self.entries[index.row()].isPDF() else flags
+
+    def supportedDropActions(self) -> Qt.DropActions:
+        return Qt.MoveAction
+
+    def moveRows(self, sourceParent: QModelIndex, sourceRow: int, count: int, destinationParent: QModelIndex,
+                 destinationChild: int) -> bool:
+        """
+        Moves the rows in one update, used by the view when the entries are dragged
+
+        :param destinationChild: row before which the rows are placed, counted before they are moved
+        """
+        if sourceParent.isValid() or destinationParent.isValid() or count <= 0 or \
+                not self.beginMoveRows(sourceParent, sourceRow, sourceRow + count - 1, destinationParent,
+                                       destinationChild):
+            return False
+        moved = self.entries[sourceRow:sourceRow + count]
+        del self.entries[sourceRow:sourceRow + count]
+        position = destinationChild - count if destinationChild > sourceRow else destinationChild
+        self.entries[position:position] = moved
+        self.endMoveRows()
+        return True
+
+    def removeRows(self, row: int, count: int, parent: QModelIndex = QModelIndex()) -> bool:
+        if parent.isValid() or count <= 0 or row < 0 or row + count > len(self.entries):
+            return False
+        self.beginRemoveRows(parent, row, row + count - 1)
+        del self.entries[row:row + count]
+        self.endRemoveRows()
+        return True
+
+    def removeEntries(self, rows: List[int]) -> None:
+        """
+        Removes the entries, each run of adjacent rows in one update
+
+        :param rows: rows of the entries to be removed
+        """
+        runs = []  # [first row, number of rows] of every run of adjacent rows
+        for row in sorted(set(rows)):
+            if runs and sum(runs[-1]) == row:
+                runs[-1][1] += 1
+            else:
+                runs.append([row, 1])
+        if len(runs) > self.MAX_REMOVED_RUNS:
+            removed = set(rows)
+            self.beginResetModel()
+            self.entries = [x for i, x in enumerate(self.entries) if i not in removed]
+            self.endResetModel()
+        else:
+            # runs are removed from the bottom, so the rows of the others do not change
+            for row, count in reversed(runs):
+                self.removeRows(row, count)
+
+    def reorder(self, order: List[int]) -> None:
+        """
+        Puts the entries in a new order in one update, the selection (and other persistent indexes) follows them
+
+        :param order: old rows of all the entries, in their new order
+        """
+        self.layoutAboutToBeChanged.emit([], QAbstractItemModel.VerticalSortHint)
+        newRows = [0] * len(order)
+        for newRow, oldRow in enumerate(order):
+            newRows[oldRow] = newRow
+        persistent = self.persistentIndexList()
+        self.changePersistentIndexList(persistent, [self.index(newRows[x.row()]) for x in persistent])
+        self.entries = [self.entries[x] for x in order]
+        self.layoutChanged.emit([], QAbstractItemModel.VerticalSortHint)
+
+    def sortEntries(self, key: Callable[[FileEntry], Any]) -> None:
+        """
+        Sorts the entries in one update, entries with equal keys keep their order
+
+        :param key: function returning the key of an entry
+        """
+        self.reorder(sorted(range(len(self.entries)), key=lambda x: key(self.entries[x])))
+
+    def insertEntries(self, row: int, entries: List[FileEntry]) -> None:
+        """
+        Inserts the entries in one update
+
+        :param row: row before which the entries are inserted
+        :param entries: entries to be inserted
+        """
+        if not entries:
+            return
+        self.beginInsertRows(QModelIndex(), row, row + len(entries) - 1)
+        self.entries[row:row] = entries
+        self.endInsertRows()
+
+    def appendPaths(self, paths: List[Path]) -> None:
+        """
+        :param paths: paths to the files to be added at the end of the list
+        """
+        self.insertEntries(len(self.entries), [FileEntry(x if isinstance(x, Path) else Path(x)) for x in paths])
+
+    def clear(self) -> None:
+        self.beginResetModel()
+        self.entries = []
+        self.endResetModel()
@@ -1,19 +1,57 @@
+import json
+import os
 import sys
+import tempfile
+import threading
 import unittest
+from io import BytesIO
 from pathlib import Path
+from unittest.mock import patch
 
-from PyQt5.Qt import QApplication
+from PIL import Image
+from PyPDF2 import PdfFileReader, PdfFileWriter
+from PyPDF2.generic import (ArrayObject, DecodedStreamObject, DictionaryObject, NameObject, NullObject,
+                            NumberObject)
+from PyQt5.Qt import QApplication, QModelIndex, QSize, Qt
 
+from engine import (DiskCache, ImageFragments, PDFMerger, PDFWriter, ReaderCache, SplitWriter, getPage, imagePage,
+                    jobFingerprint, loadImage, makeThumbnail, naturalKey, pageCount, parsePageSelection, partPath,
+                    resolvePageSelection, scanFiles, splitPDF, uniqueNames, validateFiles, walkPageTree)
+from jobs import Job, JobCancelled, ProgressTracker, ScanJob, SplitJob
 from main import PDFMaker
+from models import FilesModel, Thumbnails
 
 app = QApplication(sys.argv)
 
 
 class PDFMakerTest(unittest.TestCase):
     def setUp(self) -> None:
+        # thumbnails, encoded images, outputs and checkpoints are kept in a temporary directory, not the user's cache
+        self.cacheDir = tempfile.TemporaryDirectory()
+        cacheDirectory = patch('main.cacheDirectory', return_value=Path(self.cacheDir.name))
+        cacheDirectory.start()
+        self.addCleanup(cacheDirectory.stop)
         self.form = PDFMaker()
         self.form.testingMode = True
 
+    def tearDown(self) -> None:
+        self.form.close()  # stops the background threads of the window
+        self.cacheDir.cleanup()
+
+    def waitForJob(self) -> None:
+        """
+        Waits until the job running in the background is done and delivers its signals
+        """
+        self.form.threadPool.waitForDone()
+        app.processEvents()
+
+    def test_are_caches_in_cache_directory(self):
+        cacheDir = Path(self.cacheDir.name)
+        assert self.form.checkpointDir == cacheDir / 'jobs'
+        assert self.form.thumbnails.cacheDirectory == cacheDir / 'thumbnails'
+        assert self.form.getOutputCache().directory == cacheDir / 'outputs'
+        assert self.form.getImageFragments().cache.directory == cacheDir / 'fragments'
+
     def test_are_chosen_files_empty_on_start(self):
         assert self.form.chosenFiles == []
 
@@ -23,61 +61,1102 @@ class PDFMakerTest(unittest.TestCase):
 
     def test_are_items_in_correct_order_after_moving_down(self):
         self.form.chooseFilesHandler()
-        allItems = [self.form.filesList.item(i) for i in range(0, self.form.filesList.count())]
-        self.form.moveItem(allItems[2:4], down_direction=True)
-        itemsAfter = [self.form.filesList.item(i) for i in range(0, self.form.filesList.count())]
+        allItems = list(self.form.filesModel.entries)
+        self.form.moveItem([2, 3], down_direction=True)
+        itemsAfter = list(self.form.filesModel.entries)
         desired = ['test1.png', 'test2.png', 'test5.png', 'test3.png', 'test4.png', 'test6.png', 'test7.png', ]
-        assert all(x.text() == y for x, y in zip(itemsAfter, desired))
+        assert [x.text for x in itemsAfter] == desired
 
     def test_are_items_in_correct_order_after_moving_to_bottom(self):
         self.form.chooseFilesHandler()
-        allItems = [self.form.filesList.item(i) for i in range(0, self.form.filesList.count())]
-        self.form.moveItem(allItems[1:5], down_direction=True, to_edge=True)
-        itemsAfter = [self.form.filesList.item(i) for i in range(0, self.form.filesList.count())]
+        allItems = list(self.form.filesModel.entries)
+        self.form.moveItem([1, 2, 3, 4], down_direction=True, to_edge=True)
+        itemsAfter = list(self.form.filesModel.entries)
         desired = ['test1.png', 'test6.png', 'test7.png', 'test2.png', 'test3.png', 'test4.png', 'test5.png', ]
-        assert all(x.text() == y for x, y in zip(itemsAfter, desired))
+        assert [x.text for x in itemsAfter] == desired
 
     def test_are_items_in_correct_order_after_moving_up(self):
         self.form.chooseFilesHandler()
-        allItems = [self.form.filesList.item(i) for i in range(0, self.form.filesList.count())]
-        self.form.moveItem(allItems[3:5], down_direction=False)
-        itemsAfter = [self.form.filesList.item(i) for i in range(0, self.form.filesList.count())]
+        allItems = list(self.form.filesModel.entries)
+        self.form.moveItem([3, 4], down_direction=False)
+        itemsAfter = list(self.form.filesModel.entries)
         desired = ['test1.png', 'test2.png', 'test4.png', 'test5.png', 'test3.png', 'test6.png', 'test7.png', ]
-        assert all(x.text() == y for x, y in zip(itemsAfter, desired))
+        assert [x.text for x in itemsAfter] == desired
 
     def test_are_items_in_correct_order_after_moving_to_top(self):
         self.form.chooseFilesHandler()
-        allItems = [self.form.filesList.item(i) for i in range(0, self.form.filesList.count())]
-        self.form.moveItem(allItems[5:], down_direction=False, to_edge=True)
-        itemsAfter = [self.form.filesList.item(i) for i in range(0, self.form.filesList.count())]
+        allItems = list(self.form.filesModel.entries)
+        self.form.moveItem([5, 6], down_direction=False, to_edge=True)
+        itemsAfter = list(self.form.filesModel.entries)
         desired = ['test6.png', 'test7.png', 'test1.png', 'test2.png', 'test3.png', 'test4.png', 'test5.png', ]
-        assert all(x.text() == y for x, y in zip(itemsAfter, desired))
+        assert [x.text for x in itemsAfter] == desired
 
     def test_not_moving_up_items_if_already_at_top(self):
         self.form.chooseFilesHandler()
-        allItems = [self.form.filesList.item(i) for i in range(0, self.form.filesList.count())]
-        self.form.moveItem(allItems[0:2], down_direction=False)
-        itemsAfter = [self.form.filesList.item(i) for i in range(0, self.form.filesList.count())]
+        allItems = list(self.form.filesModel.entries)
+        self.form.moveItem([0, 1], down_direction=False)
+        itemsAfter = list(self.form.filesModel.entries)
         assert allItems == itemsAfter
 
     def test_not_moving_down_items_if_already_at_bottom(self):
         self.form.chooseFilesHandler()
-        allItems = [self.form.filesList.item(i) for i in range(0, self.form.filesList.count())]
-        self.form.moveItem(allItems[5:], down_direction=True)
-        itemsAfter = [self.form.filesList.item(i) for i in range(0, self.form.filesList.count())]
+        allItems = list(self.form.filesModel.entries)
+        self.form.moveItem([5, 6], down_direction=True)
+        itemsAfter = list(self.form.filesModel.entries)
         assert allItems == itemsAfter
 
     def test_are_chosen_files_in_correct_order(self):
         self.form.chooseFilesHandler()
-        allItems = [self.form.filesList.item(i) for i in range(0, self.form.filesList.count())]
-        self.form.moveItem(allItems[2:5], down_direction=False)
-        self.form.moveItem(allItems[0:1], down_direction=True, to_edge=True)
+        allItems = list(self.form.filesModel.entries)
+        self.form.moveItem([2, 3, 4], down_direction=False)
+        self.form.moveItem([0], down_direction=True, to_edge=True)
         self.form.orderFiles()
         desired = ['test3.png', 'test4.png', 'test5.png', 'test2.png', 'test6.png', 'test7.png', 'test1.png', ]
         assert all(x.name == y for x, y in zip(self.form.chosenFiles, desired))
 
+    def test_are_files_of_the_same_name_ordered(self):
+        paths = [Path(f'/scans/{x}/page.png') for x in ('a', 'b', 'c')]
+        self.form.chosenFiles = list(paths)
+        self.form.filesModel.appendPaths(paths)
+        self.form.moveItem([0], down_direction=True, to_edge=True)
+        self.form.orderFiles()
+        assert self.form.chosenFiles == [paths[1], paths[2], paths[0]]
+        assert self.form.filesModel.data(self.form.filesModel.index(2), FilesModel.PATH_ROLE) == paths[0]
+
     def test_are_added_items_in_list(self):
         self.form.chooseFilesHandler()
         self.form.addItem()
         desired = ['test1.png', 'test2.png', 'test3.png', 'test4.png', 'test5.png', 'test6.png', 'test7.png', ] * 2
         assert all(x.name == y for x, y in zip(self.form.chosenFiles, desired))
+
+    def test_are_chosen_files_in_correct_order_with_page_selection(self):
+        self.form.chooseFilesHandler()
+        self.form.filesModel.setData(self.form.filesModel.index(0), 'test1.png[1-2]')
+        self.form.moveItem([0], down_direction=True, to_edge=True)
+        self.form.orderFiles()
+        assert self.form.chosenFiles[-1].name == 'test1.png'
+
+    def test_are_many_files_listed_in_one_update(self):
+        inserted = []
+        self.form.filesModel.rowsInserted.connect(lambda parent, first, last: inserted.append((first, last)))
+        self.form.filesModel.appendPaths(Path(f'/scans/{i}.png') for i in range(100000))
+        assert inserted == [(0, 99999)] and self.form.filesModel.rowCount() == 100000
+        assert self.form.filesModel.data(self.form.filesModel.index(99999)) == '99999.png'
+
+    def test_are_moved_items_kept_selected(self):
+        self.form.chooseFilesHandler()
+        selection = self.form.filesList.selectionModel()
+        for row in (1, 3):
+            selection.select(self.form.filesModel.index(row), selection.Select)
+        self.form.moveItem(self.form.selectedRows(), down_direction=False, to_edge=True)
+        assert self.form.selectedRows() == [0, 1]
+        assert [x.text for x in self.form.filesModel.entries[:3]] == ['test2.png', 'test4.png', 'test1.png']
+        # rows dragged in the view are moved by the model in one step
+        model = self.form.filesModel
+        assert model.moveRows(QModelIndex(), 0, 2, QModelIndex(), 7)
+        assert [x.text for x in model.entries[-3:]] == ['test7.png', 'test2.png', 'test4.png']
+
+    def test_are_scattered_items_deleted_and_moved_in_one_update(self):
+        paths = [Path(f'/scans/{i % 2}/{i // 2}.png') for i in range(20000)]
+        self.form.chosenFiles = list(paths)
+        model = self.form.filesModel
+        model.appendPaths(paths)
+        layouts = []
+        model.layoutChanged.connect(lambda *args: layouts.append(args))
+        self.form.moveItem(list(range(1, 20000, 2)), down_direction=False, to_edge=True)
+        assert len(layouts) == 1
+        assert [x.path for x in model.entries[:2]] == [paths[1], paths[3]] and model.entries[-1].path == paths[-2]
+        # only the deleted entries are removed, not the others of the same name
+        resets = []
+        model.modelReset.connect(lambda: resets.append(True))
+        self.form.deleteItem(list(range(0, 20000, 2)))
+        assert len(resets) == 1 and model.rowCount() == 10000
+        assert self.form.chosenFiles == [x.path for x in model.entries] == paths[3::4] + paths[2::4]
+        self.form.deleteItem([0, 1, 2, 9999])
+        assert model.rowCount() == 9996 and self.form.chosenFiles[0] == paths[15]
+
+    def test_are_folders_searched_in_background(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            tmpDir = Path(tmpDir)
+            for name in ('b/2.png', 'b/10.PDF', 'a/c/1.jpg', 'a/notes.txt', '0.tif', 'z.png'):
+                (tmpDir / name).parent.mkdir(parents=True, exist_ok=True)
+                (tmpDir / name).touch()
+            self.form.addFolder()
+            self.form.scanPaths([tmpDir / 'a', tmpDir / 'z.png', tmpDir / 'b', tmpDir / 'missing'])
+            self.form.scanPool.waitForDone()
+            app.processEvents()
+            names = [x.name for x in self.form.chosenFiles]
+            assert names[:7] == [f'test{i}.png' for i in range(1, 8)]
+            assert names[7:] == ['1.jpg', 'z.png', '10.PDF', '2.png']
+            assert [x.path for x in self.form.filesModel.entries] == self.form.chosenFiles
+            assert not self.form.scanners and self.form.makePDFPush.text() == 'Merge to PDF'
+
+            # files are streamed in batches, and batches of a search which was cancelled are dropped
+            assert list(scanFiles([tmpDir], {'.png'}, batchSize=1)) == [[tmpDir / 'z.png'], [tmpDir / 'b' / '2.png']]
+            batches = []
+            assert ScanJob([tmpDir]).run(batches.append) == 5 and len(batches) == 1
+            gate = threading.Event()
+            self.form.scanPool.start(gate.wait)  # holds the only thread, so the search waits in the queue
+            self.form.scanPaths([tmpDir])
+            self.form.chooseFilesHandler()
+            gate.set()
+            self.form.scanPool.waitForDone()
+            app.processEvents()
+            assert len(self.form.chosenFiles) == 7 and not self.form.scanners
+
+    def test_are_files_sorted_by_metadata_read_in_background(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            tmpDir = Path(tmpDir)
+            paths = [makeTestPDF(tmpDir / 'doc10.pdf', 3), makeTestPDF(tmpDir / 'Doc9.pdf', 1)]
+            for name, size, taken in (('img2.jpg', 300, '2021:05:01 10:00:00'), ('img1.jpg', 50, None),
+                                      ('img11.jpg', 100, '2019:12:31 23:59:59')):
+                exif = Image.Exif()
+                if taken:
+                    exif[306] = taken
+                Image.new('RGB', (size, size), (size, 0, 0)).save(tmpDir / name, exif=exif)
+                paths.append(tmpDir / name)
+            self.form.chosenFiles = list(paths)
+            self.form.filesModel.appendPaths(paths)
+            model = self.form.filesModel
+            selection = self.form.filesList.selectionModel()
+            selection.select(model.index(0), selection.Select)
+
+            def names():
+                return [x.path.name for x in model.entries]
+
+            self.form.sortFiles('name')
+            assert names() == ['Doc9.pdf', 'doc10.pdf', 'img1.jpg', 'img2.jpg', 'img11.jpg']
+            assert self.form.selectedRows() == [1]
+            # the metadata is read once, in the background
+            self.form.sortFiles('pages')
+            assert names()[0] == 'Doc9.pdf' and self.form.infoWorker is not None
+            self.form.scanPool.waitForDone()
+            app.processEvents()
+            assert names() == ['Doc9.pdf', 'img1.jpg', 'img2.jpg', 'img11.jpg', 'doc10.pdf']
+            assert self.form.infoWorker is None and len(self.form.filesInfo) == 5
+            with patch('jobs.readFilesInfo', side_effect=AssertionError):
+                self.form.sortFiles('taken')
+                assert names() == ['img11.jpg', 'img2.jpg', 'Doc9.pdf', 'doc10.pdf', 'img1.jpg']
+                self.form.sortFiles('size')
+                sizes = [x.path.stat().st_size for x in model.entries]
+                assert sizes == sorted(sizes) and names().index('img1.jpg') < names().index('img2.jpg')
+
+    def test_are_pages_rotated_and_reordered(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            source = makeNestedPDF(Path(tmpDir) / 'tree.pdf')
+            self.form.chosenFiles = [source]
+            self.form.filesModel.appendPaths([source])
+            self.form.filesModel.setData(self.form.filesModel.index(0), 'tree.pdf[2-4]')
+            self.form.expandPages([0])
+            texts = [x.text for x in self.form.filesModel.entries]
+            assert texts == ['tree.pdf[2]', 'tree.pdf[3]', 'tree.pdf[4]']
+            assert self.form.chosenFiles == [source] * 3
+            self.form.rotateItems([0, 2], 90)
+            self.form.rotateItems([2], 180)
+            self.form.moveItem([0], down_direction=True, to_edge=True)
+            self.form.deleteItem([0])
+            assert len(self.form.chosenFiles) == 2
+
+            self.form.outputDir = Path(tmpDir)
+            self.form.showMessageBox = lambda message, is_error: None
+            self.form.customNameCheck.setChecked(True)
+            self.form.customNameLine.setText('output')
+            self.form.makePDF()
+            self.waitForJob()
+            assert self.form.createdFiles == [Path(tmpDir) / 'output.pdf']
+            result = PdfFileReader(str(Path(tmpDir) / 'output.pdf'))
+            assert [result.getPage(i).mediaBox.getWidth() for i in range(2)] == [400, 200]
+            # the fourth page inherits /Rotate 90 from its node
+            assert [result.getPage(i)['/Rotate'] for i in range(2)] == [0, 90]
+
+    def test_is_job_run_in_background(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            tmpDir = Path(tmpDir)
+            for i in range(2):
+                path = makeTestPDF(tmpDir / f'{i}.pdf', 2)
+                self.form.chosenFiles.append(path)
+                self.form.filesModel.appendPaths([path])
+            (tmpDir / '1.pdf').write_bytes(b'not a PDF file')
+            self.form.outputDir = tmpDir
+            self.form.checkpointDir = tmpDir / 'jobs'
+            messages = []
+            self.form.showMessageBox = lambda message, is_error: messages.append((message, is_error))
+            self.form.makePDF()
+            # the next job can be queued right away, the entries of the jobs change when their signals are delivered
+            assert self.form.makePDFPush.isEnabled() and self.form.jobsList.count() == 1
+            self.waitForJob()
+            assert self.form.jobsList.item(0).text() == '0.pdf and 1 more — Failed'
+            assert messages[0][1] and messages[0][0].startswith('0.pdf and 1 more: Some files cannot be used:\n1.pdf')
+            assert self.form.progressBar.isHidden() and not self.form.workers
+
+    def test_are_queued_jobs_run(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            tmpDir = Path(tmpDir)
+            for i in range(2):
+                path = makeTestPDF(tmpDir / f'{i}.pdf', 2)
+                self.form.chosenFiles.append(path)
+                self.form.filesModel.appendPaths([path])
+            self.form.outputDir = tmpDir
+            self.form.checkpointDir = tmpDir / 'jobs'
+            # the only thread is held (the pool starts one thread whatever its maximum is), so the jobs are queued
+            gate = threading.Event()
+            self.form.threadPool.setMaxThreadCount(1)
+            self.form.threadPool.start(gate.wait)
+            self.form.showMessageBox = lambda message, is_error: None
+            self.form.customNameCheck.setChecked(True)
+            for name in ('first', 'second', 'third'):
+                self.form.customNameLine.setText(name)
+                self.form.makePDF()
+            self.form.jobsList.item(1).setSelected(True)
+            self.form.cancelJob()
+            assert self.form.jobsList.item(1).text() == 'second.pdf — Cancelled' and len(self.form.workers) == 2
+            self.form.jobsList.clearSelection()
+            self.form.jobsList.item(0).setSelected(True)
+            self.form.pauseJob()
+            assert self.form.pausePush.text() == 'Resume'
+
+            # the paused job holds the only thread, so the third one is still queued
+            gate.set()
+            self.form.threadPool.waitForDone(200)
+            app.processEvents()
+            assert self.form.jobsList.item(2).text() == 'third.pdf — Queued'
+            self.form.pauseJob()
+            self.waitForJob()
+            texts = [self.form.jobsList.item(i).text() for i in range(3)]
+            assert texts == ['first.pdf — Done', 'second.pdf — Cancelled', 'third.pdf — Done']
+            assert sorted(x.name for x in tmpDir.glob('*.pdf')) == ['0.pdf', '1.pdf', 'first.pdf', 'third.pdf']
+
+            # a job queued with the name of an earlier one does not overwrite its output
+            self.form.customNameLine.setText('fourth')
+            self.form.makePDF()
+            self.form.makePDF()
+            self.waitForJob()
+            assert self.form.jobsList.item(4).text() == 'fourth.pdf — Failed'
+
+    def test_is_identical_job_reused(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            tmpDir = Path(tmpDir)
+            for i in range(3):
+                Image.new('RGB', (100, 50), (i * 100, 0, 0)).save(tmpDir / f'{i}.png')
+                self.form.chosenFiles.append(tmpDir / f'{i}.png')
+                self.form.filesModel.appendPaths([tmpDir / f'{i}.png'])
+            self.form.outputDir = tmpDir
+            self.form.outputCache = DiskCache(tmpDir / 'cache', 1024 ** 2)
+            self.form.imageFragments = ImageFragments(DiskCache(tmpDir / 'fragments', 1024 ** 2))
+            self.form.showMessageBox = lambda message, is_error: None
+            self.form.reuseCheck.setChecked(True)
+            self.form.customNameCheck.setChecked(True)
+            for name in ('first', 'second'):
+                self.form.customNameLine.setText(name)
+                self.form.makePDF()
+                self.waitForJob()
+            # the second output is a copy of the first one, kept in the cache, so changing it changes nothing else
+            assert (tmpDir / 'first.pdf').read_bytes() == (tmpDir / 'second.pdf').read_bytes()
+            assert (tmpDir / 'first.pdf').stat().st_ino != (tmpDir / 'second.pdf').stat().st_ino
+            assert PdfFileReader(str(tmpDir / 'second.pdf')).getNumPages() == 3
+            size = (tmpDir / 'first.pdf').stat().st_size
+            with open(tmpDir / 'second.pdf', 'ab') as f:
+                f.write(b'%appended')
+            assert (tmpDir / 'first.pdf').stat().st_size == size
+            assert self.form.outputCache.get(next(iter(self.form.outputCache.index)))[0].stat().st_size == size
+
+            # a changed option gives a different job
+            self.form.optimizeSizeCheck.setChecked(True)
+            self.form.customNameLine.setText('third')
+            self.form.makePDF()
+            self.waitForJob()
+            assert len(self.form.outputCache.index) == 2
+
+    def test_is_interrupted_merge_resumed(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            tmpDir = Path(tmpDir)
+            for i in range(4):
+                path = makeTestPDF(tmpDir / f'{i}.pdf', i + 1)
+                self.form.chosenFiles.append(path)
+                self.form.filesModel.appendPaths([path])
+            self.form.outputDir = tmpDir
+            self.form.checkpointDir = tmpDir / 'jobs'
+            self.form.CHECKPOINT_PAGES = 2
+            self.form.showMessageBox = lambda message, is_error: None
+            self.form.customNameCheck.setChecked(True)
+            self.form.customNameLine.setText('output')
+
+            # the job stops after the pages of the third file were merged, but before they were written
+            def stop(report):
+                if report.pages == 1 + 2 + 3:
+                    raise KeyboardInterrupt
+            self.form.startJob = lambda job, message: job.run(progress=stop)
+            with self.assertRaises(KeyboardInterrupt), patch.object(ProgressTracker, 'INTERVAL', 0):
+                self.form.makePDF()
+            partial = tmpDir / 'output.pdf.part'
+            assert partial.exists() and not (tmpDir / 'output.pdf').exists()
+            written = partial.read_bytes()
+            with open(partial, 'ab') as f:
+                f.write(b'garbage of an unfinished batch')
+
+            del self.form.startJob
+            self.form.makePDF()
+            self.waitForJob()
+            output = (tmpDir / 'output.pdf').read_bytes()
+            assert output.startswith(written) and b'garbage' not in output
+            assert PdfFileReader(str(tmpDir / 'output.pdf')).getNumPages() == 10
+            assert not partial.exists() and not list((tmpDir / 'jobs').iterdir())
+
+
+def makeTestPDF(path: Path, pages: int, content: bytes = b'0 0 m 100 100 l S\n' * 200) -> Path:
+    """
+    Creates a PDF file with blank pages sharing one uncompressed content stream
+    """
+    writer = PdfFileWriter()
+    stream = DecodedStreamObject()
+    stream.setData(content)
+    streamRef = writer._addObject(stream)
+    for _ in range(pages):
+        page = writer.addBlankPage(200, 200)
+        page[NameObject('/Contents')] = streamRef
+    with open(path, 'wb') as f:
+        writer.write(f)
+    return path
+
+
+def makeNestedPDF(path: Path) -> Path:
+    """
+    Creates a PDF file with pages 100 to 500 points wide in a page tree of two nodes, the second one passing /Rotate
+    down to its pages
+    """
+    writer = PdfFileWriter()
+    for width in range(100, 600, 100):
+        writer.addBlankPage(width, 100)
+    root = writer.getObject(writer._pages)
+    kids = list(root['/Kids'])
+    nodes = ArrayObject()
+    for pages, extra in ((kids[:3], {}), (kids[3:], {NameObject('/Rotate'): NumberObject(90)})):
+        node = DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'), NameObject('/Kids'): ArrayObject(pages),
+            NameObject('/Count'): NumberObject(len(pages)), **extra,
+        })
+        nodeRef = writer._addObject(node)
+        for page in pages:
+            page.getObject()[NameObject('/Parent')] = nodeRef
+        nodes.append(nodeRef)
+    root[NameObject('/Kids')] = nodes
+    with open(path, 'wb') as f:
+        writer.write(f)
+    return path
+
+
+def makeXrefStreamPDF(path: Path, pages: int) -> Path:
+    """
+    Creates a PDF file with blank pages 200 points wide, its catalog, page tree and pages kept in an object stream and
+    indexed by a cross-reference stream (as PDF 1.5 producers write them)
+    """
+    kids = b' '.join(b'%d 0 R' % (i + 3) for i in range(pages))
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>', b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, pages)]
+    objects += [b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 200 200] >>'] * pages
+    offsets, body = [], b''
+    for obj in objects:
+        offsets.append(len(body))
+        body += obj + b'\n'
+    header = b' '.join(b'%d %d' % (i + 1, x) for i, x in enumerate(offsets)) + b'\n'
+    streamNumber = len(objects) + 1
+    data = b'%PDF-1.5\n'
+    streamPosition = len(data)
+    data += b'%d 0 obj\n<< /Type /ObjStm /N %d /First %d /Length %d >>\nstream\n%s%s\nendstream\nendobj\n' % (
+        streamNumber, len(objects), len(header), len(header + body), header, body)
+    # entries of the free head, the objects in the object stream, the object stream and the cross-reference stream
+    xrefPosition = len(data)
+    entries = [(0, 0, 65535)] + [(2, streamNumber, i) for i in range(len(objects))]
+    entries += [(1, streamPosition, 0), (1, xrefPosition, 0)]
+    table = b''.join(bytes([kind]) + a.to_bytes(4, 'big') + b.to_bytes(2, 'big') for kind, a, b in entries)
+    data += b'%d 0 obj\n<< /Type /XRef /Size %d /W [1 4 2] /Root 1 0 R /Length %d >>\n' % (
+        streamNumber + 1, len(entries), len(table))
+    data += b'stream\n%s\nendstream\nendobj\n' % table
+    path.write_bytes(data + b'startxref\n%d\n%%%%EOF\n' % xrefPosition)
+    return path
+
+
+class EngineTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.tmpDir = Path(self.tmp.name)
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_are_content_streams_compressed(self):
+        first = makeTestPDF(self.tmpDir / 'first.pdf', 2)
+        second = makeTestPDF(self.tmpDir / 'second.pdf', 3)
+        plain, compressed = self.tmpDir / 'plain.pdf', self.tmpDir / 'compressed.pdf'
+        for path, level in ((plain, None), (compressed, 9)):
+            merged = PDFMerger(compressionLevel=level)
+            merged.append(PdfFileReader(str(first)))
+            merged.append(PdfFileReader(str(second)))
+            merged.write(str(path))
+        reader = PdfFileReader(str(compressed))
+        assert reader.getNumPages() == 5
+        assert all(reader.getPage(i)['/Contents']['/Filter'] == '/FlateDecode' for i in range(5))
+        assert reader.getPage(4).getContents().getData() == b'0 0 m 100 100 l S\n' * 200
+        assert compressed.stat().st_size < plain.stat().st_size
+
+    def test_are_images_downsampled(self):
+        source = self.tmpDir / 'scan.pdf'
+        Image.new('RGB', (2400, 2400), (10, 200, 30)).save(source, resolution=300)
+        output = self.tmpDir / 'output.pdf'
+        merged = PDFMerger(maxImageDPI=150)
+        merged.append(PdfFileReader(str(source)))
+        merged.append(PdfFileReader(str(source)))
+        merged.write(str(output))
+        reader = PdfFileReader(str(output))
+        images = [reader.getPage(i)['/Resources']['/XObject']['/image'] for i in range(2)]
+        assert all(x['/Width'] == 1200 and x['/Height'] == 1200 for x in images)
+        assert output.stat().st_size < source.stat().st_size * 2
+
+    def test_are_damaged_images_kept(self):
+        source = self.tmpDir / 'scan.pdf'
+        Image.new('RGB', (2400, 2400), (10, 200, 30)).save(source, resolution=300)
+        damaged = PdfFileReader(str(source))
+        image = damaged.getPage(0)['/Resources']['/XObject']['/image'].getObject()
+        image._data = image._data[:1000]  # the image file is truncated
+        output = self.tmpDir / 'output.pdf'
+        merged = PDFMerger(maxImageDPI=150)
+        merged.append(PdfFileReader(str(source)))
+        merged.append(damaged)
+        merged.write(str(output))
+        reader = PdfFileReader(str(output))
+        images = [reader.getPage(i)['/Resources']['/XObject']['/image'] for i in range(2)]
+        assert [x['/Width'] for x in images] == [1200, 2400] and images[1]._data == image._data
+
+    def test_is_repeated_document_copied_once(self):
+        cover = self.tmpDir / 'cover.pdf'
+        Image.new('RGB', (600, 600), (200, 30, 30)).save(cover)
+        single, repeated = self.tmpDir / 'single.pdf', self.tmpDir / 'repeated.pdf'
+        for path, count in ((single, 1), (repeated, 5)):
+            merged = PDFMerger()
+            with ReaderCache() as readers:
+                for _ in range(count):
+                    merged.append(readers.get(cover))
+                assert len(readers.readers) == 1
+                merged.write(str(path))
+        assert PdfFileReader(str(repeated)).getNumPages() == 5
+        assert repeated.stat().st_size < single.stat().st_size * 1.5
+
+    def test_are_unused_resources_dropped(self):
+        writer = PdfFileWriter()
+        fonts = {}
+        for name in ('/F1', '/F2'):
+            fontFile = DecodedStreamObject()
+            fontFile.setData(bytes(range(256)) * 100)
+            fonts[NameObject(name)] = writer._addObject(DictionaryObject({
+                NameObject('/Type'): NameObject('/Font'), NameObject('/FontFile'): writer._addObject(fontFile),
+            }))
+        resources = writer._addObject(DictionaryObject({NameObject('/Font'): DictionaryObject(fonts)}))
+        content = DecodedStreamObject()
+        content.setData(b'BT /F1 12 Tf (text) Tj ET')
+        page = writer.addBlankPage(200, 200)
+        page[NameObject('/Contents')] = writer._addObject(content)
+        page[NameObject('/Resources')] = resources
+        source = self.tmpDir / 'fonts.pdf'
+        with open(source, 'wb') as f:
+            writer.write(f)
+
+        # the resources are pruned when the output is optimized, a plain merge does not decode the content streams
+        plain, output = self.tmpDir / 'plain.pdf', self.tmpDir / 'output.pdf'
+        for path, maxImageDPI in ((plain, None), (output, 150)):
+            merged = PDFMerger(maxImageDPI=maxImageDPI)
+            with ReaderCache() as readers:
+                merged.append(readers.get(source))
+                with patch.object(DecodedStreamObject, 'getData', autospec=True,
+                                  side_effect=DecodedStreamObject.getData) as getData:
+                    merged.write(str(path))
+            assert getData.called == (maxImageDPI is not None)
+        assert list(PdfFileReader(str(plain)).getPage(0)['/Resources']['/Font']) == ['/F1', '/F2']
+        assert list(PdfFileReader(str(output)).getPage(0)['/Resources']['/Font']) == ['/F1']
+        assert output.stat().st_size < source.stat().st_size * 0.6
+
+    def test_are_resources_of_forms_kept(self):
+        writer = PdfFileWriter()
+        fonts = DictionaryObject({NameObject(x): writer._addObject(DictionaryObject({
+            NameObject('/Type'): NameObject('/Font'), NameObject('/BaseFont'): NameObject('/Helvetica'),
+        })) for x in ('/F1', '/F2', '/F3')})
+        # the forms have no resources of their own, so they use the page's fonts
+        forms = []
+        for font in (b'/F2', b'/F3'):
+            forms.append(DecodedStreamObject())
+            forms[-1].setData(b'BT %s 12 Tf (text) Tj ET' % font)
+            forms[-1].update({
+                NameObject('/Type'): NameObject('/XObject'), NameObject('/Subtype'): NameObject('/Form'),
+                NameObject('/BBox'): ArrayObject([NumberObject(x) for x in (0, 0, 200, 200)]),
+            })
+        content = DecodedStreamObject()
+        content.setData(b'BT /F1 12 Tf (text) Tj ET /Fm1 Do')
+        page = writer.addBlankPage(200, 200)
+        page[NameObject('/Contents')] = writer._addObject(content)
+        page[NameObject('/Resources')] = DictionaryObject({
+            NameObject('/Font'): fonts, NameObject('/XObject'): DictionaryObject({
+                NameObject('/Fm1'): writer._addObject(forms[0]), NameObject('/Fm2'): writer._addObject(forms[1]),
+            }),
+        })
+        source = self.tmpDir / 'forms.pdf'
+        with open(source, 'wb') as f:
+            writer.write(f)
+
+        output = self.tmpDir / 'output.pdf'
+        merged = PDFMerger(maxImageDPI=150)
+        merged.append(PdfFileReader(str(source)))
+        merged.write(str(output))
+        resources = PdfFileReader(str(output)).getPage(0)['/Resources']
+        assert sorted(resources['/Font']) == ['/F1', '/F2'] and list(resources['/XObject']) == ['/Fm1']
+
+    def test_are_unreachable_objects_dropped(self):
+        writer = PDFWriter()
+        writer.addBlankPage(200, 200)
+        orphan = DecodedStreamObject()
+        orphan.setData(b'x' * 10000)
+        writer._addObject(orphan)
+        output = self.tmpDir / 'output.pdf'
+        with open(output, 'wb') as f:
+            writer.write(f)
+        reader = PdfFileReader(str(output))
+        assert reader.getNumPages() == 1
+        assert reader.trailer['/Size'] == 5
+        assert output.stat().st_size < 1000
+
+    def test_is_page_selection_parsed(self):
+        assert parsePageSelection('report.pdf') == ('report.pdf', None)
+        assert parsePageSelection('report[1].pdf[1-2, 5,7-]') == ('report[1].pdf', [(1, 2), (5, 5), (7, None)])
+        assert resolvePageSelection([(1, 2), (5, 5), (7, None)], 8) == [0, 1, 4, 6, 7]
+        assert resolvePageSelection([(3, 1)], 3) == [2, 1, 0]
+        with self.assertRaises(ValueError):
+            parsePageSelection('report.pdf[1-2-3]')
+        with self.assertRaises(ValueError):
+            resolvePageSelection([(4, 4)], 3)
+
+    def test_are_selected_pages_merged(self):
+        source = makeNestedPDF(self.tmpDir / 'tree.pdf')
+        output = self.tmpDir / 'output.pdf'
+        merged = PDFMerger()
+        with ReaderCache() as readers:
+            reader = readers.get(source)
+            assert pageCount(reader) == 5
+            assert getPage(reader, 4)['/Rotate'] == 90
+            merged.appendPages(reader, resolvePageSelection(parsePageSelection('tree.pdf[5,1-2]')[1], 5))
+            merged.write(str(output))
+        result = PdfFileReader(str(output))
+        assert [result.getPage(i).mediaBox.getWidth() for i in range(3)] == [500, 100, 200]
+        assert result.getPage(0)['/Rotate'] == 90
+
+    def test_are_pages_left_out_not_copied_through_links(self):
+        writer = PdfFileWriter()
+        pages = []
+        for _ in range(200):
+            stream = DecodedStreamObject()
+            stream.setData(os.urandom(5000))
+            pages.append(writer.addBlankPage(200, 200))
+            pages[-1][NameObject('/Contents')] = writer._addObject(stream)
+        link = DictionaryObject({NameObject('/Type'): NameObject('/Annot'), NameObject('/Subtype'): NameObject('/Link'),
+                                 NameObject('/Dest'): ArrayObject([writer.getReference(pages[150]),
+                                                                   NameObject('/Fit')])})
+        pages[0][NameObject('/Annots')] = ArrayObject([writer._addObject(link)])
+        source, output = self.tmpDir / 'linked.pdf', self.tmpDir / 'output.pdf'
+        with open(source, 'wb') as f:
+            writer.write(f)
+        merged = PDFMerger()
+        with ReaderCache() as readers:
+            merged.appendPages(readers.get(source), [0])
+            merged.write(str(output))
+        assert output.stat().st_size < 10000 < source.stat().st_size
+        result = PdfFileReader(str(output))
+        assert result.getNumPages() == 1
+        # the link's target is not a part of the output
+        assert isinstance(result.getPage(0)['/Annots'][0].getObject()['/Dest'][0].getObject(), NullObject)
+
+    def test_are_mapped_files_merged(self):
+        first = makeTestPDF(self.tmpDir / 'first.pdf', 2)
+        second = makeTestPDF(self.tmpDir / 'second.pdf', 3)
+        outputs = []
+        for mapped in (False, True):
+            outputs.append(self.tmpDir / f'output{int(mapped)}.pdf')
+            merged = PDFMerger()
+            with ReaderCache(mapped=mapped) as readers:
+                merged.append(readers.get(first))
+                merged.append(readers.get(second))
+                merged.write(str(outputs[-1]))
+        assert outputs[0].read_bytes() == outputs[1].read_bytes()
+
+    def test_are_invalid_files_reported(self):
+        files = {name: self.tmpDir / name for name in (
+            'good.png', 'truncated.png', 'fake.png', 'good.pdf', 'truncated.pdf', 'fake.pdf', 'encrypted.pdf',
+        )}
+        Image.new('RGB', (300, 300), (20, 40, 60)).save(files['good.png'])
+        files['truncated.png'].write_bytes(files['good.png'].read_bytes()[:-20])
+        files['fake.png'].write_bytes(b'not an image')
+        makeTestPDF(files['good.pdf'], 2)
+        files['truncated.pdf'].write_bytes(files['good.pdf'].read_bytes()[:-40])
+        files['fake.pdf'].write_bytes(b'%PDF-1.3\nstartxref\n5\n%%EOF\n')
+        writer = PdfFileWriter()
+        writer.addBlankPage(100, 100)
+        writer.encrypt('password')
+        with open(files['encrypted.pdf'], 'wb') as f:
+            writer.write(f)
+
+        problems = validateFiles(list(files.values()) + [files['fake.png']])
+        assert [x.name for x in problems] == ['truncated.png', 'fake.png', 'truncated.pdf', 'fake.pdf', 'encrypted.pdf']
+        assert 'encrypted' in problems[files['encrypted.pdf']]
+
+    def test_are_images_with_appended_data_valid(self):
+        images = {}
+        for imageFormat in ('PNG', 'JPEG'):
+            data = BytesIO()
+            Image.effect_noise((200, 200), 80).convert('RGB').save(data, imageFormat)
+            images[imageFormat] = data.getvalue()
+        files = {name: self.tmpDir / name for name in ('motion.jpg', 'trailer.png', 'truncated.jpg', 'thumbnail.jpg')}
+        # e.g. the video of a motion photo, which may contain the end marker anywhere
+        files['motion.jpg'].write_bytes(images['JPEG'] + os.urandom(8192) + b'\xff\xd9' + bytes(4096))
+        files['trailer.png'].write_bytes(images['PNG'] + b'SEFT' * 1024)
+        files['truncated.jpg'].write_bytes(images['JPEG'][:len(images['JPEG']) // 2])
+        # the end marker of an embedded thumbnail does not end the image
+        thumbnail = BytesIO()
+        Image.new('RGB', (8, 8)).save(thumbnail, 'JPEG')
+        segment = b'\xff\xef' + (len(thumbnail.getvalue()) + 2).to_bytes(2, 'big') + thumbnail.getvalue()
+        files['thumbnail.jpg'].write_bytes(images['JPEG'][:2] + segment + images['JPEG'][2:len(images['JPEG']) // 2])
+        assert list(validateFiles(list(files.values()))) == [files['truncated.jpg'], files['thumbnail.jpg']]
+
+    def test_are_pages_appended_incrementally(self):
+        base = makeTestPDF(self.tmpDir / 'base.pdf', 2)
+        original = base.read_bytes()
+        scan = self.tmpDir / 'scan.pdf'
+        Image.new('RGB', (300, 400), (10, 200, 30)).save(scan)
+        for _ in range(2):
+            merged = PDFMerger(compressionLevel=6)
+            with ReaderCache() as readers:
+                merged.append(readers.get(scan))
+                merged.append(readers.get(base))
+                merged.appendTo(base)
+        assert base.read_bytes().startswith(original)
+        reader = PdfFileReader(str(base))
+        # the second update appends the file to itself, including the pages added by the first one
+        widths = [200, 200, 300, 200, 200]
+        assert [reader.getPage(i).mediaBox.getWidth() for i in range(reader.getNumPages())] == widths + [300] + widths
+        assert reader.getPage(10).getContents().getData() == b'0 0 m 100 100 l S\n' * 200
+
+    def test_are_pages_appended_to_xref_stream_file(self):
+        base = makeXrefStreamPDF(self.tmpDir / 'base.pdf', 2)
+        assert '/Size' not in PdfFileReader(str(base)).trailer
+        scan = self.tmpDir / 'scan.pdf'
+        Image.new('RGB', (300, 400), (10, 200, 30)).save(scan)
+        merged = PDFMerger()
+        with ReaderCache() as readers:
+            merged.append(readers.get(scan))
+            merged.appendTo(base)
+        reader = PdfFileReader(str(base))
+        assert [reader.getPage(i).mediaBox.getWidth() for i in range(reader.getNumPages())] == [200, 200, 300]
+        # the new objects are numbered after the existing ones, which are all kept
+        assert reader.trailer['/Size'] > 5 and reader.getPage(1).mediaBox.getWidth() == 200
+
+    def test_are_images_and_pdfs_merged_in_order(self):
+        pdf = makeTestPDF(self.tmpDir / 'doc.pdf', 2)
+        image = self.tmpDir / 'photo.png'
+        Image.new('RGBA', (3000, 1500), (200, 10, 10, 128)).save(image)
+        merged = PDFMerger()
+        with ReaderCache() as readers:
+            merged.appendImage(loadImage(image, 2000))
+            merged.append(readers.get(pdf))
+            merged.appendImage(loadImage(image, None))
+            merged.write(str(self.tmpDir / 'out.pdf'))
+        reader = PdfFileReader(str(self.tmpDir / 'out.pdf'))
+        sizes = [tuple(reader.getPage(i).mediaBox[2:]) for i in range(reader.getNumPages())]
+        assert sizes == [(2000, 1000), (200, 200), (200, 200), (3000, 1500)]
+        xObject = reader.getPage(0)['/Resources']['/XObject']['/image'].getObject()
+        assert xObject['/Filter'] == '/DCTDecode' and xObject['/ColorSpace'] == '/DeviceRGB'
+
+    def test_is_output_split_by_page_count(self):
+        pdf = makeTestPDF(self.tmpDir / 'doc.pdf', 7)
+        merged = PDFMerger(compressionLevel=6)
+        with ReaderCache() as readers:
+            merged.append(readers.get(pdf))
+            merged.append(readers.get(pdf))
+            paths = merged.writeParts(self.tmpDir / 'out.pdf', maxPages=3)
+        assert paths == [partPath(self.tmpDir / 'out.pdf', i) for i in range(1, 6)]
+        readers = [PdfFileReader(str(x)) for x in paths]
+        assert [x.getNumPages() for x in readers] == [3, 3, 3, 3, 2]
+        # objects shared by the pages are written to every part
+        assert all(x.getPage(0).getContents().getData() == b'0 0 m 100 100 l S\n' * 200 for x in readers)
+
+    def test_is_output_split_by_size(self):
+        maxBytes = 50000
+        with SplitWriter(self.tmpDir / 'out.pdf', maxBytes=maxBytes) as writer:
+            for _ in range(10):
+                # noise does not compress, so every page takes over 10 KB
+                writer.addPage(imagePage(Image.frombytes('RGB', (100, 100), os.urandom(30000))))
+        sizes = [x.stat().st_size for x in writer.paths]
+        assert all(x <= maxBytes for x in sizes) and len(sizes) < 10
+        assert sum(PdfFileReader(str(x)).getNumPages() for x in writer.paths) == 10
+        with self.assertRaises(FileExistsError):
+            with SplitWriter(self.tmpDir / 'out.pdf', maxPages=1) as writer:
+                writer.addPage(imagePage(Image.new('RGB', (10, 10))))
+
+    def test_is_pdf_split(self):
+        source = makeNestedPDF(self.tmpDir / 'tree.pdf')
+        with ReaderCache() as readers:
+            pages = walkPageTree(readers.get(source))
+        assert [inherited.get('/Rotate', 0) for _, inherited in pages] == [0, 0, 0, 90, 90]
+        for workers in (1, 2):
+            output = self.tmpDir / str(workers) / 'tree.pdf'
+            output.parent.mkdir()
+            paths = splitPDF(source, output, pagesPerPart=2, workers=workers)
+            assert paths == [partPath(output, i) for i in range(1, 4)]
+            readers = [PdfFileReader(str(x)) for x in paths]
+            pages = [x.getPage(i) for x in readers for i in range(x.getNumPages())]
+            assert [x.mediaBox.getWidth() for x in pages] == [100, 200, 300, 400, 500]
+            assert [x.get('/Rotate', 0) for x in pages] == [0, 0, 0, 90, 90]
+
+    def test_are_inherited_references_split(self):
+        writer = PdfFileWriter()
+        for _ in range(4):
+            page = writer.addBlankPage(100, 100)
+            del page['/Resources'], page['/MediaBox']
+        # the pages inherit their resources and size from the root of the page tree, both given by references
+        font = writer._addObject(DictionaryObject({NameObject('/Type'): NameObject('/Font'),
+                                                   NameObject('/BaseFont'): NameObject('/Helvetica')}))
+        root = writer.getObject(writer._pages)
+        root[NameObject('/Resources')] = writer._addObject(DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject('/F1'): font}),
+        }))
+        root[NameObject('/MediaBox')] = writer._addObject(ArrayObject([NumberObject(x) for x in (0, 0, 300, 200)]))
+        source = self.tmpDir / 'inherited.pdf'
+        with open(source, 'wb') as f:
+            writer.write(f)
+        output = self.tmpDir / 'inherited_out.pdf'
+        paths = splitPDF(source, output, pagesPerPart=1, workers=2)
+        pages = [PdfFileReader(str(x)).getPage(0) for x in paths]
+        assert len(pages) == 4 and all(x.mediaBox.getWidth() == 300 for x in pages)
+        assert all(x['/Resources']['/Font']['/F1']['/BaseFont'] == '/Helvetica' for x in pages)
+
+    def test_are_split_parts_removed_on_failure(self):
+        source = makeNestedPDF(self.tmpDir / 'tree.pdf')
+        for workers in (1, 2):
+            output = self.tmpDir / str(workers) / 'tree.pdf'
+            output.parent.mkdir()
+            partPath(output, 3).write_bytes(b'kept')
+            with self.assertRaises(FileExistsError):
+                splitPDF(source, output, pagesPerPart=1, workers=workers)
+            assert list(output.parent.iterdir()) == [partPath(output, 3)]
+
+    def test_is_split_of_one_file_stopped(self):
+        source = makeTestPDF(self.tmpDir / 'big.pdf', 40)
+        output = self.tmpDir / 'job'
+        output.mkdir()
+        job = SplitJob([source], output)
+
+        def progress(report):
+            if report.percent >= 10:
+                job.control.cancel()
+        with self.assertRaises(JobCancelled), patch.object(ProgressTracker, 'INTERVAL', 0):
+            job.run(progress)
+        assert not list(output.iterdir())
+
+        for workers in (1, 2):
+            output = self.tmpDir / str(workers)
+            output.mkdir()
+            fractions = []
+            assert len(splitPDF(source, output / 'big.pdf', workers=workers, progress=fractions.append)) == 40
+            assert fractions == sorted(fractions) and fractions[-1] == 1
+            calls = []
+
+            def interrupt():
+                calls.append(None)
+                if len(calls) == 3:
+                    raise JobCancelled()
+            for path in output.iterdir():
+                path.unlink()
+            with self.assertRaises(JobCancelled):
+                splitPDF(source, output / 'big.pdf', workers=workers, interrupt=interrupt)
+            assert len(calls) == 3 and not list(output.iterdir())
+
+    def test_are_files_of_same_name_split(self):
+        assert uniqueNames(['a.pdf', 'b.pdf', 'A.pdf', 'a (2).pdf']) == ['a.pdf', 'b.pdf', 'A (3).pdf', 'a (2).pdf']
+        sources = []
+        for folder in ('x', 'y', 'z'):
+            (self.tmpDir / folder).mkdir()
+            sources.append(makeNestedPDF(self.tmpDir / folder / 'tree.pdf'))
+        output = self.tmpDir / 'out'
+        output.mkdir()
+        paths = SplitJob(sources[:2], output, pagesPerPart=3).run()
+        assert [x.name for x in paths] == ['tree_1.pdf', 'tree_2.pdf', 'tree (2)_1.pdf', 'tree (2)_2.pdf']
+
+        # the parts of the files split before the failed one are removed too
+        for path in paths:
+            path.unlink()
+        (output / 'tree (3)_2.pdf').write_bytes(b'kept')
+        with self.assertRaises(FileExistsError):
+            SplitJob(sources, output, pagesPerPart=3).run()
+        assert [x.name for x in output.iterdir()] == ['tree (3)_2.pdf']
+
+    def test_is_job_fingerprint_based_on_contents(self):
+        for name, content in (('a', b'1'), ('b', b'2'), ('c', b'1')):
+            (self.tmpDir / name).write_bytes(content)
+        fingerprint = jobFingerprint([self.tmpDir / 'a', self.tmpDir / 'b'], {'level': 6})
+        assert fingerprint == jobFingerprint([self.tmpDir / 'c', self.tmpDir / 'b'], {'level': 6})
+        assert fingerprint != jobFingerprint([self.tmpDir / 'b', self.tmpDir / 'a'], {'level': 6})
+        assert fingerprint != jobFingerprint([self.tmpDir / 'a', self.tmpDir / 'b'], {'level': 7})
+
+    def test_are_least_recently_used_entries_evicted(self):
+        cache = DiskCache(self.tmpDir / 'cache', maxBytes=250)
+        for key in ('a', 'b'):
+            (self.tmpDir / key).write_bytes(key.encode() * 100)
+            cache.put(key, [self.tmpDir / key])
+        assert cache.get('a')[0].read_bytes() == b'a' * 100
+        cache.putData('c', b'c' * 100)
+        assert cache.get('b') is None and cache.getData('c') == b'c' * 100
+        # the index survives, entries are copies of the files put, and a changed entry is not used anymore
+        cache = DiskCache(self.tmpDir / 'cache', maxBytes=250)
+        with open(self.tmpDir / 'a', 'ab') as f:
+            f.write(b'a')
+        assert cache.getData('a') == b'a' * 100
+        with open(cache.get('a')[0], 'ab') as f:
+            f.write(b'a')
+        assert cache.get('a') is None and sorted(cache.index) == ['c']
+
+    def test_are_only_changed_images_encoded(self):
+        paths = []
+        for i in range(3):
+            paths.append(self.tmpDir / f'{i}.png')
+            Image.new('RGB', (60, 40), (i * 100, 0, 0)).save(paths[-1])
+        fragments = ImageFragments(DiskCache(self.tmpDir / 'cache', 1024 ** 2))
+        first = list(fragments.get(paths + [paths[0]]))
+        assert len(first) == 4 and first[0] == first[3] and len(fragments.cache.index) == 3
+
+        Image.new('RGB', (60, 40), (0, 0, 255)).save(paths[1])
+        # a file of the same size and modification time is taken as unchanged, without being read
+        stat = paths[2].stat()
+        paths[2].write_bytes(b'x' * stat.st_size)
+        os.utime(paths[2], ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        fragments = ImageFragments(DiskCache(self.tmpDir / 'cache', 1024 ** 2))
+        second = list(fragments.get(paths))
+        assert second[0] == first[0] and second[2] == first[2] and second[1] != first[1]
+        assert len(fragments.cache.index) == 4
+
+        merged = PDFMerger()
+        for data in second:
+            merged.appendJPEG(data)
+        merged.write(str(self.tmpDir / 'out.pdf'))
+        assert PdfFileReader(str(self.tmpDir / 'out.pdf')).getPage(1).mediaBox.getWidth() == 60
+
+    def test_is_manifest_saved_as_snapshot(self):
+        paths = []
+        for i in range(2):
+            paths.append(self.tmpDir / f'{i}.png')
+            Image.new('RGB', (60, 40), (i * 100, 0, 0)).save(paths[-1])
+        fragments = ImageFragments(DiskCache(self.tmpDir / 'cache', 1024 ** 2))
+        fragments.digest(paths[0])
+        dump = json.dump
+
+        def digestWhileDumping(obj, f):
+            # another job digests its files while the manifest is being written
+            thread = threading.Thread(target=fragments.digest, args=(paths[1],))
+            thread.start()
+            thread.join()
+            dump(obj, f)
+
+        with patch('engine.json.dump', digestWhileDumping):
+            fragments.save()
+        with open(self.tmpDir / 'cache' / ImageFragments.MANIFEST_NAME) as f:
+            assert list(json.load(f)) == [str(paths[0].resolve())]
+        assert len(fragments.manifest) == 2
+
+    def test_are_images_encoded_ahead_in_bounded_window(self):
+        paths = []
+        for i in range(10):
+            paths.append(self.tmpDir / f'{i}.png')
+            Image.new('RGB', (60, 40), (i * 20, 0, 0)).save(paths[-1])
+        cache = DiskCache(self.tmpDir / 'cache', 1024 ** 2)
+        fragments = ImageFragments(cache)
+        with patch.object(ImageFragments, 'PREFETCH', 2), patch.object(DiskCache, '_save', wraps=cache._save) as save:
+            images = fragments.get(paths, workers=1)
+            next(images)
+            assert len(cache.index) <= 3
+            images.close()
+            # the index is saved once with the manifest, not with every fragment
+            assert save.call_count == 1 and len(cache.index) <= 3
+            assert len(list(fragments.get(paths + paths[:1]))) == 11 and len(cache.index) == 10
+
+        # the images of a mixed merge are encoded in one pass
+        files = [paths[0], makeTestPDF(self.tmpDir / 'doc.pdf', 1), paths[1]]
+        with patch.object(ImageFragments, 'get', wraps=fragments.get) as get:
+            Job(files, self.jobOptions(files), self.tmpDir, fragments, customName='mixed').run()
+        assert get.call_count == 1 and PdfFileReader(str(self.tmpDir / 'mixed.pdf')).getNumPages() == 3
+
+    def jobOptions(self, files, **options) -> dict:
+        return dict({'images': False, 'items': [x.name for x in files], 'rotations': [0] * len(files),
+                     'maxDimension': None, 'maxImageDPI': None, 'compressionLevel': None, 'limits': None}, **options)
+
+    def test_is_job_of_renamed_files_reused(self):
+        files = [makeTestPDF(self.tmpDir / f'{i}.pdf', 2) for i in range(2)]
+        fragments = ImageFragments(DiskCache(self.tmpDir / 'fragments', 1024 ** 2))
+        outputCache = DiskCache(self.tmpDir / 'outputs', 1024 ** 2)
+        for name in ('a', 'b'):
+            files = [x.rename(x.with_name(f'{name}{x.name}')) for x in files]
+            options = self.jobOptions(files, items=[f'{x.name}[1]' for x in files])
+            Job(files, options, self.tmpDir, fragments, customName=name, reuse=True, outputCache=outputCache).run()
+        assert len(outputCache.index) == 1
+        assert (self.tmpDir / 'a.pdf').read_bytes() == (self.tmpDir / 'b.pdf').read_bytes()
+
+        # a different page selection gives a different job
+        options = self.jobOptions(files, items=[f'{x.name}[2]' for x in files])
+        Job(files, options, self.tmpDir, fragments, customName='c', reuse=True, outputCache=outputCache).run()
+        assert len(outputCache.index) == 2
+
+    def test_is_identical_split_job_reused(self):
+        files = [makeTestPDF(self.tmpDir / f'{i}.pdf', 3) for i in range(2)]
+        fragments = ImageFragments(DiskCache(self.tmpDir / 'fragments', 1024 ** 2))
+        outputCache = DiskCache(self.tmpDir / 'outputs', 1024 ** 2)
+        options = self.jobOptions(files, limits=(2, None))
+        first = Job(files, options, self.tmpDir, fragments, reuse=True, outputCache=outputCache).run()
+        # the parts named after the fingerprint are kept, others are copied from the cache
+        assert Job(files, options, self.tmpDir, fragments, reuse=True, outputCache=outputCache).run() == first
+        named = Job(files, options, self.tmpDir, fragments, customName='named', reuse=True,
+                    outputCache=outputCache).run()
+        assert len(first) == 3 and [x.name for x in named] == ['named_1.pdf', 'named_2.pdf', 'named_3.pdf']
+        assert [x.read_bytes() for x in named] == [x.read_bytes() for x in first]
+        for path in first:
+            path.unlink()
+        assert Job(files, options, self.tmpDir, fragments, reuse=True, outputCache=outputCache).run() == first
+        assert all(x.exists() for x in first)
+
+    def test_is_cancelled_job_cleaned_up(self):
+        files = [makeTestPDF(self.tmpDir / f'{i}.pdf', 3) for i in range(3)]
+        fragments = ImageFragments(DiskCache(self.tmpDir / 'fragments', 1024 ** 2))
+        original = (self.tmpDir / '0.pdf').read_bytes()
+        jobs = [
+            # checkpointed merge, cancelled after the first batch was written
+            Job(files, self.jobOptions(files), self.tmpDir, fragments, customName='merged',
+                checkpointDir=self.tmpDir / 'jobs', checkpointPages=3),
+            Job(files, self.jobOptions(files, limits=(2, None)), self.tmpDir, fragments, customName='split'),
+            Job(files[1:], self.jobOptions(files[1:]), self.tmpDir, fragments, customName='0', append=True),
+        ]
+        for job in jobs:
+            # the jobs are cancelled while their output is written
+            def progress(report, job=job):
+                if report.percent >= 60:
+                    job.control.cancel()
+            with self.assertRaises(JobCancelled), patch.object(ProgressTracker, 'INTERVAL', 0):
+                job.run(progress)
+        assert sorted(x.name for x in self.tmpDir.iterdir()) == ['0.pdf', '1.pdf', '2.pdf', 'fragments', 'jobs']
+        assert not list((self.tmpDir / 'jobs').iterdir())
+        assert (self.tmpDir / '0.pdf').read_bytes() == original
+
+    def test_is_failed_job_cleaned_up(self):
+        files = [makeTestPDF(self.tmpDir / f'{i}.pdf', 3) for i in range(2)]
+        image = self.tmpDir / 'image.png'
+        Image.new('RGB', (60, 40)).save(image)
+        fragments = ImageFragments(DiskCache(self.tmpDir / 'fragments', 1024 ** 2))
+        opened = []
+
+        def recordOpen(*args, **kwargs):
+            opened.append(open(*args, **kwargs))
+            return opened[-1]
+
+        for job in (Job(files, self.jobOptions(files), self.tmpDir, fragments, customName='merged'),
+                    Job([image], self.jobOptions([image], images=True), self.tmpDir, fragments, customName='image'),
+                    Job(files, self.jobOptions(files), self.tmpDir, fragments, customName='checkpointed',
+                        checkpointDir=self.tmpDir / 'jobs')):
+            # the jobs fail while their output is written
+            def progress(report):
+                if report.percent >= 60:
+                    raise OSError('No space left on device')
+            with self.assertRaises(OSError), patch('jobs.open', recordOpen, create=True), \
+                    patch('engine.open', recordOpen, create=True), patch.object(ProgressTracker, 'INTERVAL', 0):
+                job.run(progress)
+        # the outputs (and the partial file of the checkpointed job) are opened by the jobs, which close them
+        assert any(str(x.name).endswith('.part') for x in opened) and all(x.closed for x in opened)
+        assert sorted(x.name for x in self.tmpDir.iterdir() if x.name != 'jobs') == ['0.pdf', '1.pdf', 'fragments',
+                                                                                     'image.png']
+        assert not list((self.tmpDir / 'jobs').glob('*'))
+
+    def test_is_paused_job_resumed(self):
+        files = [makeTestPDF(self.tmpDir / f'{i}.pdf', 2) for i in range(2)]
+        fragments = ImageFragments(DiskCache(self.tmpDir / 'fragments', 1024 ** 2))
+        job = Job(files, self.jobOptions(files), self.tmpDir, fragments, customName='merged')
+        paused = threading.Event()
+
+        def progress(report):
+            if report.percent < 50:
+                job.control.pause()
+                paused.set()
+        thread = threading.Thread(target=job.run, args=(progress,))
+        thread.start()
+        assert paused.wait(10)
+        thread.join(0.2)
+        assert thread.is_alive() and not (self.tmpDir / 'merged.pdf').exists()
+        job.control.resume()
+        thread.join(10)
+        assert PdfFileReader(str(self.tmpDir / 'merged.pdf')).getNumPages() == 4
+
+    def test_is_progress_weighted_by_size(self):
+        files = [makeTestPDF(self.tmpDir / 'small.pdf', 1), makeTestPDF(self.tmpDir / 'big.pdf', 40,
+                                                                          content=os.urandom(20000))]
+        fragments = ImageFragments(DiskCache(self.tmpDir / 'fragments', 1024 ** 2))
+        job = Job(files, self.jobOptions(files), self.tmpDir, fragments, customName='merged')
+        reports = []
+        with patch.object(ProgressTracker, 'INTERVAL', 0):
+            job.run(reports.append)
+        percents = [x.percent for x in reports]
+        assert percents == sorted(percents) and percents[-1] == 100
+        # the small file is a tiny part of the work, and the output is reported while it is written
+        assert reports[0].pages == 1 and reports[0].percent < 10
+        assert any(50 < x < 100 for x in percents) and reports[-1].pages == 41
+
+        # reports sent in quick succession are coalesced
+        reports = []
+        tracker = ProgressTracker(reports.append, 1000)
+        for _ in range(1000):
+            tracker.advance(1, pages=1)
+        tracker.finish()
+        assert len(reports) < 10 and reports[-1].percent == 100 and reports[-1].pages == 1000
+
+    def test_are_names_sorted_naturally(self):
+        names = ['scan10.png', 'Scan2.png', 'scan1.png', 'a.pdf', 'scan2.png[10]', 'scan2.png[9]']
+        assert sorted(names, key=naturalKey) == ['a.pdf', 'scan1.png', 'Scan2.png', 'scan2.png[9]', 'scan2.png[10]',
+                                                 'scan10.png']
+
+    def test_are_thumbnails_made_in_background_and_cached(self):
+        image = self.tmpDir / 'photo.jpg'
+        Image.new('RGB', (1200, 800), (200, 30, 30)).save(image)
+        scan = self.tmpDir / 'scan.pdf'
+        merged = PDFMerger()
+        merged.appendImage(Image.new('RGB', (300, 600), (30, 30, 200)))
+        with open(scan, 'wb') as f:
+            merged.write(f)
+        drawing = makeTestPDF(self.tmpDir / 'drawing.pdf', 1)
+        with Image.open(BytesIO(makeThumbnail(image, 48))) as thumbnail:
+            assert thumbnail.size == (48, 32)
+        with Image.open(BytesIO(makeThumbnail(scan, 48))) as thumbnail:
+            assert thumbnail.size == (24, 48)
+        assert makeThumbnail(drawing, 48) is None
+
+        model = FilesModel()
+        thumbnails = Thumbnails(self.tmpDir / 'thumbnails', 1024 ** 2)
+        model.setThumbnails(thumbnails)
+        model.appendPaths([image, scan, drawing])
+        updates = []
+        model.dataChanged.connect(lambda first, last, roles: updates.append(roles))
+        icons = [model.data(model.index(i), Qt.DecorationRole) for i in range(3)]
+        assert all(x is thumbnails.placeholder for x in icons)
+        for future in list(thumbnails.pending.values()):
+            future.result()
+        app.processEvents()
+        assert updates and all(x == [Qt.DecorationRole] for x in updates) and not thumbnails.pending
+        icons = [model.data(model.index(i), Qt.DecorationRole) for i in range(3)]
+        assert icons[0].availableSizes() == [QSize(48, 32)] and icons[2] is thumbnails.placeholder
+        model.setData(model.index(1), 90, FilesModel.ROTATION_ROLE)
+        assert model.data(model.index(1), Qt.DecorationRole).availableSizes() == [QSize(48, 24)]
+        thumbnails.close()
+
+        # thumbnails made before are read from the cache on disk
+        thumbnails = Thumbnails(self.tmpDir / 'thumbnails', 1024 ** 2)
+        with patch('models.makeThumbnail', side_effect=AssertionError):
+            assert thumbnails.get(image) is None
+            thumbnails.pending[(image, 0)].result()
+            app.processEvents()
+            assert thumbnails.get(image).availableSizes() == [QSize(48, 32)]
+        thumbnails.close()